@@ -1,17 +1,23 @@
 import streamlit as st
 import google.generativeai as genai
 from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
-import json
-import random
-import time
 from datetime import datetime
+import json
 import os
-from jinja2 import Template
-import re
-import shutil
-import zipfile
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import generator
+from cache import CACHE_MODES, get_image_cache, get_response_cache
+from export import INDEX_PAGE_SIZE, SiteExport, zip_directory
+from generator import TITLE_BATCH_SIZE, build_routed_model
+from journal import JobJournal
+from key_pool import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE, KeyPool
+from metrics import start_run
+from pipeline import DEFAULT_MAX_WORKERS
+from postprocess import DEFAULT_PROCESS_WORKERS
+from routing import DEFAULT_ROUTES, load_routes
+from store import ArticleStore, build_site
+from utils import load_api_keys
 
 # Load environment variables
 load_dotenv()
@@ -23,384 +29,109 @@ st.set_page_config(
     layout="wide"
 )
 
-# Load blog template
-with open('templates/blog_template.html', 'r') as f:
-    BLOG_TEMPLATE = Template(f.read())
-
-def generate_engaging_title(model, topic):
-    """Generate a professional and SEO-optimized title"""
-    title_prompt = f"""
-    Create one SEO-optimized title about: {topic}
-
-    Requirements:
-    - Include primary keyword naturally
-    - 50-60 characters (optimal for search engines)
-    - Use power words that drive clicks
-    - Include numbers or specific benefits when relevant
-    - Match search intent
-    - Avoid clickbait while maintaining interest
-    
-    Return only the optimized title, no additional text.
-    """
-    
-    generation_config = {
-        "temperature": 0.8,
-        "top_p": 0.95,
-        "top_k": 64,
-    }
-    
-    response = model.generate_content(title_prompt, generation_config=generation_config)
-    return response.text.strip().replace('"', '').replace('#', '').strip()
+@st.cache_resource
+def get_journal():
+    """Open the job journal once and share it between sessions"""
+    return JobJournal()
 
-def generate_meta_description(model, topic, title):
-    """Generate an SEO-optimized meta description"""
-    meta_prompt = f"""
-    Create a compelling meta description for an article about {topic} with title: {title}
+@st.cache_resource
+def get_store():
+    """Open the article store once and share it between sessions"""
+    return ArticleStore()
 
-    Requirements:
-    - 150-160 characters long
-    - Include primary keyword naturally
-    - Clear value proposition
-    - Call-to-action
-    - Match search intent
-    
-    Return only the meta description, no additional text.
-    """
-    
-    generation_config = {
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 64,
-    }
-    
-    response = model.generate_content(meta_prompt, generation_config=generation_config)
-    return response.text.strip()
+def with_script_ctx():
+    """Return a thread initializer that attaches the current Streamlit script context"""
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
 
-def generate_article_content(model, topic, title):
-    """Generate comprehensive article content in HTML format"""
-    content_prompt = f"""
-    Write a comprehensive, SEO-optimized article about: {topic}
-    Title: {title}
-    
-    Requirements:
-    - 2000-3000 words
-    - Return the content in clean HTML format using these tags:
-      - <h2> for main sections
-      - <h3> for subsections
-      - <p> for paragraphs
-      - <ul> and <li> for unordered lists
-      - <ol> and <li> for ordered lists
-      - <strong> for emphasis
-      - <em> for italics
-      - <blockquote> for quotes
-    - Include relevant statistics and examples
-    - Make content visually appealing with proper spacing
-    - Include a strong introduction and conclusion
-    - Add calls-to-action where appropriate
-    - Use proper HTML structure
-    - NO markdown formatting
-    
-    Return ONLY the HTML content, no additional text or formatting.
-    """
-    
-    generation_config = {
-        "temperature": 0.8,
-        "top_p": 0.95,
-        "top_k": 64,
-    }
-    
-    response = model.generate_content(content_prompt, generation_config=generation_config)
-    return response.text
+def process_bulk_topics(topics, key_pool, max_workers=DEFAULT_MAX_WORKERS, cache_mode="use", stream=False, export=None,
+                        journal=None, job_id=None, mirror_images=False, postprocess_workers=DEFAULT_PROCESS_WORKERS,
+                        title_batch_size=TITLE_BATCH_SIZE, store=None):
+    """Process multiple topics concurrently and generate articles, reporting progress on the page"""
+    if job_id is None:
+        total = len([topic for topic in topics if topic.strip()])
+    else:
+        total = len(journal.topics(job_id))
+    progress = st.progress(0.0, text=f"Generating {total} articles with {max_workers} workers...")
+    preview = st.empty() if stream else None
+    finished = []
 
-def clean_filename(title):
-    """Convert title to URL-friendly slug"""
-    title = title.lower()
-    title = re.sub(r'[^a-z0-9\s-]', '', title)
-    title = re.sub(r'[-\s]+', '-', title)
-    return title.strip('-')
+    def on_result(index, topic, article, error):
+        finished.append(index)
+        if error is not None:
+            st.error(f"Error processing topic '{topic}': {str(error)}")
+        progress.progress(len(finished) / total, text=f"Generated {len(finished)}/{total}: {topic}")
 
-def search_bing_images(query, num_images=15):
-    """Search for images using Bing"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        search_url = f'https://www.bing.com/images/search?q={query}&form=HDRSC2'
-        response = requests.get(search_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        images = []
-        for img in soup.find_all('a', class_='iusc'):
-            try:
-                m = json.loads(img['m'])
-                images.append({
-                    'url': m['murl'],
-                    'title': m.get('t', 'Image')
-                })
-            except:
-                continue
-            
-            if len(images) >= num_images:
-                break
-        
-        return images
-    except Exception as e:
-        st.error(f"Error searching images: {str(e)}")
-        return []
+    def on_preview(title, text):
+        preview.markdown(f"**✍️ {title}**\n\n{text}", unsafe_allow_html=True)
 
-def format_content_with_images(content, images, title, meta_description):
-    """Format content with images interspersed"""
-    # Split content into sections (assuming they're separated by </h2> tags)
-    sections = content.split('</h2>')
-    formatted_content = []
-    
-    # Add meta description
-    formatted_content.append(f'<div class="meta-description">{meta_description}</div>')
-    
-    # Add featured image
-    if images:
-        formatted_content.append(f'<div class="featured-image-container"><img src="{images[0]["url"]}" alt="{title}" class="featured-image"></div>')
-    
-    # Intersperse content with images
-    image_index = 1
-    for i, section in enumerate(sections):
-        if i == 0:  # First section
-            formatted_content.append(section + '</h2>' if i < len(sections)-1 else section)
-        else:
-            formatted_content.append(section + '</h2>' if i < len(sections)-1 else section)
-            
-            # Add an image after every other section
-            if i % 2 == 0 and image_index < len(images):
-                formatted_content.append(
-                    f'<div class="content-image-container">'
-                    f'<img src="{images[image_index]["url"]}" alt="{images[image_index]["title"]}" class="content-image">'
-                    f'<p class="image-caption">{images[image_index]["title"]}</p>'
-                    f'</div>'
-                )
-                image_index += 1
-    
-    return '\n'.join(formatted_content)
-
-def generate_blog_html(title, content, meta_description, images, site_name="My Blog", site_description="", all_articles=None):
-    """Generate complete blog HTML using the template"""
-    featured_image = images[0]["url"] if images else ""
-    read_time = len(content.split()) // 200  # Assuming 200 words per minute reading speed
-    
-    # Format content with images
-    content_with_images = format_content_with_images(content, images, title, meta_description)
-    
-    # Generate related articles from actual articles
-    related_articles = []
-    if all_articles:
-        # Filter out current article and get up to 2 random articles
-        other_articles = [a for a in all_articles if a["title"] != title]
-        selected_articles = random.sample(other_articles, min(2, len(other_articles)))
-        
-        for article in selected_articles:
-            related_articles.append({
-                "title": article["title"],
-                "url": article["filename"],
-                "image": images[1]["url"] if len(images) > 1 else "",
-                "excerpt": meta_description[:100] + "..."
-            })
-    
-    # If we don't have enough related articles, pad with placeholders
-    while len(related_articles) < 2:
-        related_articles.append({
-            "title": "Explore More Articles",
-            "url": "/",
-            "image": images[-1]["url"] if images else "",
-            "excerpt": "Discover more interesting articles on our site"
-        })
-    
-    # Render template
-    html = BLOG_TEMPLATE.render(
-        title=title,
-        content=content_with_images,
-        meta_description=meta_description,
-        featured_image=featured_image,
-        date=datetime.now().strftime("%B %d, %Y"),
-        read_time=read_time,
-        site_name=site_name,
-        site_description=site_description,
-        year=datetime.now().year,
-        related_articles=related_articles
+    generated_articles, stats = generator.process_bulk_topics(
+        topics,
+        build_routed_model(key_pool, st.session_state.routes, cache_mode, st.session_state.model),
+        site_name=st.session_state.get('site_name', 'My Blog'),
+        site_description=st.session_state.get('site_description', ''),
+        max_workers=max_workers,
+        stream=stream,
+        on_preview=on_preview if stream else None,
+        export=export,
+        journal=journal,
+        job_id=job_id,
+        on_result=on_result,
+        mirror_images=mirror_images,
+        postprocess_workers=postprocess_workers,
+        title_batch_size=title_batch_size,
+        store=store,
+        # Worker threads need the script context to be able to write to the page
+        initializer=with_script_ctx()
     )
-    
-    return html
-
-def create_github_export(articles, site_name, site_description):
-    """Create a GitHub-ready export of the blog"""
-    # Create temporary directory for export
-    export_dir = "github_export"
-    if os.path.exists(export_dir):
-        shutil.rmtree(export_dir)
-    os.makedirs(export_dir)
-    
-    # Copy template assets
-    os.makedirs(os.path.join(export_dir, 'templates'))
-    shutil.copy('templates/blog_template.html', os.path.join(export_dir, 'templates'))
-    
-    # Create articles directory
-    articles_dir = os.path.join(export_dir, 'articles')
-    os.makedirs(articles_dir)
-    
-    # Save articles
-    for article in articles:
-        filepath = os.path.join(articles_dir, article["filename"])
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(article["html"])
-    
-    # Create index.html
-    index_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <title>{site_name}</title>
-        <meta name="description" content="{site_description}">
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-    </head>
-    <body class="bg-gray-50">
-        <header class="bg-white shadow-lg py-6">
-            <div class="max-w-7xl mx-auto px-4">
-                <h1 class="text-3xl font-bold text-gray-900">{site_name}</h1>
-                <p class="mt-2 text-gray-600">{site_description}</p>
-            </div>
-        </header>
-        
-        <main class="max-w-7xl mx-auto px-4 py-12">
-            <div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-8">
-    """
-    
-    # Add article cards to index
-    for article in articles:
-        index_content += f"""
-                <a href="articles/{article['filename']}" class="block">
-                    <div class="bg-white rounded-lg shadow-md overflow-hidden hover:shadow-xl transition-shadow">
-                        <div class="p-6">
-                            <h2 class="text-xl font-semibold mb-2">{article['title']}</h2>
-                            <p class="text-gray-600">Click to read more...</p>
-                        </div>
-                    </div>
-                </a>
-        """
-    
-    index_content += """
-            </div>
-        </main>
-        
-        <footer class="bg-gray-800 text-white py-8 mt-12">
-            <div class="max-w-7xl mx-auto px-4 text-center">
-                <p>&copy; 2024 All rights reserved.</p>
-            </div>
-        </footer>
-    </body>
-    </html>
-    """
-    
-    with open(os.path.join(export_dir, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(index_content)
-    
-    # Create README.md
-    readme_content = f"""# {site_name}
+    progress.empty()
+    if preview is not None:
+        preview.empty()
 
-A collection of SEO-optimized blog articles generated with AI.
-
-## Articles
-
-{chr(10).join(f'- [{article["title"]}](articles/{article["filename"]})' for article in articles)}
-
-## About
-
-{site_description}
-
-## Setup
-
-1. Clone this repository
-2. Open index.html in your browser
-3. Deploy to GitHub Pages for online access
-
-## License
-
-MIT
-"""
-    
-    with open(os.path.join(export_dir, 'README.md'), 'w', encoding='utf-8') as f:
-        f.write(readme_content)
-    
-    # Create zip file
-    shutil.make_archive(export_dir, 'zip', export_dir)
-    
-    return f"{export_dir}.zip"
-
-def process_bulk_topics(topics):
-    """Process multiple topics and generate articles"""
-    generated_articles = []
-    
-    for topic in topics:
-        topic = topic.strip()
-        if not topic:
-            continue
-            
-        try:
-            with st.spinner(f"Generating article for: {topic}"):
-                # Generate content
-                model = genai.GenerativeModel(model_name=st.session_state.model)
-                title = generate_engaging_title(model, topic)
-                meta_description = generate_meta_description(model, topic, title)
-                content = generate_article_content(model, topic, title)
-                
-                # Search for images
-                images = search_bing_images(topic)
-                
-                # Generate HTML with access to all previously generated articles
-                html = generate_blog_html(
-                    title=title,
-                    content=content,
-                    meta_description=meta_description,
-                    images=images,
-                    site_name=st.session_state.get('site_name', 'My Blog'),
-                    site_description=st.session_state.get('site_description', ''),
-                    all_articles=generated_articles  # Pass existing articles
-                )
-                
-                # Create filename
-                filename = f"{clean_filename(title)}.html"
-                
-                generated_articles.append({
-                    "title": title,
-                    "filename": filename,
-                    "html": html,
-                    "meta_description": meta_description,
-                    "content": content  # Store the content for regenerating HTML later
-                })
-            
-        except Exception as e:
-            st.error(f"Error processing topic '{topic}': {str(e)}")
-    
-    # After all articles are generated, update their related articles sections
-    for i, article in enumerate(generated_articles):
-        # Regenerate HTML with access to all articles
-        html = generate_blog_html(
-            title=article["title"],
-            content=article["content"],
-            meta_description=article["meta_description"],
-            images=search_bing_images(article["title"]),  # Re-fetch images if needed
-            site_name=st.session_state.get('site_name', 'My Blog'),
-            site_description=st.session_state.get('site_description', ''),
-            all_articles=generated_articles
-        )
-        generated_articles[i]["html"] = html
-    
+    st.info(
+        f"⏱️ {stats['completed']} articles in {stats['elapsed']:.1f}s "
+        f"({stats['articles_per_minute']:.1f} articles/min, {stats['failed']} failed)"
+    )
     return generated_articles
 
+def show_run_metrics(run):
+    """Show the per-stage metrics of a run with JSON and Prometheus downloads"""
+    stages = run.to_dict()["stages"]
+    with st.expander("📊 Run metrics"):
+        st.table([
+            {
+                "stage": name,
+                "calls": stage["calls"],
+                "failures": stage["failures"],
+                "retries": stage["retries"],
+                "p50 (s)": stage["seconds_p50"],
+                "p95 (s)": stage["seconds_p95"],
+                "prompt tokens": stage["prompt_tokens"],
+                "output tokens": stage["output_tokens"],
+                "models": ", ".join(f"{name} ({calls})" for name, calls in stage["models"].items()),
+                "fallbacks": stage["fallbacks"],
+                "cost ($)": round(stage["cost_usd"], 4),
+            }
+            for name, stage in stages.items()
+        ])
+        st.download_button("Download JSON", data=run.to_json(), file_name="metrics.json", mime="application/json")
+        st.download_button("Download Prometheus", data=run.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+
 # Initialize session state
 if 'api_key' not in st.session_state:
     st.session_state.api_key = ''
 if 'model' not in st.session_state:
     st.session_state.model = 'gemini-1.5-pro'
+if 'max_workers' not in st.session_state:
+    st.session_state.max_workers = DEFAULT_MAX_WORKERS
+if 'requests_per_minute' not in st.session_state:
+    st.session_state.requests_per_minute = DEFAULT_REQUESTS_PER_MINUTE
+if 'tokens_per_minute' not in st.session_state:
+    st.session_state.tokens_per_minute = DEFAULT_TOKENS_PER_MINUTE
+if 'page_size' not in st.session_state:
+    st.session_state.page_size = INDEX_PAGE_SIZE
+if 'routes' not in st.session_state:
+    st.session_state.routes = DEFAULT_ROUTES
 
 # Main UI
 st.markdown('<div class="main-title">SEO-Optimized Blog Generator</div>', unsafe_allow_html=True)
@@ -410,9 +141,10 @@ with st.sidebar:
     st.markdown("### Configuration")
     
     api_key = st.text_input(
-        "Enter your Gemini API key:",
+        "Enter your Gemini API key(s):",
         type="password",
-        value=st.session_state.get('api_key', '')
+        value=st.session_state.get('api_key', ''),
+        help="Separate several keys with commas. Keys from apikey.txt and GEMINI_API_KEY in .env are added automatically."
     )
     
     site_name = st.text_input(
@@ -425,14 +157,72 @@ with st.sidebar:
         value=st.session_state.get('site_description', '')
     )
     
+    site_url = st.text_input(
+        "Site URL:",
+        value=st.session_state.get('site_url', ''),
+        help="Where the site will be published, e.g. https://you.github.io/blog. Needed for sitemap.xml and feed.xml."
+    )
+    
+    page_size = st.number_input(
+        "Articles per index page:",
+        min_value=1,
+        value=st.session_state.page_size
+    )
+    
+    max_workers = st.number_input(
+        "Concurrent workers:",
+        min_value=1,
+        max_value=32,
+        value=st.session_state.max_workers,
+        help="Number of topics generated at the same time"
+    )
+    
+    requests_per_minute = st.number_input(
+        "Requests per minute per key:",
+        min_value=1,
+        value=st.session_state.requests_per_minute
+    )
+    
+    tokens_per_minute = st.number_input(
+        "Tokens per minute per key:",
+        min_value=1000,
+        step=1000,
+        value=st.session_state.tokens_per_minute
+    )
+    
+    routes = st.text_area(
+        "Model routes (JSON):",
+        value=json.dumps(st.session_state.routes, indent=2),
+        height=200,
+        help="Models tried in order for each stage: the next one takes over on quota errors and timeouts. "
+             "Each tier may also set a generation_config and a timeout in seconds."
+    )
+    
     if st.button("Save Configuration"):
-        if api_key:
+        keys = [key.strip() for key in api_key.split(',') if key.strip()] + load_api_keys()
+        try:
+            routes = load_routes(routes, st.session_state.model)
+        except ValueError as e:
+            st.error(str(e))
+            keys = None
+        if keys:
             st.session_state.api_key = api_key
             st.session_state.site_name = site_name
             st.session_state.site_description = site_description
-            genai.configure(api_key=api_key)
-            st.success("Configuration saved successfully!")
-        else:
+            st.session_state.site_url = site_url.strip()
+            st.session_state.page_size = int(page_size)
+            st.session_state.max_workers = int(max_workers)
+            st.session_state.requests_per_minute = int(requests_per_minute)
+            st.session_state.tokens_per_minute = int(tokens_per_minute)
+            st.session_state.routes = routes
+            st.session_state.key_pool = KeyPool(
+                keys,
+                requests_per_minute=st.session_state.requests_per_minute,
+                tokens_per_minute=st.session_state.tokens_per_minute
+            )
+            genai.configure(api_key=keys[0])
+            st.success(f"Configuration saved successfully with {len(st.session_state.key_pool.keys)} API key(s)!")
+        elif keys is not None:
             st.error("Please enter an API key.")
 
 # Main content area
@@ -445,43 +235,178 @@ topics_text = st.text_area(
     placeholder="Enter your topics here, one per line..."
 )
 
+cache_mode = st.radio(
+    "Response cache:",
+    CACHE_MODES,
+    format_func=lambda mode: {
+        "use": "Use cached responses",
+        "refresh": "Refresh (regenerate and update cache)",
+        "bypass": "Bypass (don't read or write cache)"
+    }[mode],
+    horizontal=True
+)
+
+stream = st.checkbox(
+    "Stream article content",
+    help="Show articles as they are written and retry requests that are slow to start or stall"
+)
+
+mirror_images = st.checkbox(
+    "Mirror images into the site",
+    help="Download the images into assets/ as resized WebP and JPEG variants instead of linking them (needs Pillow)"
+)
+
+optimize_export = st.checkbox(
+    "Optimize the export",
+    help="Shared hashed CSS/JS files, minified pages and precompressed .gz/.br files for static hosts"
+)
+
+use_store = st.checkbox(
+    "Keep articles in the local store",
+    help="Add the articles to the local article store and download the site of every stored article. "
+         "Only the pages that changed since the last build are rendered again."
+)
+
+render_processes = st.number_input(
+    "Rendering processes:",
+    min_value=0,
+    max_value=os.cpu_count() or 1,
+    value=DEFAULT_PROCESS_WORKERS,
+    help="Format and render the pages on this many worker processes, off the app's own process. "
+         "0 renders them here, which is faster for small batches."
+)
+
+title_batch_size = st.number_input(
+    "Topics per title call:",
+    min_value=0,
+    max_value=50,
+    value=TITLE_BATCH_SIZE,
+    help="Ask for the titles and meta descriptions of this many topics in one call. "
+         "Answers that fail validation are asked for topic by topic; 0 asks for every topic separately."
+)
+
+def run_generation(topics, job_id=None):
+    """Generate the articles for a new or resumed job and offer the export for download"""
+    run = start_run()
+    store = get_store() if use_store else None
+    export = None
+    if store is None:
+        export = SiteExport(
+            st.session_state.get('site_name', 'My Blog'),
+            st.session_state.get('site_description', ''),
+            optimize=optimize_export,
+            site_url=st.session_state.get('site_url') or None,
+            page_size=st.session_state.page_size
+        )
+    articles = process_bulk_topics(
+        topics,
+        st.session_state.key_pool,
+        max_workers=st.session_state.max_workers,
+        cache_mode=cache_mode,
+        stream=stream,
+        mirror_images=mirror_images,
+        postprocess_workers=int(render_processes),
+        title_batch_size=int(title_batch_size),
+        export=export,
+        store=store,
+        journal=get_journal(),
+        job_id=job_id
+    )
+    if store is not None:
+        # Rebuild the store's site with the new articles and archive all of it. Every site settings get
+        # their own directory, and sessions building the same one wait for each other
+        settings = (
+            st.session_state.get('site_name', 'My Blog'),
+            st.session_state.get('site_description', ''),
+            optimize_export,
+            st.session_state.get('site_url') or None,
+            st.session_state.page_size,
+        )
+        directory = store.site_directory(*settings)
+        with store.site_lock(directory):
+            built = build_site(
+                store, settings[0], settings[1], directory, optimize=settings[2], site_url=settings[3],
+                page_size=settings[4], render_workers=int(render_processes)
+            )
+            export_file = zip_directory(directory)
+    else:
+        # Finish the GitHub-ready archive the articles were written into
+        export_file = export.close()
+    show_run_metrics(run)
+    if store is not None:
+        st.caption(f"🗄️ Site of {built['articles']} stored articles: {built['rendered']} pages rendered, {built['kept']} kept")
+        for failure in built['failed']:
+            st.error(f"Page of {failure['filename']} could not be rendered: {failure['error']}")
+    elif optimize_export:
+        st.caption(f"📉 Site size: {export.size_summary()}")
+    
+    if articles:
+        # Provide download link
+        st.download_button(
+            label="📦 Download GitHub-ready package",
+            data=export_file.read(),
+            file_name="blog_export.zip",
+            mime="application/zip"
+        )
+        
+        st.success(f"""
+        ✅ Generated {len(articles)} articles successfully!
+        
+        To deploy to GitHub:
+        1. Download the zip file
+        2. Extract the contents
+        3. Create a new GitHub repository
+        4. Upload the extracted files
+        5. Enable GitHub Pages in repository settings
+        """)
+
 if st.button("Generate Articles"):
-    if not st.session_state.get('api_key'):
+    if 'key_pool' not in st.session_state:
         st.error("Please configure your API key in the sidebar first.")
     elif not topics_text:
         st.error("Please enter at least one topic.")
     else:
-        topics = topics_text.split('\n')
-        
         # Process topics and generate articles
-        articles = process_bulk_topics(topics)
-        
-        if articles:
-            # Create GitHub-ready export
-            export_file = create_github_export(
-                articles,
-                st.session_state.get('site_name', 'My Blog'),
-                st.session_state.get('site_description', '')
+        run_generation(topics_text.split('\n'))
+
+unfinished_jobs = get_journal().unfinished_jobs()
+if unfinished_jobs:
+    with st.expander(f"♻️ Resume an unfinished job ({len(unfinished_jobs)})"):
+        job = st.selectbox(
+            "Job:",
+            unfinished_jobs,
+            format_func=lambda job: (
+                f"{datetime.fromtimestamp(job['created']).strftime('%Y-%m-%d %H:%M')} · "
+                f"{job['written']}/{job['total']} written · {job['failed']} failed"
             )
-            
-            # Provide download link
-            with open(export_file, 'rb') as f:
-                st.download_button(
-                    label="📦 Download GitHub-ready package",
-                    data=f,
-                    file_name="blog_export.zip",
-                    mime="application/zip"
-                )
-            
-            st.success(f"""
-            ✅ Generated {len(articles)} articles successfully!
-            
-            To deploy to GitHub:
-            1. Download the zip file
-            2. Extract the contents
-            3. Create a new GitHub repository
-            4. Upload the extracted files
-            5. Enable GitHub Pages in repository settings
-            """)
+        )
+        resume_column, dismiss_column = st.columns(2)
+        if resume_column.button("Resume Job"):
+            if 'key_pool' not in st.session_state:
+                st.error("Please configure your API key in the sidebar first.")
+            else:
+                run_generation([], job_id=job['id'])
+        if dismiss_column.button("Dismiss Job", help="Remove the job from this list; its failed topics are not retried"):
+            get_journal().dismiss_job(job['id'])
+            st.rerun()
 
 st.markdown('</div>', unsafe_allow_html=True)
+
+with st.sidebar:
+    image_cache_stats = get_image_cache().stats()
+    st.caption(
+        f"🖼️ Image cache: {image_cache_stats['hits']} hits · "
+        f"{image_cache_stats['misses']} misses · {image_cache_stats['entries']} queries stored"
+    )
+    response_cache_stats = get_response_cache().stats()
+    st.caption(
+        f"💬 Response cache: {response_cache_stats['hits']} hits · "
+        f"{response_cache_stats['misses']} misses · {response_cache_stats['bytes'] / 1024 / 1024:.1f} MB stored"
+    )
+    if 'key_pool' in st.session_state:
+        pool_stats = st.session_state.key_pool.stats()
+        cooling_down = sum(1 for key in pool_stats['keys'] if key['cooling_down'])
+        st.caption(
+            f"🔑 {len(pool_stats['keys'])} keys · {cooling_down} cooling down · "
+            f"concurrency limit {pool_stats['concurrency_limit']}"
+        )
@@ -0,0 +1,268 @@
+"""Shared static assets, minification and precompression for exported sites
+
+The page CSS and JS live in static/. An optimized export bundles them into
+content-hashed files under static/ of the site, so browsers can cache them
+forever, minifies every page and writes .gz (and, with the optional brotli
+package, .br) siblings for static hosts to serve as they are.
+
+Tailwind is vendored into the site stylesheet when it can be downloaded,
+purged to the classes the templates and page markup actually use the same
+way Tailwind's own purge works: any token in the sources that looks like a
+class keeps its rules.
+"""
+import functools
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import re
+
+from cache import CACHE_DIR
+from fetch import fetch
+from rendering import STATIC_DIR, TEMPLATES_DIR
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TAILWIND_URL = 'https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css'
+TAILWIND_CACHE_PATH = os.path.join(CACHE_DIR, 'tailwind-2.2.19.min.css')
+
+# Everything that can put a class attribute on a page
+MARKUP_SOURCES = (
+    os.path.join(TEMPLATES_DIR, '*.html'),
+    os.path.join(STATIC_DIR, '*.js'),
+    os.path.join(BASE_DIR, 'generator.py'),
+    os.path.join(BASE_DIR, 'images.py'),
+    os.path.join(BASE_DIR, 'utils.py'),
+)
+
+# Bundle name -> source files in static/; 'tailwind' is the purged Tailwind build
+BUNDLES = {
+    'site.css': ('tailwind', 'blog.css'),
+    'pinterest.css': ('pinterest.css',),
+    'slideshow.js': ('slideshow.js',),
+    'search.js': ('search.js',),
+}
+
+# Files worth precompressing; images and fonts are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.xml', '.json', '.txt', '.svg')
+MIN_COMPRESS_SIZE = 256
+BROTLI_QUALITY = 11
+
+
+@functools.lru_cache(maxsize=None)
+def load_tailwind():
+    """Return the Tailwind build, downloading it once into the cache, or None when it can't be had
+
+    A failed download is not retried until the process restarts.
+    """
+    if os.path.exists(TAILWIND_CACHE_PATH):
+        with open(TAILWIND_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return f.read()
+    try:
+        css = fetch(TAILWIND_URL).text
+    except Exception as e:
+        logger.warning("Could not download Tailwind, pages keep using the CDN: %s", e)
+        return None
+    os.makedirs(os.path.dirname(TAILWIND_CACHE_PATH), exist_ok=True)
+    with open(TAILWIND_CACHE_PATH, 'w', encoding='utf-8') as f:
+        f.write(css)
+    return css
+
+
+def used_classes(sources=MARKUP_SOURCES):
+    """Every class-like token in the markup sources"""
+    tokens = set()
+    for pattern in sources:
+        for path in glob.glob(pattern):
+            with open(path, 'r', encoding='utf-8') as f:
+                tokens.update(re.findall(r'[^<>"\'`\s=]*[^<>"\'`\s=:]', f.read()))
+    return tokens
+
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+def _blocks(css):
+    """Split CSS into top-level (prelude, body) pairs; body is None for statements like @charset"""
+    blocks = []
+    position = 0
+    while position < len(css):
+        position = _WHITESPACE.match(css, position).end()
+        brace = css.find('{', position)
+        if brace == -1:
+            break
+        if not css.startswith('@', position):
+            # Plain rules have no nested blocks
+            end = css.find('}', brace)
+            end = len(css) if end == -1 else end
+            blocks.append((css[position:brace].strip(), css[brace + 1:end]))
+            position = end + 1
+            continue
+
+        semicolon = css.find(';', position)
+        if semicolon != -1 and semicolon < brace:
+            blocks.append((css[position:semicolon + 1].strip(), None))
+            position = semicolon + 1
+            continue
+        depth = 0
+        for end in range(brace, len(css)):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+        blocks.append((css[position:brace].strip(), css[brace + 1:end]))
+        position = end + 1
+    return blocks
+
+
+def _selector_classes(selector):
+    return [re.sub(r'\\(.)', r'\1', name) for name in re.findall(r'\.((?:\\.|[\w-])+)', selector)]
+
+
+def purge_css(css, classes):
+    """Drop every rule none of whose selectors can match the given classes"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    kept = []
+    for prelude, body in _blocks(css):
+        if body is None:
+            kept.append(prelude)
+        elif prelude.startswith(('@media', '@supports')):
+            inner = purge_css(body, classes)
+            if inner:
+                kept.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            kept.append(f'{prelude}{{{body}}}')
+        else:
+            selectors = [s for s in prelude.split(',') if all(c in classes for c in _selector_classes(s))]
+            if selectors:
+                kept.append(f"{','.join(selectors)}{{{body}}}")
+    return ''.join(kept)
+
+
+def expand_apply(css, utilities):
+    """Replace @apply rules with the declarations of the utility classes they name"""
+    def replace(match):
+        declarations = (utilities.get(name, '').strip(';') for name in match.group(1).split())
+        return ';'.join(declaration for declaration in declarations if declaration) + ';'
+    return re.sub(r'@apply\s+([^;]+);', replace, css)
+
+
+def utility_declarations(css):
+    """Declarations of the plain, single-class top-level rules of a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    utilities = {}
+    for prelude, body in _blocks(css):
+        if body is not None and re.fullmatch(r'\.(?:\\.|[\w-])+', prelude):
+            utilities[_selector_classes(prelude)[0]] = body
+    return utilities
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    css = re.sub(r';+', ';', css).replace('{;', '{').replace(';}', '}')
+    # Rules left empty, e.g. by @apply of utilities Tailwind doesn't have
+    return re.sub(r'[^{}]+\{\}', '', css).strip()
+
+
+def minify_js(js):
+    """Conservative minification: indentation, blank lines and whole-line comments only"""
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def minify_html(pieces):
+    """Minify HTML given as an iterable of pieces, yielding the minified lines
+
+    Indentation, blank lines and comments are dropped line by line, which
+    never changes how a page renders; <pre> and <textarea> content is kept
+    as it is. The <!--more--> marker blog platforms use is kept.
+    """
+    buffer = ''
+    verbatim = False
+    for piece in pieces:
+        buffer += piece
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            line, verbatim = _minify_line(line, verbatim)
+            if line is not None:
+                yield line + '\n'
+    line, verbatim = _minify_line(buffer, verbatim)
+    if line is not None:
+        yield line + '\n'
+
+
+def _minify_line(line, verbatim):
+    """Return the minified line, None to drop it, and whether the next line is inside <pre>"""
+    opens = len(re.findall(r'<(?:pre|textarea)\b', line, re.IGNORECASE))
+    closes = len(re.findall(r'</(?:pre|textarea)>', line, re.IGNORECASE))
+    if verbatim:
+        return line, closes <= opens
+    line = re.sub(r'<!--(?!more-->|\[if).*?-->', '', line).strip()
+    return line or None, opens > closes
+
+
+def compressed_siblings(name, data):
+    """Return [(name, bytes)] of the .gz and .br versions worth keeping for one file"""
+    if not name.endswith(COMPRESSIBLE_EXTENSIONS) or len(data) < MIN_COMPRESS_SIZE:
+        return []
+    siblings = [(f'{name}.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    brotli = brotli_module()
+    if brotli is not None:
+        siblings.append((f'{name}.br', brotli.compress(data, quality=BROTLI_QUALITY)))
+    return [(sibling, compressed) for sibling, compressed in siblings if len(compressed) < len(data)]
+
+
+_brotli = False
+
+
+def brotli_module():
+    """The optional brotli package, or None when it is not installed"""
+    global _brotli
+    if _brotli is False:
+        try:
+            import brotli
+        except ImportError:
+            logger.warning("brotli is not installed, only .gz files are written (pip install brotli)")
+            brotli = None
+        _brotli = brotli
+    return _brotli
+
+
+def build_assets(write, bundles=BUNDLES):
+    """Build and write the hashed static bundles and return the assets context of the templates
+
+    The context maps every bundle name to its path in the site;
+    tailwind_cdn is set when Tailwind could not be vendored.
+    """
+    tailwind = load_tailwind()
+    assets = {'tailwind_cdn': tailwind is None}
+    for bundle, sources in bundles.items():
+        parts = []
+        for source in sources:
+            if source == 'tailwind':
+                if tailwind is not None:
+                    parts.append(purge_css(tailwind, used_classes()))
+                continue
+            with open(os.path.join(STATIC_DIR, source), 'r', encoding='utf-8') as f:
+                parts.append(f.read())
+        text = '\n'.join(parts)
+        if bundle.endswith('.css'):
+            if tailwind is not None:
+                text = expand_apply(text, utility_declarations(tailwind))
+            text = minify_css(text)
+        else:
+            text = minify_js(text)
+
+        data = text.encode('utf-8')
+        stem, extension = bundle.rsplit('.', 1)
+        path = f"static/{stem}.{hashlib.sha256(data).hexdigest()[:10]}.{extension}"
+        write(path, data)
+        assets[bundle] = path
+    return assets
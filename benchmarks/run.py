@@ -0,0 +1,559 @@
+"""Benchmark suite running against local stand-ins for Gemini, Bing and the other services
+
+    python -m benchmarks.run                      # everything, results in benchmarks/results/
+    python -m benchmarks.run --only export --quick
+    python -m benchmarks.run --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+
+# Keep the benchmark's caches and journal away from the real ones
+os.environ.setdefault("BLOG_CACHE_DIR", tempfile.mkdtemp(prefix="blog-bench-cache-"))
+os.environ.setdefault("BLOG_DATA_DIR", tempfile.mkdtemp(prefix="blog-bench-data-"))
+
+import assets
+import export
+import generator
+import language
+import postprocess
+import rendering
+import utils
+from benchmarks.stubs import (FakeBingServer, FakeImageServer, FakeModel, FakePooledModel, FakeQuotaServer,
+                              FakeStylesheetServer, bing_results_page, fake_articles, fake_html_article, fake_images,
+                              fake_markdown_article, fake_subjects)
+from bing import IMAGE_RESULTS, extract_image_records
+from cache import CachedModel
+from chat import HISTORY_POLICIES, ChatSessionManager
+from images import ImageMirror
+from key_pool import KeyPool
+from metrics import MeteredModel, start_run
+from routing import DEFAULT_MODEL, RoutedModel, load_routes, single_model_routes
+from search import SearchIndex
+from store import ArticleStore, build_site
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark; it receives the quick flag and returns a dict of metrics"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def timed(func, repeat=5):
+    """Run func repeat times and return the best and median wall time in seconds"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return {"seconds": min(times), "median_seconds": statistics.median(times)}
+
+
+@benchmark("process_bulk_topics")
+def bench_process_bulk_topics(quick):
+    topics = [f"benchmark topic {i}" for i in range(20 if quick else 100)]
+    with FakeBingServer(latency=0.05) as bing, mock.patch.object(generator, "BING_IMAGES_URL", bing.url):
+        model = CachedModel(FakeModel(latency=0.05), mode="bypass")
+        articles, stats = generator.process_bulk_topics(topics, model, max_workers=8)
+    return {
+        "seconds": stats["elapsed"],
+        "articles": stats["completed"],
+        "articles_per_minute": stats["articles_per_minute"],
+    }
+
+
+@benchmark("model_routing")
+def bench_model_routing(quick):
+    """Per-stage latency and cost of a batch on one model and with the default routes
+
+    Every model runs through a KeyPool of two keys, like build_model. The
+    fake pro model is slower than the flash one and fails one call in ten
+    with a quota error, which cools the key down for pro only: the single
+    model run waits for the keys, the routed run falls back to flash.
+    """
+    topics = [f"benchmark topic {i}" for i in range(20 if quick else 100)]
+    latencies = {"gemini-1.5-pro": 0.08, "gemini-1.5-flash": 0.02}
+
+    results = {}
+    with FakeBingServer(latency=0.05) as bing, mock.patch.object(generator, "BING_IMAGES_URL", bing.url):
+        for name, routes in (("single_model", single_model_routes(DEFAULT_MODEL)), ("routed", load_routes())):
+            pool = KeyPool(["key-0", "key-1"], requests_per_minute=6000, cooldown=1.0)
+
+            def build(model_name):
+                quota_error_every = 10 if model_name == DEFAULT_MODEL else 0
+                model = FakeModel(model_name, latency=latencies[model_name], quota_error_every=quota_error_every)
+                return MeteredModel(FakePooledModel(pool, model))
+
+            run = start_run()
+            # Titles and meta descriptions topic by topic, so each has its own stage to compare
+            articles, stats = generator.process_bulk_topics(
+                topics, RoutedModel(routes, build), max_workers=8, title_batch_size=0
+            )
+            results[f"{name}_seconds"] = stats["elapsed"]
+            results[f"{name}_articles"] = stats["completed"]
+            stages = run.to_dict()["stages"]
+            results[f"{name}_cost_usd"] = sum(stage["cost_usd"] for stage in stages.values())
+            results[f"{name}_cost_per_article_usd"] = results[f"{name}_cost_usd"] / max(1, stats["completed"])
+            for stage in ("title", "meta_description", "content"):
+                results[f"{name}_{stage}_p50_seconds"] = stages[stage]["seconds_p50"]
+                results[f"{name}_{stage}_cost_usd"] = stages[stage]["cost_usd"]
+                results[f"{name}_{stage}_fallbacks"] = stages[stage]["fallbacks"]
+            results[f"{name}_quota_errors"] = sum(key["quota_errors"] for key in pool.stats()["keys"])
+    return results
+
+
+@benchmark("batched_titles")
+def bench_batched_titles(quick):
+    """Title and meta description calls of a batch, topic by topic against batched JSON calls"""
+    topics = [f"benchmark topic {i}" for i in range(20 if quick else 100)]
+    results = {"topics": len(topics)}
+    with FakeBingServer(latency=0.05) as bing, mock.patch.object(generator, "BING_IMAGES_URL", bing.url):
+        for batch_size in (0, generator.TITLE_BATCH_SIZE):
+            model = FakeModel(latency=0.05)
+            started = time.perf_counter()
+            articles, stats = generator.process_bulk_topics(
+                topics, CachedModel(model, mode="bypass"), max_workers=8, title_batch_size=batch_size
+            )
+            # Every topic makes one content call, the rest are for titles and meta descriptions
+            results[f"batch_{batch_size}_title_calls"] = model.calls - stats["completed"]
+            results[f"batch_{batch_size}_seconds"] = time.perf_counter() - started
+    return results
+
+
+def soup_image_records(page):
+    """The full-DOM BeautifulSoup extraction the image searches used before bing.extract_image_records"""
+    from bs4 import BeautifulSoup
+
+    records = []
+    for img in BeautifulSoup(page, 'html.parser').find_all('a', class_='iusc'):
+        m = json.loads(img['m'])
+        records.append({'url': m['murl'], 'title': m.get('t', 'Image'), 'description': m.get('desc', 'No description available')})
+    return records
+
+
+@benchmark("bing_extract")
+def bench_bing_extract(quick):
+    page = bing_results_page("benchmark query", results=35)
+    expected = soup_image_records(page)[:IMAGE_RESULTS]
+    assert extract_image_records(page) == expected, "extractor records differ from BeautifulSoup"
+    repeat = 5 if quick else 20
+    soup = timed(lambda: soup_image_records(page), repeat=repeat)
+    extractor = timed(lambda: extract_image_records(page), repeat=repeat)
+    return {
+        "page_bytes": len(page),
+        "soup_seconds": soup["seconds"],
+        "extractor_seconds": extractor["seconds"],
+        "speedup": soup["seconds"] / extractor["seconds"],
+    }
+
+
+@benchmark("format_content_with_images")
+def bench_format_content_with_images(quick):
+    results = {}
+    images = fake_images(50)
+    for sections in (100, 1000) if quick else (400, 4000):
+        content = fake_html_article(sections=sections)
+        result = timed(lambda: generator.format_content_with_images(content, images, "Title", "Meta"))
+        results[f"{sections}_sections_seconds"] = result["seconds"]
+        results[f"{sections}_sections_words"] = len(content.split())
+
+        def streamed():
+            # Chunks about the size the model streams
+            formatter = generator.content_formatter(images)
+            for start in range(0, len(content), 100):
+                formatter.feed(content[start:start + 100])
+            return ''.join(formatter.close())
+
+        results[f"{sections}_sections_streamed_seconds"] = timed(streamed)["seconds"]
+    return results
+
+
+@benchmark("format_article_with_images")
+def bench_format_article_with_images(quick):
+    results = {}
+    image_html = [f'<div><img src="{image["url"]}"></div>' for image in fake_images(50)]
+    for paragraphs in (500, 5000) if quick else (3000, 30000):
+        article = fake_markdown_article(paragraphs=paragraphs)
+        result = timed(lambda: utils.format_article_with_images(article, image_html, max_images=50))
+        results[f"{paragraphs}_paragraphs_seconds"] = result["seconds"]
+        results[f"{paragraphs}_paragraphs_words"] = len(article.split())
+    return results
+
+
+@benchmark("generate_blog_html")
+def bench_generate_blog_html(quick):
+    content = fake_html_article()
+    images = fake_images()
+    all_articles = fake_articles(20)
+    generator.get_blog_template()
+    result = timed(
+        lambda: [
+            generator.generate_blog_html("Title", content, "Meta", images, all_articles=all_articles)
+            for _ in range(20 if quick else 100)
+        ],
+        repeat=3
+    )
+    pages = 20 if quick else 100
+    return {**result, "pages": pages, "seconds_per_page": result["seconds"] / pages}
+
+
+@benchmark("render_pages")
+def bench_render_pages(quick):
+    pages = 20 if quick else 100
+    article = generator.blog_page_context("Title", fake_html_article(), "Meta", fake_images(), all_articles=fake_articles(20))
+    index = export.index_context(
+        [{"title": f"Article {i}", "filename": f"article-{i}.html"} for i in range(1000)], "Bench", "Benchmark site"
+    )
+    image_html = [utils.format_image_html(image["url"], image["title"]) for image in fake_images()]
+    body = utils.format_article_with_images(fake_markdown_article(), image_html)
+    results = {}
+    for name, render_page in (
+        ("article", lambda: rendering.render(generator.BLOG_TEMPLATE, **article)),
+        ("article_streamed", lambda: io.StringIO().writelines(rendering.stream(generator.BLOG_TEMPLATE, **article))),
+        ("index_1000_entries", lambda: rendering.render("index.html", **index)),
+        ("pinterest", lambda: utils.generate_html_template("Title", body, image_html)),
+    ):
+        render_page()
+        timing = timed(lambda: [render_page() for _ in range(pages)], repeat=3)
+        results[f"{name}_seconds_per_page"] = timing["seconds"] / pages
+    return results
+
+
+@benchmark("create_github_export")
+def bench_create_github_export(quick):
+    results = {}
+    for count in (10, 100) if quick else (10, 100, 1000):
+        articles = fake_articles(count)
+        sizes = []
+
+        def run_export():
+            buffer = export.create_github_export(articles, "Bench", "Benchmark site", fileobj=io.BytesIO())
+            sizes.append(len(buffer.getvalue()))
+
+        timing = timed(run_export, repeat=3)
+        results[f"{count}_articles_seconds"] = timing["seconds"]
+        results[f"{count}_articles_bytes"] = sizes[-1]
+    return results
+
+
+@benchmark("site_index")
+def bench_site_index(quick):
+    """Index pages, sitemap and feed of a large site, written once every article was added"""
+    results = {}
+    for count in (1000, 10000) if quick else (1000, 10000, 100000):
+        articles = [
+            {"title": f"Article {i}", "filename": f"article-{i}.html", "meta_description": "Meta", "html": "<p></p>"}
+            for i in range(count)
+        ]
+        site = export.SiteExport("Bench", "Benchmark site", fileobj=io.BytesIO(), site_url="https://example.com")
+        for article in articles:
+            site.add_article(article)
+        started = time.perf_counter()
+        site.close()
+        results[f"{count}_articles_seconds"] = time.perf_counter() - started
+    return results
+
+
+@benchmark("postprocess")
+def bench_postprocess(quick):
+    """Formatting and rendering of long articles in the calling process and on worker processes"""
+    count = 64 if quick else 256
+    records = fake_articles(count, sections=60)
+    for i, record in enumerate(records):
+        record["related"] = generator.pick_related(records, i)
+    steps = (postprocess.article_stats, generator.format_article, generator.render_article)
+    results = {"articles": count, "words_per_article": len(records[0]["content"].split())}
+    for workers in (0, 2, 4):
+        with postprocess.PostProcessor(workers) as processor:
+            # Start the workers before timing, a real run starts them while the articles are generated
+            processor.run(steps, records[:1])
+            started = time.perf_counter()
+            processor.run(steps, records)
+            results[f"{workers}_processes_seconds"] = time.perf_counter() - started
+    # utils.generate_article output: images, markdown conversion and the Pinterest page
+    image_html = [utils.format_image_html(image["url"], image["title"]) for image in fake_images()]
+    pinterest = [
+        {"title": f"Article {i}", "content": fake_markdown_article(seed=i), "image_html": image_html} for i in range(count)
+    ]
+    started = time.perf_counter()
+    utils.render_pinterest_articles(pinterest)
+    results["pinterest_0_processes_seconds"] = time.perf_counter() - started
+    return results
+
+
+@benchmark("search_index")
+def bench_search_index(quick):
+    """Search index build time and the compressed size of its shards"""
+    results = {}
+    for count in (1000,) if quick else (1000, 10000):
+        articles = fake_articles(count)
+        sizes = {}
+
+        def build():
+            index = SearchIndex()
+            for article in articles:
+                index.add(article["title"], article["filename"], article["meta_description"], article["content"])
+            sizes.update(index.write(lambda name, data: None))
+
+        timing = timed(build, repeat=3)
+        shards = [size for name, size in sizes.items() if "/docs-" not in name]
+        results[f"{count}_articles_seconds"] = timing["seconds"]
+        results[f"{count}_articles_shards"] = len(shards)
+        results[f"{count}_articles_largest_shard_bytes"] = max(shards)
+        results[f"{count}_articles_index_bytes"] = sum(sizes.values())
+    return results
+
+
+@benchmark("detect_languages")
+def bench_detect_languages(quick):
+    """Language detection of a topics file: one uncached detect per subject against the memoized batch"""
+    count = 2000 if quick else 10000
+    path = os.path.join(tempfile.mkdtemp(prefix="blog-bench-subjects-"), "subjects.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(fake_subjects(count)))
+    with open(path, "r", encoding="utf-8") as f:
+        subjects = [line.strip() for line in f if line.strip()]
+    results = {"subjects": len(subjects), "distinct": len({language.normalize_subject(s) for s in subjects})}
+
+    from langdetect import detect
+    language.warm_up()
+    sample = subjects[:500]
+    started = time.perf_counter()
+    for subject in sample:
+        # What detect_language did per call before the memo and the Latin fast path
+        language.language_name(detect(subject))
+    results["uncached_seconds"] = (time.perf_counter() - started) * len(subjects) / len(sample)
+
+    for workers in (0, 2):
+        language.clear_cache()
+        started = time.perf_counter()
+        language.detect_languages(subjects, max_workers=workers)
+        results[f"batch_{workers}_processes_seconds"] = time.perf_counter() - started
+    results.update({f"warm_{k}": v for k, v in timed(lambda: language.detect_languages(subjects)).items()})
+    return results
+
+
+@benchmark("chat_history")
+def bench_chat_history(quick):
+    """Prompt tokens per article over a batch on one chat session, for every history policy"""
+    count = 100 if quick else 500
+    results = {"subjects": count}
+    for policy in HISTORY_POLICIES:
+        session = ChatSessionManager(FakeModel(latency=0), policy=policy)
+        started = time.perf_counter()
+        for i in range(count):
+            title = utils.generate_title(session, f"benchmark topic {i}", "English")
+            utils.generate_article(session, title, f"benchmark topic {i}", "English")
+        results[f"{policy}_seconds"] = time.perf_counter() - started
+        # A title and an article call per subject
+        per_article = [sum(pair) for pair in zip(session.input_tokens[::2], session.input_tokens[1::2])]
+        results[f"{policy}_first_10_article_tokens"] = statistics.mean(per_article[:10])
+        results[f"{policy}_last_10_article_tokens"] = statistics.mean(per_article[-10:])
+        results[f"{policy}_input_tokens_total"] = sum(per_article)
+    return results
+
+
+@benchmark("optimized_export")
+def bench_optimized_export(quick):
+    """Site size and build time with shared assets, minified pages and precompressed files"""
+    count = 10 if quick else 100
+    articles = fake_articles(count)
+    exports = []
+
+    def run_export():
+        site = export.SiteExport("Bench", "Benchmark site", fileobj=io.BytesIO(), optimize=True)
+        for article in articles:
+            site.add_article(article)
+        site.close()
+        exports.append(site)
+
+    # Tailwind comes from a local stand-in of the CDN, into a cache of its own
+    with FakeStylesheetServer() as stylesheets, tempfile.TemporaryDirectory() as directory, \
+            mock.patch.object(assets, "TAILWIND_URL", stylesheets.url), \
+            mock.patch.object(assets, "TAILWIND_CACHE_PATH", os.path.join(directory, "tailwind.min.css")):
+        assets.load_tailwind.cache_clear()
+        try:
+            timing = timed(run_export, repeat=3)
+        finally:
+            assets.load_tailwind.cache_clear()
+    sizes = exports[-1].size_report()
+    return {
+        "seconds": timing["seconds"],
+        "original_bytes": sizes["original_bytes"],
+        "minified_bytes": sizes["bytes"],
+        "gzip_bytes": sizes["gzip_bytes"],
+        "brotli_bytes": sizes["brotli_bytes"],
+    }
+
+
+@benchmark("image_mirror")
+def bench_image_mirror(quick):
+    # Every image is referenced twice: once more by another article under a different URL
+    count = 10 if quick else 40
+    files = {}
+    with FakeImageServer() as server:
+        urls = [server.image_url(i) for i in range(count)] + [server.image_url(i, copy=1) for i in range(count)]
+        originals = sum(len(server.respond(f"/img/{i}.jpg")[2]) for i in range(count))
+        started = time.perf_counter()
+        mirrored = ImageMirror(files.__setitem__).mirror(urls)
+        elapsed = time.perf_counter() - started
+    largest = {image["src"].rsplit("/", 1)[-1] for image in mirrored.values()}
+    return {
+        "seconds": elapsed,
+        "urls": len(urls),
+        "mirrored_urls": len(mirrored),
+        "unique_images": len(largest),
+        "files": len(files),
+        "original_bytes": originals,
+        "largest_jpeg_bytes": sum(len(files[f"assets/images/{name}"]) for name in largest),
+        "largest_webp_bytes": sum(len(files[f"assets/images/{name[:-4]}.webp"]) for name in largest),
+    }
+
+
+@benchmark("incremental_site")
+def bench_incremental_site(quick):
+    """Full build of a stored site, then a rebuild after adding 10 articles, with the peak memory of each"""
+    results = {}
+    for count in (200, 1000) if quick else (1000, 5000):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ArticleStore(directory)
+            for article in fake_articles(count + 10, sections=3)[:count]:
+                del article["html"]
+                store.add(article)
+            for name, extra in (("full", 0), ("incremental", 10)):
+                for article in fake_articles(count + extra, sections=3)[count:]:
+                    del article["html"]
+                    store.add(article)
+                tracemalloc.start()
+                started = time.perf_counter()
+                built = build_site(store, "Bench", "Benchmark site", site_url="https://example.com")
+                results[f"{count}_{name}_seconds"] = time.perf_counter() - started
+                results[f"{count}_{name}_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results[f"{count}_{name}_rendered"] = built["rendered"]
+                results[f"{count}_{name}_files_written"] = built["files_written"]
+    return results
+
+
+@benchmark("key_pool")
+def bench_key_pool(quick):
+    """Throughput of a KeyPool with 1, 2 and 4 keys against a local endpoint answering 429 past its per-key rate
+
+    The pool's own budget is set above the endpoint's rate, so the keys run
+    into 429s: each puts its key in cooldown for the model and halves the
+    model's concurrency limit, successes grow it again. In the exhausted run
+    one of four keys always answers 429 and has to be skipped while it cools
+    down; in the model run every call of one model answers 429 while the
+    other model's calls, on the same keys, have to keep going.
+    """
+    calls = 100 if quick else 300
+    results = {}
+    scenarios = (
+        ("1_key", 1, (), ()), ("2_keys", 2, (), ()), ("4_keys", 4, (), ()),
+        ("4_keys_1_exhausted", 4, ("key-0",), ()), ("4_keys_1_model_exhausted", 4, (), ("pro",)),
+    )
+    for name, keys, exhausted, exhausted_models in scenarios:
+        with FakeQuotaServer(latency=0.02, requests_per_second=10, exhausted=exhausted,
+                             exhausted_models=exhausted_models) as server:
+            # The exhausted model gives up once every key answered 429, so its calls don't run for minutes
+            pool = KeyPool([f"key-{i}" for i in range(keys)], requests_per_minute=1200, cooldown=1.0,
+                           max_attempts=keys if exhausted_models else 8)
+            limits = []
+
+            def call(index):
+                # Every eighth call goes to the exhausted model, only the others are measured
+                model = "pro" if exhausted_models and index % 8 == 0 else "flash"
+                try:
+                    pool.call(lambda key: urllib.request.urlopen(f"{server.url}?key={key}&model={model}").read(),
+                              model=model)
+                    ok = True
+                except Exception:
+                    ok = False
+                limits.append(pool.concurrency_limit("flash"))
+                return model, ok, time.perf_counter()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(32) as executor:
+                outcomes = [outcome for outcome in executor.map(call, range(calls)) if outcome[0] == "flash"]
+            stats = pool.stats()
+        elapsed = max(finished for _, _, finished in outcomes) - started
+        succeeded = sum(1 for _, ok, _ in outcomes if ok)
+        results[f"{name}_calls_per_second"] = succeeded / elapsed
+        results[f"{name}_failed"] = len(outcomes) - succeeded
+        results[f"{name}_quota_errors"] = sum(key["quota_errors"] for key in stats["keys"])
+        results[f"{name}_min_concurrency_limit"] = min(limits)
+        results[f"{name}_final_concurrency_limit"] = int(pool.concurrency_limit("flash"))
+        if exhausted:
+            results[f"{name}_exhausted_key_calls"] = stats["keys"][0]["calls"]
+            results[f"{name}_other_keys_calls"] = sum(key["calls"] for key in stats["keys"][1:])
+    return results
+
+
+def compare(current, previous):
+    """Print the relative change of every shared metric"""
+    for name, metrics in current["results"].items():
+        old = previous["results"].get(name, {})
+        for metric, value in metrics.items():
+            if isinstance(value, (int, float)) and isinstance(old.get(metric), (int, float)) and old[metric]:
+                change = (value - old[metric]) / old[metric] * 100
+                print(f"{name:32} {metric:28} {old[metric]:>12.4f} -> {value:>12.4f} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the blog generator benchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs for a fast check")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "quick": args.quick,
+        "results": {},
+    }
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        report["results"][name] = BENCHMARKS[name](args.quick)
+        print(json.dumps(report["results"][name], indent=2), file=sys.stderr)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
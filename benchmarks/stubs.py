@@ -0,0 +1,380 @@
+"""Local stand-ins for Gemini and Bing with configurable latency"""
+import html
+import io
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    "garden light morning coffee travel budget design simple habit growth color space "
+    "story recipe season energy balance quiet home creative weekend practical"
+).split()
+
+
+def fake_words(count, seed=0):
+    """Deterministic filler text"""
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def fake_html_article(sections=12, words_per_section=220, seed=0):
+    """An article shaped like generate_article_content output"""
+    parts = [f"<p>{fake_words(80, seed)}</p>"]
+    for i in range(sections):
+        parts.append(f"<h2>Section {i + 1}</h2>")
+        parts.append(f"<p>{fake_words(words_per_section // 2, seed + i)}</p>")
+        parts.append(f"<h3>Detail {i + 1}</h3><p>{fake_words(words_per_section // 2, seed + i + 1)}</p>")
+    return '\n'.join(parts)
+
+
+def fake_markdown_article(paragraphs=60, words_per_paragraph=50, seed=0):
+    """An article shaped like utils.generate_article output"""
+    parts = ["# A Title"]
+    for i in range(paragraphs):
+        if i % 6 == 0:
+            parts.append(f"## Heading {i // 6 + 1}")
+        parts.append(fake_words(words_per_paragraph, seed + i))
+    return '\n\n'.join(parts)
+
+
+def fake_images(count=15):
+    return [{"url": f"https://images.example.com/{i}.jpg", "title": f"Image {i}"} for i in range(count)]
+
+
+def fake_articles(count, sections=12):
+    """Rendered-article records as passed to the export"""
+    return [
+        {
+            "title": f"Article number {i}",
+            "filename": f"article-number-{i}.html",
+            "meta_description": fake_words(25, i),
+            "content": fake_html_article(sections, seed=i),
+            "images": fake_images(),
+            "html": "<html><body>" + fake_html_article(sections, seed=i) + "</body></html>",
+        }
+        for i in range(count)
+    ]
+
+
+SUBJECT_PHRASES = (
+    "how to bake sourdough bread at home", "best budget travel tips for {} in summer",
+    "comment préparer un jardin pour {}", "les meilleures idées de décoration pour {}",
+    "wie man im {} einen Garten anlegt", "die besten Reiseziele für {}",
+    "cómo ahorrar dinero en {}", "ideas de recetas fáciles para {}",
+    "come organizzare la casa per {}", "consigli di viaggio per {}",
+    "como decorar a sala para {}", "如何在{}种植蔬菜", "как подготовить сад к {}",
+    "{}に最適な家庭料理のレシピ", "hoe je tuin klaarmaken voor {}",
+)
+
+
+def fake_subjects(count, distinct=4000, seed=0):
+    """Subjects in a dozen languages, drawn with repeats from distinct variants like a real topics file"""
+    rng = random.Random(seed)
+    variants = [phrase.format(f"{rng.choice(WORDS)} {i}") for i, phrase in
+                ((i, rng.choice(SUBJECT_PHRASES)) for i in range(distinct))]
+    subjects = [rng.choice(variants) for _ in range(count)]
+    # Repeats often differ only in case and spacing
+    return [subject.title() if rng.random() < 0.2 else subject for subject in subjects]
+
+
+def _usage(prompt, text):
+    prompt_tokens = max(1, len(prompt) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        candidates_token_count=output_tokens,
+        total_token_count=prompt_tokens + output_tokens
+    )
+
+
+class FakeResponse:
+    def __init__(self, text, prompt=""):
+        self.text = text
+        self.usage_metadata = _usage(prompt, text)
+
+
+class FakeModel:
+    """GenerativeModel stand-in: sleeps for latency and answers by prompt type
+
+    Streaming responses are split into chunks_per_response chunks spread over
+    the same latency. With quota_error_every every n-th call fails like an
+    exhausted quota.
+    """
+
+    def __init__(self, model_name="models/fake", latency=0.05, article_sections=12, chunks_per_response=10,
+                 quota_error_every=0):
+        self.model_name = model_name
+        self.latency = latency
+        self.article_sections = article_sections
+        self.chunks_per_response = chunks_per_response
+        self.quota_error_every = quota_error_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt):
+        with self._lock:
+            self.calls += 1
+            seed = self.calls
+        if self.quota_error_every and seed % self.quota_error_every == 0:
+            raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+        if "meta description" in prompt:
+            return fake_words(25, seed)
+        if "title" in prompt.lower() and "Write" not in prompt:
+            return f"Fake Title {seed}: {fake_words(5, seed)}"
+        return fake_html_article(self.article_sections, seed=seed)
+
+    def _json_answer(self, prompt):
+        """Titles and meta descriptions for the numbered topics of a batched prompt"""
+        indices = [int(number) for number in re.findall(r"^\s*(\d+)\. ", prompt, re.MULTILINE)]
+        return json.dumps([
+            {
+                "index": index,
+                "title": f"Fake Title {index}: {fake_words(8, index)}"[:60],
+                "meta_description": fake_words(40, index)[:155],
+            }
+            for index in indices
+        ])
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            self._answer("")
+            text = self._json_answer(str(prompt))
+        else:
+            text = self._answer(str(prompt))
+        if not stream:
+            time.sleep(self.latency)
+            return FakeResponse(text, str(prompt))
+        return self._stream(text, str(prompt))
+
+    def _stream(self, text, prompt):
+        size = max(1, len(text) // self.chunks_per_response)
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / self.chunks_per_response)
+            yield FakeResponse(text[start:start + size], prompt)
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+
+class FakeChatSession:
+    """ChatSession stand-in that keeps a history like the real one and is billed for it"""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+        self.last = None
+
+    def send_message(self, prompt, stream=False, **kwargs):
+        # Like the API, every message is sent along with the whole history
+        context = '\n'.join([*self.history, prompt])
+        response = self.model.generate_content(prompt, stream=stream)
+        if stream:
+            return self._stream(response, prompt, context)
+        response.usage_metadata = _usage(context, response.text)
+        self.history += [prompt, response.text]
+        return response
+
+    def _stream(self, stream, prompt, context):
+        parts = []
+        for chunk in stream:
+            parts.append(chunk.text)
+            self.last = chunk
+            yield chunk
+        chunk.usage_metadata = _usage(context, ''.join(parts))
+        self.history += [prompt, ''.join(parts)]
+        self.last = None
+
+    def rewind(self):
+        self.last = None
+        del self.history[-2:]
+
+
+def bing_results_page(query, results=35, image_base="https://images.example.com"):
+    """An HTML page shaped like the Bing image results page"""
+    items = []
+    for i in range(results):
+        m = {"murl": f"{image_base}/{i}-{abs(hash(query)) % 10000}.jpg", "t": f"{query} {i}", "desc": f"Description {i}"}
+        items.append(
+            f'<div class="imgpt"><a class="iusc" style="height:180px" m="{html.escape(json.dumps(m))}" '
+            f'href="/images/search?view=detailV2&amp;id={i}"><img class="mimg" src="https://tse.example.com/{i}"></a>'
+            f'<div class="infnmpt"><div class="inflnk">{fake_words(12, i)}</div></div></div>'
+        )
+    filler = f"<script>{'var x=1;' * 2000}</script>" + f"<div>{fake_words(3000)}</div>"
+    return f"<!DOCTYPE html><html><head><title>{html.escape(query)}</title>{filler}</head><body>{''.join(items)}</body></html>"
+
+
+class LocalServer:
+    """Threaded local HTTP server; subclasses answer GET requests with respond(path)"""
+
+    def __init__(self, latency=0.05):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency)
+                status, content_type, body = server.respond(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, path):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeBingServer(LocalServer):
+    """Local HTTP server answering /images/search with a Bing-like results page"""
+
+    def __init__(self, latency=0.05, results=35, image_base="https://images.example.com"):
+        super().__init__(latency)
+        self.results = results
+        self.image_base = image_base
+        self.url = f"{self.base_url}/images/search"
+
+    def respond(self, path):
+        query = parse_qs(urlsplit(path).query).get("q", [""])[0]
+        return 200, "text/html; charset=utf-8", bing_results_page(query, self.results, self.image_base).encode("utf-8")
+
+
+class FakePooledModel:
+    """PooledModel stand-in: runs every call of a fake model through a KeyPool, under the fake's model name"""
+
+    def __init__(self, pool, model):
+        self.pool = pool
+        self.model = model
+        self.model_name = model.model_name
+
+    def generate_content(self, prompt, **kwargs):
+        return self.pool.call(lambda key: self.model.generate_content(prompt, **kwargs), model=self.model_name)
+
+
+class FakeQuotaServer(LocalServer):
+    """Local HTTP endpoint enforcing a per-key request rate like the Gemini quota
+
+    GET /generate?key=<key>&model=<model> answers 200, or 429 once the key
+    made requests_per_second requests of the model within the last second.
+    Keys in exhausted and models in exhausted_models always get 429, like a
+    key or a model whose daily quota is spent.
+    """
+
+    def __init__(self, latency=0.02, requests_per_second=10, exhausted=(), exhausted_models=()):
+        super().__init__(latency)
+        self.requests_per_second = requests_per_second
+        self.exhausted = set(exhausted)
+        self.exhausted_models = set(exhausted_models)
+        self.url = f"{self.base_url}/generate"
+        self.answered = {}
+        self.rejected = {}
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def respond(self, path):
+        query = parse_qs(urlsplit(path).query)
+        key = query.get("key", [""])[0]
+        model = query.get("model", [""])[0]
+        now = time.monotonic()
+        with self._lock:
+            recent = [at for at in self._recent.get((key, model), []) if now - at < 1.0]
+            if key in self.exhausted or model in self.exhausted_models or len(recent) >= self.requests_per_second:
+                self._recent[key, model] = recent
+                self.rejected[key] = self.rejected.get(key, 0) + 1
+                return 429, "application/json", b'{"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}'
+            self._recent[key, model] = recent + [now]
+            self.answered[key] = self.answered.get(key, 0) + 1
+        return 200, "application/json", b'{"text": "ok"}'
+
+TAILWIND_UTILITIES = {
+    "p": "padding", "px": "padding-left", "py": "padding-top", "m": "margin", "mx": "margin-left",
+    "mb": "margin-bottom", "mt": "margin-top", "w": "width", "h": "height", "gap": "gap",
+}
+TAILWIND_COLORS = ("gray", "red", "yellow", "green", "blue", "indigo", "purple", "pink")
+
+
+def fake_tailwind_css():
+    """A stylesheet shaped like the Tailwind build: thousands of utility rules, few of them used"""
+    rules = [".container{width:100%}", ".flex{display:flex}", ".grid{display:grid}", ".hidden{display:none}",
+             ".rounded-lg{border-radius:.5rem}", ".shadow-md{box-shadow:0 4px 6px -1px rgba(0,0,0,.1)}"]
+    for prefix, prop in TAILWIND_UTILITIES.items():
+        for size in range(0, 97):
+            rules.append(f".{prefix}-{size}{{{prop}:{size / 4}rem}}")
+    for color in TAILWIND_COLORS:
+        for shade in range(100, 1000, 100):
+            rules.append(f".text-{color}-{shade}{{--tw-text-opacity:1;color:rgba({shade // 4},{shade // 8},{shade // 5},var(--tw-text-opacity))}}")
+            rules.append(f".bg-{color}-{shade}{{--tw-bg-opacity:1;background-color:rgba({shade // 4},{shade // 8},{shade // 5},var(--tw-bg-opacity))}}")
+            rules.append(f".hover\\:bg-{color}-{shade}:hover{{background-color:rgba({shade // 4},{shade // 8},{shade // 5},1)}}")
+    for breakpoint, width in (("sm", 640), ("md", 768), ("lg", 1024)):
+        rules.append(f"@media (min-width:{width}px){{" + "".join(
+            f".{breakpoint}\\:grid-cols-{n}{{grid-template-columns:repeat({n},minmax(0,1fr))}}" for n in range(1, 13)
+        ) + "}")
+    return "\n".join(rules)
+
+
+class FakeStylesheetServer(LocalServer):
+    """Local HTTP server serving fake_tailwind_css() at /tailwind.min.css, in place of the CDN"""
+
+    def __init__(self, latency=0.05):
+        super().__init__(latency)
+        self.url = f"{self.base_url}/tailwind.min.css"
+        self._css = fake_tailwind_css().encode("utf-8")
+
+    def respond(self, path):
+        return 200, "text/css; charset=utf-8", self._css
+
+def fixture_image(seed, size=(1600, 1067)):
+    """A JPEG photo stand-in with some detail so encoders have real work to do (needs Pillow)"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    picture = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(picture)
+    for _ in range(60):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randrange(40, 400), y + rng.randrange(40, 400)),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    picture.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class FakeImageServer(LocalServer):
+    """Local HTTP server serving fixture JPEGs at /img/<n>.jpg; /img/<n>-<copy>.jpg returns the same bytes as /img/<n>.jpg"""
+
+    def __init__(self, latency=0.02, size=(1600, 1067)):
+        super().__init__(latency)
+        self.size = size
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def image_url(self, number, copy=None):
+        return f"{self.base_url}/img/{number}.jpg" if copy is None else f"{self.base_url}/img/{number}-{copy}.jpg"
+
+    def respond(self, path):
+        name = urlsplit(path).path.rsplit("/", 1)[-1]
+        if not name.endswith(".jpg"):
+            return 404, "text/plain", b"not found"
+        number = int(name[:-4].split("-")[0])
+        with self._lock:
+            if number not in self._images:
+                self._images[number] = fixture_image(number, self.size)
+        return 200, "image/jpeg", self._images[number]
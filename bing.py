@@ -0,0 +1,54 @@
+"""Image record extraction from Bing image result pages
+
+The results we need are the "m" attributes of the <a class="iusc"> links,
+so instead of building a DOM for the whole page the extractor jumps from
+one "iusc" occurrence to the next, parses just that tag's attributes and
+stops once it has enough records.
+"""
+import html
+import json
+import re
+
+# Records kept per query, enough for every caller of the shared image cache
+IMAGE_RESULTS = 15
+
+_TAG = re.compile(r'<a\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*>', re.IGNORECASE)
+_ATTR = re.compile(r'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+
+
+def _attributes(tag):
+    return {
+        name.lower(): html.unescape(double + single + bare)
+        for name, double, single, bare in _ATTR.findall(tag, 2)
+    }
+
+
+def extract_image_records(page, limit=IMAGE_RESULTS):
+    """Return up to limit {'url', 'title', 'description'} records from a results page"""
+    records = []
+    position = 0
+    while limit is None or len(records) < limit:
+        found = page.find('iusc', position)
+        if found == -1:
+            break
+        position = found + 4
+
+        start = page.rfind('<', 0, found)
+        match = _TAG.match(page, start) if start != -1 else None
+        if match is None or match.end() <= found:
+            continue
+        position = match.end()
+
+        attributes = _attributes(match.group())
+        if 'iusc' not in attributes.get('class', '').split():
+            continue
+        try:
+            m = json.loads(attributes['m'])
+            records.append({
+                'url': m['murl'],
+                'title': m.get('t', 'Image'),
+                'description': m.get('desc', 'No description available')
+            })
+        except (KeyError, TypeError, ValueError):
+            continue
+    return records
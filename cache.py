@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.environ.get("BLOG_CACHE_DIR", ".cache")
+
+# Bing results change slowly, a week keeps reruns consistent without going stale
+IMAGE_CACHE_TTL = 7 * 24 * 3600
+IMAGE_CACHE_MAX_ENTRIES = 5000
+
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# "use" reads and writes the cache, "refresh" skips reads but stores new
+# responses, "bypass" leaves the cache untouched
+CACHE_MODES = ("use", "refresh", "bypass")
+
+_image_cache = None
+_response_cache = None
+_cache_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """Normalize a search query so equivalent queries share one cache entry"""
+    return ' '.join(query.replace('+', ' ').lower().split())
+
+
+class DiskCache:
+    """SQLite-backed JSON cache with TTL expiry and LRU eviction
+
+    The number of entries and their total size are kept up to date by
+    triggers in a one-row usage table, so writes and stats() don't scan
+    the cache and eviction only runs once a limit is passed.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None, max_bytes=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, "
+                "size INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+            if "size" not in columns:
+                # Caches written before sizes were stored
+                self._conn.execute("ALTER TABLE entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute("UPDATE entries SET size = LENGTH(CAST(value AS BLOB))")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO usage SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN "
+                "UPDATE usage SET entries = entries + 1, bytes = bytes + NEW.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN "
+                "UPDATE usage SET bytes = bytes + NEW.size - OLD.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN "
+                "UPDATE usage SET entries = entries - 1, bytes = bytes - OLD.size; END"
+            )
+
+    def get(self, key):
+        """Return the cached value for key, or None when missing or expired"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def peek(self, key):
+        """Return the cached value for key like get, without counting a hit or miss or refreshing its LRU position"""
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries when full"""
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock, self._conn:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete wouldn't fire the usage trigger
+            self._conn.execute(
+                "INSERT INTO entries (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, created = excluded.created, "
+                "accessed = excluded.accessed, size = excluded.size",
+                (key, data, now, now, len(data.encode('utf-8')))
+            )
+            while True:
+                entries, size = self._conn.execute("SELECT entries, bytes FROM usage").fetchone()
+                # Entries over max_entries go at once, over max_bytes one at a time until it fits
+                excess = entries - self.max_entries if self.max_entries is not None else 0
+                if self.max_bytes is not None and size > self.max_bytes:
+                    excess = max(excess, 1)
+                if excess <= 0:
+                    break
+                self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)", (excess,)
+                )
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters, the number of entries and their total size"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT entries, bytes FROM usage").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+def get_image_cache():
+    """Return the process-wide image search cache, opening it on first use"""
+    global _image_cache
+    with _cache_lock:
+        if _image_cache is None:
+            _image_cache = DiskCache(
+                os.path.join(CACHE_DIR, "images.sqlite3"),
+                ttl=IMAGE_CACHE_TTL,
+                max_entries=IMAGE_CACHE_MAX_ENTRIES
+            )
+        return _image_cache
+
+
+def get_response_cache():
+    """Return the process-wide LLM response cache, opening it on first use"""
+    global _response_cache
+    with _cache_lock:
+        if _response_cache is None:
+            _response_cache = DiskCache(
+                os.path.join(CACHE_DIR, "responses.sqlite3"),
+                max_bytes=RESPONSE_CACHE_MAX_BYTES
+            )
+        return _response_cache
+
+
+def response_cache_key(model_name, prompt, generation_config=None):
+    """Hash the model name, prompt text and generation config into a cache key"""
+    payload = json.dumps(
+        {"model": model_name, "prompt": prompt, "generation_config": generation_config},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """Stand-in for a Gemini response that was served from the cache"""
+
+    usage_metadata = None
+    from_cache = True
+
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        # A cached streaming response arrives as a single chunk
+        yield self
+
+
+def _store_when_complete(cache, key, stream):
+    parts = []
+    for chunk in stream:
+        parts.append(chunk.text)
+        yield chunk
+    # Abandoned or failed streams never reach this point, so partial text is never cached
+    cache.set(key, ''.join(parts))
+
+
+def _cached_call(cache, mode, key, call, stream=False):
+    if mode == "bypass":
+        return call()
+
+    if mode == "use":
+        text = cache.get(key)
+        if text is not None:
+            return CachedResponse(text)
+
+    response = call()
+    if stream:
+        return _store_when_complete(cache, key, response)
+    cache.set(key, response.text)
+    return response
+
+
+class CachedModel:
+    """Wrap a GenerativeModel so generate_content goes through the response cache"""
+
+    def __init__(self, model, mode="use", cache=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.model = model
+        self.mode = mode
+        self.cache = cache or get_response_cache()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        key = response_cache_key(self.model.model_name, prompt, generation_config)
+        return _cached_call(
+            self.cache, self.mode, key,
+            lambda: self.model.generate_content(prompt, generation_config=generation_config, **kwargs),
+            stream=kwargs.get("stream", False)
+        )
+
+
+class CachedChatSession:
+    """Wrap a ChatSession so send_message goes through the response cache
+
+    Replies are keyed by the prompt alone, so only sessions that send every
+    prompt on its own (a ChatSessionManager with the "stateless" policy) are
+    cached; a chat keeping a history answers with it and needs every turn
+    added to it, so its messages always go to the session.
+    """
+
+    def __init__(self, session, generation_config=None, mode="use", cache=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.session = session
+        self.generation_config = generation_config
+        self.mode = mode
+        self.cache = cache or get_response_cache()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def send_message(self, prompt, **kwargs):
+        if getattr(self.session, "policy", None) != "stateless":
+            return self.session.send_message(prompt, **kwargs)
+        key = response_cache_key(self.session.model.model_name, prompt, self.generation_config)
+        return _cached_call(
+            self.cache, self.mode, key,
+            lambda: self.session.send_message(prompt, **kwargs),
+            stream=kwargs.get("stream", False)
+        )
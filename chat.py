@@ -0,0 +1,111 @@
+"""Chat sessions with a bounded history
+
+A Gemini chat resends its whole history with every message, so a session
+shared by a batch pays for every earlier title and article again on each
+call. ChatSessionManager keeps the input bounded with one of these history
+policies:
+
+- "stateless": every prompt is sent on its own with generate_content
+- "window": only the last max_turns exchanges are kept
+- "rotate": a fresh chat is started once a call's input passes max_history_tokens
+- "full": the history grows for the life of the session
+
+The prompt tokens of every call are recorded, as the API reports them.
+"""
+import threading
+
+from key_pool import estimate_tokens
+from metrics import MeteredModel
+
+HISTORY_POLICIES = ("stateless", "window", "rotate", "full")
+# The prompts are self-contained ("Forget previous instructions"), so history only adds cost
+DEFAULT_HISTORY_POLICY = "stateless"
+HISTORY_TURNS = 2
+# A 3000-word article is about 4000 tokens
+ROTATE_AFTER_TOKENS = 16000
+
+
+class ChatSessionManager:
+    """send_message over a model with the chat history bounded by a policy
+
+    Stands in for a ChatSession, so CachedChatSession can wrap it and
+    discard_unfinished_turn can rewind it.
+    """
+
+    def __init__(self, model, policy=DEFAULT_HISTORY_POLICY, max_turns=HISTORY_TURNS,
+                 max_history_tokens=ROTATE_AFTER_TOKENS):
+        if policy not in HISTORY_POLICIES:
+            raise ValueError(f"Unknown history policy: {policy}")
+        self.model = model
+        self.policy = policy
+        self.max_turns = max_turns
+        self.max_history_tokens = max_history_tokens
+        # Prompt tokens of every call, in order
+        self.input_tokens = []
+        self.rotations = 0
+        self._chat = None
+        self._lock = threading.Lock()
+
+    @property
+    def history(self):
+        return [] if self._chat is None else self._chat.history
+
+    @property
+    def last(self):
+        return None if self._chat is None else self._chat.last
+
+    def rewind(self):
+        """Drop the last exchange, as ChatSession.rewind does"""
+        if self._chat is not None:
+            return self._chat.rewind()
+
+    def _session(self):
+        """The chat to send the next message on, with its history bounded first"""
+        if self._chat is None or (self.policy == "rotate" and self.input_tokens
+                                  and self.input_tokens[-1] > self.max_history_tokens):
+            if self._chat is not None:
+                self.rotations += 1
+            self._chat = self.model.start_chat(history=[])
+        elif self.policy == "window":
+            history = self._chat.history
+            # An exchange is a user and a model turn
+            if len(history) > 2 * self.max_turns:
+                self._chat.history = history[-2 * self.max_turns:]
+        return self._chat
+
+    def _record(self, response, prompt):
+        usage = getattr(response, "usage_metadata", None)
+        tokens = getattr(usage, "prompt_token_count", 0) if usage is not None else 0
+        with self._lock:
+            self.input_tokens.append(tokens or estimate_tokens(prompt))
+
+    def _recorded_stream(self, stream, prompt):
+        last = None
+        for chunk in stream:
+            last = chunk
+            yield chunk
+        # Streaming responses report the usage of the whole response on the last chunk
+        self._record(last, prompt)
+
+    def send_message(self, prompt, stream=False, **kwargs):
+        if self.policy == "stateless":
+            response = MeteredModel(self.model).generate_content(prompt, stream=stream, **kwargs)
+        else:
+            response = MeteredModel(self._session()).send_message(prompt, stream=stream, **kwargs)
+        if stream:
+            return self._recorded_stream(response, prompt)
+        self._record(response, prompt)
+        return response
+
+    def token_stats(self):
+        """Prompt tokens per call: total, mean, first and last call, and the largest"""
+        tokens = list(self.input_tokens)
+        return {
+            "calls": len(tokens),
+            "input_tokens_total": sum(tokens),
+            "input_tokens_mean": sum(tokens) / len(tokens) if tokens else 0,
+            "input_tokens_first": tokens[0] if tokens else 0,
+            "input_tokens_last": tokens[-1] if tokens else 0,
+            "input_tokens_max": max(tokens, default=0),
+            "rotations": self.rotations,
+        }
@@ -0,0 +1,202 @@
+"""Generate a blog from a topics file without the Streamlit UI
+
+    python cli.py topics.txt --output site.zip
+    python cli.py topics.txt --output site/ --workers 8 --site-name "My Blog"
+    python cli.py --resume <job id> --output site.zip
+    python cli.py topics.txt --output site.zip --metrics-out metrics.prom
+    python cli.py topics.txt --output site.zip --routes routes.json
+    python cli.py topics.txt --output site/ --store
+    python cli.py --store --output site/
+"""
+import argparse
+import logging
+import os
+import sys
+
+from cache import CACHE_MODES
+from export import INDEX_PAGE_SIZE, DirectoryExport, SiteExport, zip_directory
+from generator import TITLE_BATCH_SIZE, build_routed_model, process_bulk_topics
+from postprocess import DEFAULT_PROCESS_WORKERS
+from journal import JobJournal
+from key_pool import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from metrics import start_run
+from routing import single_model_routes
+from pipeline import DEFAULT_MAX_WORKERS
+from store import STORE_DIR, ArticleStore, build_site
+from utils import create_key_pool
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate SEO-optimized blog articles for a list of topics")
+    parser.add_argument("topics", nargs="?", help="text file with one topic per line")
+    parser.add_argument("-o", "--output", required=True, help="ZIP file (*.zip) or directory to write the site to")
+    parser.add_argument("--site-name", default="My Blog")
+    parser.add_argument("--site-description", default="")
+    parser.add_argument("--site-url", help="URL the site is deployed to, needed for sitemap.xml and feed.xml")
+    parser.add_argument("--page-size", type=int, default=INDEX_PAGE_SIZE, help="articles per index page")
+    parser.add_argument("--model", help="send every stage to this one model instead of routing them")
+    parser.add_argument("--routes", metavar="PATH",
+                        help="JSON file mapping stages to the models tried in order (see routing.py)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="topics generated at the same time")
+    parser.add_argument("--cache-mode", choices=CACHE_MODES, default="use", help="how the response cache is used")
+    parser.add_argument("--stream", action="store_true", help="stream article content with early timeouts")
+    parser.add_argument("--mirror-images", action="store_true",
+                        help="download images into assets/ as resized WebP and JPEG variants (needs Pillow)")
+    parser.add_argument("--render-processes", type=int, default=DEFAULT_PROCESS_WORKERS,
+                        help="worker processes formatting and rendering the pages (0: render in this process)")
+    parser.add_argument("--title-batch-size", type=int, default=TITLE_BATCH_SIZE,
+                        help="topics whose titles and meta descriptions are asked for in one call (0: one call each)")
+    parser.add_argument("--optimize", action="store_true",
+                        help="shared hashed CSS/JS, minified pages and precompressed .gz/.br files")
+    parser.add_argument("--keys-file", default="apikey.txt", help="file with one API key per line")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_REQUESTS_PER_MINUTE, help="requests per minute per key")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TOKENS_PER_MINUTE, help="tokens per minute per key")
+    parser.add_argument("--resume", metavar="JOB_ID", help="resume an interrupted job instead of starting a new one")
+    parser.add_argument("--metrics-out", metavar="PATH",
+                        help="write per-stage run metrics as JSON, or Prometheus text if PATH ends in .prom")
+    parser.add_argument("--store", nargs="?", const=STORE_DIR, metavar="DIR",
+                        help="keep the articles in an article store (%(const)s by default) and build the site from "
+                             "every stored article, rendering only the pages that changed; without topics only rebuild")
+    parser.add_argument("--full-rebuild", action="store_true", help="render every page of the stored articles again")
+    args = parser.parse_args(argv)
+    if not args.topics and not args.resume and not args.store:
+        parser.error("a topics file, --resume JOB_ID or --store is required")
+    if args.full_rebuild and not args.store:
+        parser.error("--full-rebuild needs --store")
+    if args.model and args.routes:
+        parser.error("--model and --routes are mutually exclusive")
+    return args
+
+
+def build_store_site(args, store):
+    """Build the site of every stored article into the output directory, or ZIP the store's own site"""
+    directory = args.output
+    if args.output.endswith(".zip"):
+        directory = store.site_directory(args.site_name, args.site_description, args.optimize, args.site_url, args.page_size)
+    with store.site_lock(directory):
+        built = build_site(
+            store, args.site_name, args.site_description, directory, optimize=args.optimize, site_url=args.site_url,
+            page_size=args.page_size, render_workers=args.render_processes, full=args.full_rebuild
+        )
+        if directory != args.output:
+            with open(f"{args.output}.tmp", "wb") as output:
+                zip_directory(directory, output)
+            os.replace(output.name, args.output)
+    logging.info(
+        "Site of %d stored articles: %d pages rendered, %d kept, %d failed, %d files written",
+        built["articles"], built["rendered"], built["kept"], len(built["failed"]), built["files_written"]
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from dotenv import load_dotenv
+
+    # Load environment variables
+    load_dotenv()
+
+    store = ArticleStore(args.store) if args.store else None
+    if store is not None and not args.topics and not args.resume:
+        build_store_site(args, store)
+        return 0
+
+    topics = []
+    if args.topics:
+        with open(args.topics, "r", encoding="utf-8") as f:
+            topics = f.read().split("\n")
+
+    try:
+        key_pool = create_key_pool(args.keys_file, requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+    except ValueError:
+        logging.error("No API keys found in %s or GEMINI_API_KEY(S)", args.keys_file)
+        return 1
+
+    if args.model:
+        routes = single_model_routes(args.model)
+    elif args.routes:
+        with open(args.routes, "r", encoding="utf-8") as f:
+            routes = f.read()
+    else:
+        routes = None
+    try:
+        model = build_routed_model(key_pool, routes, args.cache_mode)
+    except ValueError as e:
+        logging.error("Invalid routes in %s: %s", args.routes, e)
+        return 1
+
+    # Nothing is opened for writing before the keys and routes are known to be good
+    output = None
+    if store is not None:
+        # The site is built from the store once the articles are in it
+        export = None
+    elif args.output.endswith(".zip"):
+        # Written next to the output and moved over it once complete, so a failed run leaves the old one
+        output = open(f"{args.output}.tmp", "wb")
+        export = SiteExport(args.site_name, args.site_description, fileobj=output, optimize=args.optimize,
+                            site_url=args.site_url, page_size=args.page_size)
+    else:
+        export = DirectoryExport(args.site_name, args.site_description, args.output, optimize=args.optimize,
+                                 site_url=args.site_url, page_size=args.page_size)
+
+    journal = JobJournal()
+    if args.resume is None:
+        args.resume = journal.create_job([topic.strip() for topic in topics if topic.strip()])
+    logging.info("Job %s (resume with --resume %s)", args.resume, args.resume)
+
+    run = start_run()
+
+    def on_result(index, topic, article, error):
+        if error is None:
+            logging.info("Generated %s", article["title"])
+
+    articles, stats = process_bulk_topics(
+        topics,
+        model,
+        site_name=args.site_name,
+        site_description=args.site_description,
+        max_workers=args.workers,
+        stream=args.stream,
+        mirror_images=args.mirror_images,
+        postprocess_workers=args.render_processes,
+        title_batch_size=args.title_batch_size,
+        export=export,
+        store=store,
+        journal=journal,
+        job_id=args.resume,
+        on_result=on_result
+    )
+    if store is not None:
+        build_store_site(args, store)
+    else:
+        export.close()
+        if output is not None:
+            output.close()
+            os.replace(output.name, args.output)
+        if args.optimize:
+            logging.info("Site size: %s", export.size_summary())
+
+    if args.metrics_out:
+        with open(args.metrics_out, "w", encoding="utf-8") as f:
+            f.write(run.to_prometheus() if args.metrics_out.endswith(".prom") else run.to_json())
+
+    stages = run.to_dict()["stages"]
+    for name, stage in stages.items():
+        if stage["models"]:
+            logging.info(
+                "Stage %s: %d calls, p50 %.2fs, p95 %.2fs, $%.4f, %d fallbacks (%s)",
+                name, stage["calls"], stage["seconds_p50"], stage["seconds_p95"], stage["cost_usd"],
+                stage["fallbacks"], ", ".join(f"{model}: {calls}" for model, calls in stage["models"].items())
+            )
+    logging.info("Estimated API cost: $%.4f", sum(stage["cost_usd"] for stage in stages.values()))
+
+    logging.info(
+        "%d articles in %.1fs (%.1f articles/min, %d failed), written to %s",
+        stats["completed"], stats["elapsed"], stats["articles_per_minute"], stats["failed"], args.output
+    )
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
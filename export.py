@@ -0,0 +1,364 @@
+import hashlib
+import io
+import itertools
+import math
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+
+from assets import STATIC_DIR, brotli_module, build_assets, compressed_siblings, minify_html
+from metrics import instrument
+from rendering import TEMPLATES_DIR, render, stream
+from search import SearchIndex
+
+# Archives stay in memory up to this size and spill to a temporary file beyond it
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# Already compressed files are stored as they are, deflating them again only costs time
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.gz', '.br')
+
+# Articles per index page: index.html, then page-2.html, page-3.html, ...
+INDEX_PAGE_SIZE = 48
+# URLs per sitemap file allowed by the sitemap protocol, larger sites get a sitemap index
+SITEMAP_MAX_URLS = 50000
+# Most recent articles listed in feed.xml
+FEED_ENTRIES = 50
+
+
+class SiteExport:
+    """Write a GitHub-ready blog export straight into a ZIP archive
+
+    Articles are compressed into the archive as soon as they are added, so
+    only their titles and filenames are kept around for the index and the
+    README. Every export has its own buffer, nothing is shared on disk.
+
+    The index is split into pages of page_size articles. Given the site_url
+    the site is deployed to, sitemap.xml, an Atom feed.xml and robots.txt
+    are written too; they need absolute URLs. Every site gets search.html
+    with a search index built from the articles as they are added.
+
+    With optimize the shared CSS and JS go into hashed files under static/,
+    pages are minified and every file gets precompressed .gz/.br siblings;
+    size_report() then compares the site before and after.
+    """
+
+    def __init__(self, site_name, site_description, fileobj=None, optimize=False, site_url=None,
+                 page_size=INDEX_PAGE_SIZE):
+        self.file = fileobj if fileobj is not None else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.archive = zipfile.ZipFile(self.file, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._start(site_name, site_description, optimize, site_url, page_size)
+
+    def _start(self, site_name, site_description, optimize, site_url, page_size):
+        self.site_name = site_name
+        self.site_description = site_description
+        self.site_url = site_url.rstrip('/') if site_url else None
+        self.page_size = max(1, page_size)
+        self.entries = []
+        self.search = SearchIndex()
+        self.optimize = optimize
+        self.sizes = {"files": 0, "original_bytes": 0, "bytes": 0, "gzip_bytes": 0, "brotli_bytes": None}
+        if optimize and brotli_module() is not None:
+            self.sizes["brotli_bytes"] = 0
+
+        # Copy template assets
+        for directory in (TEMPLATES_DIR, STATIC_DIR):
+            for template in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, template), 'r', encoding='utf-8') as f:
+                    self._write_file(f'templates/{template}', f.read())
+
+        # Context the page templates need to link the shared assets
+        self.assets = build_assets(self.write) if optimize else None
+
+    def write(self, name, data):
+        """Write one file of the site; data is str, bytes or an iterable of str pieces"""
+        if not self.optimize:
+            self._write_file(name, data)
+            return
+
+        if not isinstance(data, (str, bytes)):
+            data = ''.join(data)
+        if name.endswith('.html'):
+            original, data = data.encode('utf-8'), ''.join(minify_html([data])).encode('utf-8')
+        else:
+            original = data = data.encode('utf-8') if isinstance(data, str) else data
+        self._write_file(name, data)
+
+        self.sizes["files"] += 1
+        self.sizes["original_bytes"] += len(original)
+        self.sizes["bytes"] += len(data)
+        compressed = dict(compressed_siblings(name, data))
+        for sibling, sibling_data in compressed.items():
+            self._write_file(sibling, sibling_data)
+        self.sizes["gzip_bytes"] += len(compressed.get(f"{name}.gz", data))
+        if self.sizes["brotli_bytes"] is not None:
+            self.sizes["brotli_bytes"] += len(compressed.get(f"{name}.br", data))
+
+    def size_report(self):
+        """Total site size before and after optimizing: original, minified, and as served with gzip or brotli"""
+        return dict(self.sizes)
+
+    def size_summary(self):
+        """One line describing size_report()"""
+        sizes = self.sizes
+        summary = (
+            f"{sizes['files']} files: {sizes['original_bytes'] / 1024:.1f} KB → "
+            f"{sizes['bytes'] / 1024:.1f} KB minified, {sizes['gzip_bytes'] / 1024:.1f} KB gzip"
+        )
+        if sizes["brotli_bytes"] is not None:
+            summary += f", {sizes['brotli_bytes'] / 1024:.1f} KB brotli"
+        return summary
+
+    def _write_file(self, name, data):
+        if not isinstance(data, (str, bytes)):
+            with io.TextIOWrapper(self.archive.open(name, 'w'), encoding='utf-8', newline='') as f:
+                f.writelines(data)
+            return
+        compress_type = zipfile.ZIP_STORED if name.endswith(STORED_EXTENSIONS) else None
+        self.archive.writestr(name, data, compress_type=compress_type)
+
+    @instrument("export")
+    def add_article(self, article):
+        """Add one rendered article to the site"""
+        self.write(f"articles/{article['filename']}", article["html"])
+        self.add_entry(article)
+
+    def add_entry(self, article, search_weights=None):
+        """List an article in the index, README, sitemap, feed and search without writing its page"""
+        self.entries.append({
+            "title": article["title"],
+            "filename": article["filename"],
+            "description": article.get("meta_description", ""),
+            "updated": article.get("updated") or _timestamp(),
+        })
+        self.search.add(
+            article["title"], f"articles/{article['filename']}", article.get("meta_description", ""),
+            article.get("content_html") or article.get("content", ""), weights=search_weights
+        )
+
+    @instrument("export")
+    def finish(self):
+        """Write the index pages, the search, README.md and, with a site_url, the sitemap and feed once every article was added"""
+        pages = max(1, math.ceil(len(self.entries) / self.page_size))
+        feed_url = 'feed.xml' if self.site_url else None
+        for page in range(1, pages + 1):
+            entries = self.entries[(page - 1) * self.page_size:page * self.page_size]
+            self.write(index_page_name(page), stream('index.html', assets=self.assets, **index_context(
+                entries, self.site_name, self.site_description, page, pages, feed_url, 'search.html'
+            )))
+        self.search.write(self.write)
+        self.write('search.html', stream('search.html', assets=self.assets, root='', site_name=self.site_name))
+        self.write('README.md', render_readme(self.entries, self.site_name, self.site_description))
+
+        if self.site_url:
+            updated = _timestamp()
+            self._write_sitemap(sitemap_urls(self.site_url, self.entries, pages, updated), pages + len(self.entries), updated)
+            self.write('feed.xml', stream('feed.xml', **feed_context(
+                self.entries, self.site_name, self.site_description, self.site_url, updated
+            )))
+            self.write('robots.txt', f"User-agent: *\nAllow: /\n\nSitemap: {self.site_url}/sitemap.xml\n")
+
+    def _write_sitemap(self, urls, count, updated):
+        """Write sitemap.xml, or sitemap-N.xml files and a sitemap.xml index when there are too many URLs for one"""
+        if count <= SITEMAP_MAX_URLS:
+            self.write('sitemap.xml', stream('sitemap.xml', urls=urls))
+            return
+        names = [f'sitemap-{number}.xml' for number in range(1, math.ceil(count / SITEMAP_MAX_URLS) + 1)]
+        for name in names:
+            # Each file takes the next URLs from the same generator as it is written
+            self.write(name, stream('sitemap.xml', urls=itertools.islice(urls, SITEMAP_MAX_URLS)))
+        self.write('sitemap.xml', stream(
+            'sitemap_index.xml', sitemaps=[f'{self.site_url}/{name}' for name in names], updated=updated
+        ))
+
+    def close(self):
+        """Finish the site and the archive and return its file object"""
+        self.finish()
+        self.archive.close()
+        self.file.seek(0)
+        return self.file
+
+
+class DirectoryExport(SiteExport):
+    """Write the same site as SiteExport into a directory instead of a ZIP archive"""
+
+    def __init__(self, site_name, site_description, directory, optimize=False, site_url=None,
+                 page_size=INDEX_PAGE_SIZE):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._start(site_name, site_description, optimize, site_url, page_size)
+
+    def _write_file(self, name, data):
+        path = os.path.join(self.directory, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, bytes):
+            with open(path, 'wb') as f:
+                f.write(data)
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.writelines([data] if isinstance(data, str) else data)
+
+    def close(self):
+        """Finish the site and return its directory"""
+        self.finish()
+        return self.directory
+
+
+class IncrementalExport(DirectoryExport):
+    """DirectoryExport that leaves the files unchanged since the previous build alone
+
+    previous maps every file of the previous build to its hash, hashes
+    collects this build's. Files are hashed by their bytes; article pages
+    can instead be checked against the hash of their inputs with
+    unchanged() before they are rendered at all, and keep()-ed. Files of the
+    previous build that this one didn't produce are deleted when it closes.
+    With rewrite every file is written again, whatever its hash.
+    """
+
+    def __init__(self, site_name, site_description, directory, previous=None, optimize=False, site_url=None,
+                 page_size=INDEX_PAGE_SIZE, rewrite=False):
+        self.previous = previous or {}
+        self.rewrite = rewrite
+        self.hashes = {}
+        self.written = 0
+        self.kept = 0
+        super().__init__(site_name, site_description, directory, optimize, site_url, page_size)
+
+    def _path(self, name):
+        return os.path.join(self.directory, *name.split('/'))
+
+    def _write_file(self, name, data):
+        if not isinstance(data, (str, bytes)):
+            data = ''.join(data)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        self.hashes[name] = digest
+        if self.unchanged(name, digest):
+            self.kept += 1
+            return
+        self.written += 1
+        super()._write_file(name, data)
+
+    def unchanged(self, name, digest):
+        """Whether the file was built from inputs hashing to digest last time and is still there"""
+        return not self.rewrite and self.previous.get(name) == digest and os.path.exists(self._path(name))
+
+    def keep(self, name, digest):
+        """Keep a file of the previous build, and its compressed siblings, without writing it again"""
+        self.hashes[name] = digest
+        for sibling in (f'{name}.gz', f'{name}.br'):
+            if sibling in self.previous:
+                self.hashes[sibling] = self.previous[sibling]
+        self.kept += 1
+
+    def write_page(self, name, data, digest):
+        """Write a page checked with unchanged(), remembering the hash of its inputs"""
+        self.write(name, data)
+        self.hashes[name] = digest
+
+    def close(self):
+        """Finish the site, delete the files of the previous build it no longer has and return its directory"""
+        self.finish()
+        for name in self.previous.keys() - self.hashes.keys():
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        return self.directory
+
+
+def zip_directory(directory, fileobj=None):
+    """ZIP a built site directory file by file and return the archive's file object"""
+    file = fileobj if fileobj is not None else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for root, _, files in os.walk(directory):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, '/')
+                compress_type = zipfile.ZIP_STORED if name.endswith(STORED_EXTENSIONS) else None
+                archive.write(path, name, compress_type=compress_type)
+    file.seek(0)
+    return file
+
+
+def _timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def index_page_name(page):
+    return 'index.html' if page == 1 else f'page-{page}.html'
+
+
+def index_context(entries, site_name, site_description, page=1, pages=1, feed_url=None, search_url=None):
+    return {
+        "entries": entries,
+        "site_name": site_name,
+        "site_description": site_description,
+        "year": datetime.now().year,
+        "page": page,
+        "pages": pages,
+        "previous_page": index_page_name(page - 1) if page > 1 else None,
+        "next_page": index_page_name(page + 1) if page < pages else None,
+        "feed_url": feed_url,
+        "search_url": search_url,
+    }
+
+
+def render_index(entries, site_name, site_description):
+    """Render a single index.html with a card for every entry"""
+    return render('index.html', **index_context(entries, site_name, site_description))
+
+
+def sitemap_urls(site_url, entries, pages, updated):
+    """Generate the (url, lastmod) pair of every index page and article"""
+    for page in range(1, pages + 1):
+        yield f"{site_url}/{index_page_name(page) if page > 1 else ''}", updated
+    for entry in entries:
+        yield f"{site_url}/articles/{entry['filename']}", entry["updated"]
+
+
+def feed_context(entries, site_name, site_description, site_url, updated):
+    """Context of feed.xml: the FEED_ENTRIES most recently added articles, newest first"""
+    return {
+        "entries": entries[:-FEED_ENTRIES - 1:-1],
+        "site_name": site_name,
+        "site_description": site_description,
+        "site_url": site_url,
+        "updated": entries[-1]["updated"] if entries else updated,
+    }
+
+
+def render_readme(entries, site_name, site_description):
+    """Render the README.md listing every article"""
+    return f"""# {site_name}
+
+A collection of SEO-optimized blog articles generated with AI.
+
+## Articles
+
+{chr(10).join(f"- [{entry['title']}](articles/{entry['filename']})" for entry in entries)}
+
+## About
+
+{site_description}
+
+## Setup
+
+1. Clone this repository
+2. Open index.html in your browser
+3. Deploy to GitHub Pages for online access
+
+## License
+
+MIT
+"""
+
+
+def create_github_export(articles, site_name, site_description, fileobj=None, optimize=False, site_url=None,
+                         page_size=INDEX_PAGE_SIZE):
+    """Create a GitHub-ready export of the blog and return the ZIP file object"""
+    export = SiteExport(site_name, site_description, fileobj, optimize, site_url, page_size)
+    for article in articles:
+        export.add_article(article)
+    return export.close()
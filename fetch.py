@@ -0,0 +1,99 @@
+import asyncio
+import random
+import threading
+import time
+
+from metrics import record_retry
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+POOL_SIZE = 32
+MAX_CONCURRENT_FETCHES = 16
+
+# Throttling and server errors are worth another try, anything else is final
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the requests session shared by every outbound fetch, so connections are kept alive and reused"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry attempt (1-based)"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def fetch(url, params=None, headers=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=MAX_RETRIES):
+    """GET a URL through the shared session and return the response
+
+    Connection errors, timeouts and throttling or server error statuses are
+    retried up to retries times with jittered backoff; the last failure is
+    raised, as is any other error status.
+    """
+    import requests
+
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeout)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                response.raise_for_status()
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        record_retry()
+        time.sleep(backoff_delay(attempt + 1))
+
+
+async def fetch_async(url, semaphore=None, **kwargs):
+    """Awaitable fetch(); the request runs on a thread using the shared session's connection pool"""
+    if semaphore is None:
+        return await asyncio.to_thread(fetch, url, **kwargs)
+    async with semaphore:
+        return await asyncio.to_thread(fetch, url, **kwargs)
+
+
+def fetch_all(targets, max_concurrency=MAX_CONCURRENT_FETCHES, on_result=None, **kwargs):
+    """Fetch many (url, params) pairs concurrently, at most max_concurrency at a time
+
+    Returns a (response, error) pair per request, in order.
+    on_result(index, response, error) is called as each request finishes.
+    """
+    async def one(index, url, params, semaphore):
+        try:
+            response, error = await fetch_async(url, semaphore, params=params, **kwargs), None
+        except Exception as e:
+            response, error = None, e
+        if on_result is not None:
+            on_result(index, response, error)
+        return response, error
+
+    async def gather():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(*(one(index, url, params, semaphore) for index, (url, params) in enumerate(targets)))
+
+    return asyncio.run(gather())
@@ -0,0 +1,112 @@
+"""Spread images evenly through an article's sections
+
+SectionFormatter splits content into sections once, while it arrives chunk
+by chunk, and remembers each section's word count. Once the whole article
+is known close() picks the sections to follow with an image so the images
+are evenly spaced by words (or sections), and yields the article as pieces
+for the caller to join once or write as they come.
+"""
+
+
+def spread(weights, count):
+    """Indices of the sections to follow with an image: count of them, evenly spaced by the sections' weights"""
+    count = min(count, len(weights))
+    total = sum(weights)
+    positions = []
+    cumulative = 0
+    for index, weight in enumerate(weights):
+        if len(positions) == count:
+            break
+        cumulative += weight
+        target = total * (len(positions) + 1) / (count + 1)
+        # Never leave more images than sections still to come
+        if cumulative >= target or len(weights) - index <= count - len(positions):
+            positions.append(index)
+    return positions
+
+
+class SectionFormatter:
+    """Split content into sections at separator and place images evenly between them
+
+    The separator is dropped and put back around the placed images when
+    keep_separator is False (paragraphs split at blank lines), or starts the
+    next section when it is True (HTML split at "<h2"). At most one image
+    follows a section and at most one image is placed per sections_per_image
+    sections. render_image(image) returns the HTML of a placed image.
+    """
+
+    def __init__(self, images, separator, keep_separator=False, render_image=str, max_images=None,
+                 sections_per_image=1, by_words=True):
+        self.images = images if max_images is None else images[:max_images]
+        self.separator = separator
+        self.keep_separator = keep_separator
+        self.joiner = '' if keep_separator else separator
+        self.render_image = render_image
+        self.sections_per_image = sections_per_image
+        self.by_words = by_words
+        self.reset()
+
+    def reset(self):
+        self.sections = []
+        self.weights = []
+        self._parts = []
+        self._carry = ''
+        self._positions = None
+
+    def _end_section(self):
+        section = ''.join(self._parts)
+        self._parts = []
+        if self.keep_separator and not section and not self.sections:
+            # Content starting with the separator has no section before it
+            return
+        self.sections.append(section)
+        self.weights.append(len(section.split()) if self.by_words else 1)
+
+    def feed(self, chunk):
+        """Split off the sections the content received so far completes"""
+        separator = self.separator
+        # A separator may straddle two chunks, so the tail that could start one is carried over
+        *complete, rest = (self._carry + chunk).split(separator)
+        for text in complete:
+            self._parts.append(text)
+            self._end_section()
+            if self.keep_separator:
+                self._parts.append(separator)
+        keep_from = max(0, len(rest) - len(separator) + 1)
+        self._parts.append(rest[:keep_from])
+        self._carry = rest[keep_from:]
+
+    def _finish(self):
+        """End the content and pick the sections to follow with an image, once"""
+        if self._positions is None:
+            self._parts.append(self._carry)
+            self._carry = ''
+            self._end_section()
+            count = min(len(self.images), len(self.sections) // self.sections_per_image)
+            self._positions = spread(self.weights, count)
+        return self._positions
+
+    def placed_images(self):
+        """End the content and return the images close() places, in order"""
+        return self.images[:len(self._finish())]
+
+    def close(self):
+        """End the content and yield the formatted article piece by piece"""
+        positions = self._finish()
+        images = iter(self.images)
+        following = 0
+        for index, section in enumerate(self.sections):
+            if index:
+                yield self.joiner
+            yield section
+            if following < len(positions) and positions[following] == index:
+                yield self.joiner
+                yield self.render_image(next(images))
+                following += 1
+
+
+def format_sections(content, images, separator, **options):
+    """Format a complete article with SectionFormatter and return its pieces"""
+    formatter = SectionFormatter(images, separator, **options)
+    formatter.feed(content)
+    return formatter.close()
@@ -0,0 +1,763 @@
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+from datetime import datetime
+
+from bing import IMAGE_RESULTS, extract_image_records
+from cache import CachedModel, get_image_cache, normalize_query
+from fetch import fetch, fetch_all
+from formatting import SectionFormatter
+from images import ImageMirror, image_tag, localize, pillow_available
+from key_pool import PooledModel
+from metrics import MeteredModel, instrument, record_failure
+from pipeline import DEFAULT_MAX_WORKERS, run_concurrently, run_stages
+from postprocess import DEFAULT_PROCESS_WORKERS, PostProcessor, article_stats, gather
+from rendering import get_template, render, stream
+from routing import DEFAULT_MODEL, RoutedModel, load_routes
+from streaming import stream_text
+
+logger = logging.getLogger(__name__)
+
+BING_IMAGES_URL = 'https://www.bing.com/images/search'
+
+BLOG_TEMPLATE = 'blog_template.html'
+
+def get_blog_template():
+    """Return the article page template"""
+    return get_template(BLOG_TEMPLATE)
+
+def build_model(key_pool, model_name, cache_mode="use"):
+    """Build the model used for generation: cached responses first, then whichever pooled key has capacity
+
+    Token usage is recorded for the calls that actually reach the API.
+    """
+    return CachedModel(MeteredModel(PooledModel(key_pool, model_name)), mode=cache_mode)
+
+def build_routed_model(key_pool, routes=None, cache_mode="use", default_model=DEFAULT_MODEL):
+    """Build a model sending each stage to the models routed for it (see routing.py), each built like build_model"""
+    return RoutedModel(
+        load_routes(routes, default_model),
+        lambda model_name: build_model(key_pool, model_name, cache_mode)
+    )
+
+@instrument("title")
+def generate_engaging_title(model, topic):
+    """Generate a professional and SEO-optimized title"""
+    title_prompt = f"""
+    Create one SEO-optimized title about: {topic}
+
+    Requirements:
+    - Include primary keyword naturally
+    - 50-60 characters (optimal for search engines)
+    - Use power words that drive clicks
+    - Include numbers or specific benefits when relevant
+    - Match search intent
+    - Avoid clickbait while maintaining interest
+    
+    Return only the optimized title, no additional text.
+    """
+    
+    generation_config = {
+        "temperature": 0.8,
+        "top_p": 0.95,
+        "top_k": 64,
+    }
+    
+    response = model.generate_content(title_prompt, generation_config=generation_config)
+    return response.text.strip().replace('"', '').replace('#', '').strip()
+
+@instrument("meta_description")
+def generate_meta_description(model, topic, title):
+    """Generate an SEO-optimized meta description"""
+    meta_prompt = f"""
+    Create a compelling meta description for an article about {topic} with title: {title}
+
+    Requirements:
+    - 150-160 characters long
+    - Include primary keyword naturally
+    - Clear value proposition
+    - Call-to-action
+    - Match search intent
+    
+    Return only the meta description, no additional text.
+    """
+    
+    generation_config = {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 64,
+    }
+    
+    response = model.generate_content(meta_prompt, generation_config=generation_config)
+    return response.text.strip()
+
+# Topics whose titles and meta descriptions are asked for in one JSON call; 0 asks topic by topic
+TITLE_BATCH_SIZE = 10
+# Accepted lengths of batched answers, a little looser than the prompts ask for
+TITLE_LENGTH = (20, 80)
+META_DESCRIPTION_LENGTH = (80, 200)
+
+TITLES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "title": {"type": "string"},
+            "meta_description": {"type": "string"},
+        },
+        "required": ["index", "title", "meta_description"],
+    },
+}
+
+def _valid_text(value, length):
+    """The stripped text when it is a string of an accepted length, None otherwise"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if length[0] <= len(value) <= length[1] else None
+
+@instrument("titles_batch")
+def generate_titles_and_metas(model, topics):
+    """Generate the titles and meta descriptions of several topics in one JSON-mode call
+
+    Returns {index in topics: {"title": ..., "meta_description": ...}}
+    holding only the answers that passed validation; the caller generates
+    the missing ones topic by topic.
+    """
+    listing = '\n'.join(f"{index}. {topic}" for index, topic in enumerate(topics))
+    batch_prompt = f"""
+    For each numbered topic below, create one SEO-optimized title and a meta description.
+
+    Title requirements:
+    - Include primary keyword naturally
+    - 50-60 characters (optimal for search engines)
+    - Use power words that drive clicks
+    - Include numbers or specific benefits when relevant
+    - Avoid clickbait while maintaining interest
+
+    Meta description requirements:
+    - 150-160 characters long
+    - Include primary keyword naturally
+    - Clear value proposition and a call-to-action
+
+    Answer with one object per topic, with the topic's number as its index.
+
+    Topics:
+    {listing}
+    """
+    
+    generation_config = {
+        "temperature": 0.8,
+        "top_p": 0.95,
+        "top_k": 64,
+        "response_mime_type": "application/json",
+        "response_schema": TITLES_SCHEMA,
+    }
+    
+    response = model.generate_content(batch_prompt, generation_config=generation_config)
+    items = json.loads(response.text)
+    if not isinstance(items, list):
+        raise ValueError("Batched titles are not a JSON array")
+    
+    answers = {}
+    for item in items:
+        index = item.get("index") if isinstance(item, dict) else None
+        if not isinstance(index, int) or not 0 <= index < len(topics) or index in answers:
+            continue
+        answer = {
+            "title": _valid_text(item.get("title"), TITLE_LENGTH),
+            "meta_description": _valid_text(item.get("meta_description"), META_DESCRIPTION_LENGTH),
+        }
+        answers[index] = {name: value for name, value in answer.items() if value is not None}
+    return answers
+
+def batch_titles(model, entries, batch_size=TITLE_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS, on_artifact=None, initializer=None):
+    """Fill in the title and meta_description artifacts of entries with batched calls
+
+    Only topics missing either are asked for. A batch that fails, or
+    answers that don't pass validation, leave the artifact out so
+    generate_topic_article makes its per-topic call instead.
+    on_artifact(position, name, value) sees every artifact filled in.
+    Returns the number of batch calls and of topics left to per-topic calls.
+    """
+    missing = [
+        position for position, entry in enumerate(entries)
+        if "title" not in entry["artifacts"] or "meta_description" not in entry["artifacts"]
+    ]
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    
+    def generate(batch):
+        return generate_titles_and_metas(model, [entries[position]["topic"] for position in batch])
+    
+    results, _ = run_concurrently(batches, generate, max_workers=max_workers, initializer=initializer)
+    fallbacks = 0
+    for batch, (answers, error) in zip(batches, results):
+        if error is not None:
+            logger.warning("Batched titles failed, generating them per topic: %s", error)
+            answers = {}
+        for index, position in enumerate(batch):
+            artifacts = entries[position]["artifacts"]
+            answer = answers.get(index, {})
+            # A new title needs a new meta description, a kept title only an answered one
+            if "title" not in artifacts and "title" in answer:
+                artifacts["title"] = answer["title"]
+                if on_artifact is not None:
+                    on_artifact(position, "title", answer["title"])
+            if ("meta_description" not in artifacts and "meta_description" in answer
+                    and "title" in answer and artifacts.get("title") == answer["title"]):
+                artifacts["meta_description"] = answer["meta_description"]
+                if on_artifact is not None:
+                    on_artifact(position, "meta_description", answer["meta_description"])
+            fallbacks += "title" not in artifacts or "meta_description" not in artifacts
+    return {"batches": len(batches), "fallbacks": fallbacks}
+
+@instrument("content")
+def generate_article_content(model, topic, title, on_chunk=None, on_retry=None):
+    """Generate comprehensive article content in HTML format
+
+    When on_chunk is given the response is streamed: every chunk is passed
+    to on_chunk as it arrives, and a request that is slow to start or stalls
+    is retried early (on_retry is called before each retry).
+    """
+    content_prompt = f"""
+    Write a comprehensive, SEO-optimized article about: {topic}
+    Title: {title}
+    
+    Requirements:
+    - 2000-3000 words
+    - Return the content in clean HTML format using these tags:
+      - <h2> for main sections
+      - <h3> for subsections
+      - <p> for paragraphs
+      - <ul> and <li> for unordered lists
+      - <ol> and <li> for ordered lists
+      - <strong> for emphasis
+      - <em> for italics
+      - <blockquote> for quotes
+    - Include relevant statistics and examples
+    - Make content visually appealing with proper spacing
+    - Include a strong introduction and conclusion
+    - Add calls-to-action where appropriate
+    - Use proper HTML structure
+    - NO markdown formatting
+    
+    Return ONLY the HTML content, no additional text or formatting.
+    """
+    
+    generation_config = {
+        "temperature": 0.8,
+        "top_p": 0.95,
+        "top_k": 64,
+    }
+    
+    if on_chunk is not None:
+        return stream_text(
+            lambda: model.generate_content(content_prompt, generation_config=generation_config, stream=True),
+            on_chunk=on_chunk,
+            on_retry=on_retry
+        )
+    
+    response = model.generate_content(content_prompt, generation_config=generation_config)
+    return response.text
+
+def clean_filename(title):
+    """Convert title to URL-friendly slug"""
+    title = title.lower()
+    title = re.sub(r'[^a-z0-9\s-]', '', title)
+    title = re.sub(r'[-\s]+', '-', title)
+    return title.strip('-')
+
+def bing_search_params(query):
+    return {'q': query, 'form': 'HDRSC2'}
+
+@instrument("image_search")
+def search_bing_images(query, num_images=15):
+    """Search for images using Bing, reusing cached results for the same query
+
+    A search of the query that prefetch_images has in flight is waited for
+    instead of being sent again.
+    """
+    cache = get_image_cache()
+    cache_key = normalize_query(query)
+    with _prefetching_lock:
+        prefetching = _prefetching.get(cache_key)
+    if prefetching is not None:
+        prefetching.wait()
+    records = cache.get(cache_key)
+    
+    if records is None:
+        try:
+            response = fetch(BING_IMAGES_URL, params=bing_search_params(query))
+            records = extract_image_records(response.text, max(num_images, IMAGE_RESULTS))
+        except Exception as e:
+            logger.error("Error searching images: %s", e)
+            record_failure()
+            return []
+        
+        # Don't cache empty pages, they are usually a blocked or failed request
+        if records:
+            cache.set(cache_key, records)
+    
+    return [{'url': r['url'], 'title': r['title']} for r in records[:num_images]]
+
+# Normalized query -> Event set once prefetch_images has stored or given up on its search
+_prefetching = {}
+_prefetching_lock = threading.Lock()
+
+def _claim_prefetch(queries):
+    """Register an Event for every uncached query no prefetch has in flight yet and return (key, query) pairs
+
+    The cache is looked up without counting hits or misses, those are
+    counted once by search_bing_images.
+    """
+    cache = get_image_cache()
+    keys = {}
+    with _prefetching_lock:
+        for query in queries:
+            key = normalize_query(query)
+            if key not in keys and key not in _prefetching and cache.peek(key) is None:
+                keys[key] = query
+                _prefetching[key] = threading.Event()
+    return list(keys.items())
+
+@instrument("image_prefetch")
+def _prefetch(keys):
+    cache = get_image_cache()
+
+    def on_result(index, response, error):
+        key = keys[index][0]
+        try:
+            if error is None:
+                records = extract_image_records(response.text)
+                if records:
+                    cache.set(key, records)
+        finally:
+            with _prefetching_lock:
+                _prefetching.pop(key).set()
+
+    try:
+        fetch_all([(BING_IMAGES_URL, bing_search_params(query)) for _, query in keys], on_result=on_result)
+    finally:
+        # Searches that never finished must not leave their waiters blocked
+        with _prefetching_lock:
+            for key, _ in keys:
+                event = _prefetching.pop(key, None)
+                if event is not None:
+                    event.set()
+
+def prefetch_images(queries):
+    """Run the image searches for every uncached query concurrently and fill the image cache
+
+    Every result is stored as soon as it arrives. Failed searches are left
+    for search_bing_images to retry and report.
+    """
+    keys = _claim_prefetch(queries)
+    if keys:
+        _prefetch(keys)
+
+def prefetch_images_in_background(queries):
+    """Start prefetch_images on a thread, so the first model calls don't wait for every search
+
+    The queries are claimed before it returns, so searches started right
+    after wait for the prefetch instead of being sent twice.
+    """
+    keys = _claim_prefetch(queries)
+    if not keys:
+        return None
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_prefetch, keys), daemon=True)
+    thread.start()
+    return thread
+
+# Images are spaced out by words, with at least two sections per image
+SECTIONS_PER_IMAGE = 2
+
+def content_image_html(image):
+    return (
+        f'<div class="content-image-container">'
+        f'{image_tag(image, image["title"], "content-image", "(min-width: 896px) 832px, 100vw")}'
+        f'<p class="image-caption">{image["title"]}</p>'
+        f'</div>\n'
+    )
+
+def content_formatter(images):
+    """Formatter spreading every image but the featured one evenly between the <h2> sections of the content"""
+    return SectionFormatter(
+        images[1:], '<h2', keep_separator=True, render_image=content_image_html, sections_per_image=SECTIONS_PER_IMAGE
+    )
+
+def referenced_image_urls(record):
+    """URLs of the images an article's page shows: the featured one, those placed in the content and the related cards'"""
+    images = record["images"]
+    if not images:
+        return []
+    formatter = content_formatter(images)
+    formatter.feed(record["content"])
+    # blog_page_context shows images[1] on related article cards and images[-1] on placeholder cards
+    shown = [images[0], *formatter.placed_images(), *images[1:2], images[-1]]
+    return list(dict.fromkeys(image["url"] for image in shown))
+
+def format_content_header(images, title, meta_description):
+    """Format the meta description and featured image shown above the content"""
+    header = [f'<div class="meta-description">{meta_description}</div>']
+    
+    # Add featured image
+    if images:
+        header.append(f'<div class="featured-image-container">{image_tag(images[0], title, "featured-image", lazy=False)}</div>')
+    
+    return '\n'.join(header)
+
+def format_content_with_images(content, images, title, meta_description, content_html=None):
+    """Format content with images interspersed
+
+    content_html is the body already formatted by a content_formatter while
+    the content was streamed, which avoids a second pass over the article.
+    """
+    if content_html is None:
+        formatter = content_formatter(images)
+        formatter.feed(content)
+        content_html = ''.join(formatter.close())
+    
+    return format_content_header(images, title, meta_description) + '\n' + content_html
+
+def blog_page_context(title, content, meta_description, images, site_name="My Blog", site_description="", all_articles=None, content_html=None, assets=None, read_time=None):
+    """Build the template context of an article page
+
+    assets are the shared static files of an optimized export, see assets.build_assets.
+    """
+    featured_image = images[0] if images else None
+    if read_time is None:
+        read_time = len(content.split()) // 200  # Assuming 200 words per minute reading speed
+    
+    # Format content with images
+    content_with_images = format_content_with_images(content, images, title, meta_description, content_html)
+    
+    # Generate related articles from actual articles
+    related_articles = []
+    if all_articles:
+        # Filter out current article and get up to 2 random articles
+        other_articles = [a for a in all_articles if a["title"] != title]
+        selected_articles = random.sample(other_articles, min(2, len(other_articles)))
+        
+        for article in selected_articles:
+            related_articles.append({
+                "title": article["title"],
+                "url": article["filename"],
+                "image": images[1] if len(images) > 1 else {"url": ""},
+                "excerpt": meta_description[:100] + "..."
+            })
+    
+    # If we don't have enough related articles, pad with placeholders
+    while len(related_articles) < 2:
+        related_articles.append({
+            "title": "Explore More Articles",
+            "url": "/",
+            "image": images[-1] if images else {"url": ""},
+            "excerpt": "Discover more interesting articles on our site"
+        })
+    
+    return {
+        "title": title,
+        "content": content_with_images,
+        "meta_description": meta_description,
+        "featured_image": featured_image,
+        "date": datetime.now().strftime("%B %d, %Y"),
+        "read_time": read_time,
+        "site_name": site_name,
+        "site_description": site_description,
+        "year": datetime.now().year,
+        "related_articles": related_articles,
+        "assets": assets,
+        # Article pages live in articles/, below the shared assets
+        "root": "../"
+    }
+
+@instrument("render")
+def generate_blog_html(title, content, meta_description, images, site_name="My Blog", site_description="", all_articles=None, content_html=None, assets=None):
+    """Generate complete blog HTML using the template"""
+    return render(BLOG_TEMPLATE, **blog_page_context(
+        title, content, meta_description, images, site_name, site_description, all_articles, content_html, assets
+    ))
+
+@instrument("render")
+def stream_blog_html(title, content, meta_description, images, site_name="My Blog", site_description="", all_articles=None, content_html=None, assets=None, read_time=None):
+    """Like generate_blog_html, but return the page as an iterator of pieces for a writer to consume
+
+    The template itself runs while the pieces are consumed, so its time shows
+    up in the writer's stage.
+    """
+    return stream(BLOG_TEMPLATE, **blog_page_context(
+        title, content, meta_description, images, site_name, site_description, all_articles, content_html, assets,
+        read_time
+    ))
+
+def format_article(record, mirrored=None):
+    """Post-processing step: format the content with its images, using the local variants of mirrored images"""
+    if mirrored:
+        record["images"] = localize(record["images"], mirrored)
+        # Content formatted while streaming still links the remote images
+        record["content_html"] = None
+    if record.get("content_html") is None:
+        formatter = content_formatter(record["images"])
+        formatter.feed(record["content"])
+        record["content_html"] = ''.join(formatter.close())
+    return record
+
+@instrument("render")
+def render_article(record, site_name="My Blog", site_description="", assets=None):
+    """Post-processing step: render the article page into record["html"]
+
+    record["related"] are the articles the page links to.
+    """
+    record["html"] = render(BLOG_TEMPLATE, **blog_page_context(
+        record["title"], record["content"], record["meta_description"], record["images"], site_name, site_description,
+        record.get("related"), record.get("content_html"), assets, record.get("read_time")
+    ))
+    return record
+
+def stream_article(record, site_name="My Blog", site_description="", assets=None):
+    """Like render_article, but return the page as pieces for the export to write as they are produced"""
+    return stream_blog_html(
+        record["title"], record["content"], record["meta_description"], record["images"], site_name, site_description,
+        record.get("related"), record.get("content_html"), assets, record.get("read_time")
+    )
+
+def pick_related(articles, index, count=2):
+    """Title and filename of up to count random other articles, for the page of articles[index]"""
+    picks = random.sample(range(len(articles) - 1), min(count, len(articles) - 1))
+    return [
+        {"title": articles[pick]["title"], "filename": articles[pick]["filename"]}
+        for pick in (pick + (pick >= index) for pick in picks)
+    ]
+
+def stream_formatted_content(model, topic, title, images, on_preview=None):
+    """Stream the article content, formatting it with images as the chunks arrive
+
+    on_preview(title, text) sees the raw content received so far after every chunk.
+    """
+    formatter = content_formatter(images)
+    raw = []
+    
+    def on_chunk(chunk):
+        raw.append(chunk)
+        formatter.feed(chunk)
+        if on_preview is not None:
+            on_preview(title, ''.join(raw))
+    
+    def on_retry(attempt):
+        # Throw away the partial output of the timed out attempt
+        formatter.reset()
+        raw.clear()
+    
+    content = generate_article_content(model, topic, title, on_chunk=on_chunk, on_retry=on_retry)
+    return {"content": content, "content_html": ''.join(formatter.close())}
+
+def generate_topic_article(model, topic, stream=False, on_preview=None, artifacts=None, on_artifact=None, initializer=None):
+    """Generate the title, meta description, content and images for one topic
+
+    The image search only needs the topic, so it runs alongside the title;
+    the meta description and content both wait for the title and then run
+    side by side. Streamed content also waits for the images so it can be
+    formatted while it arrives. Stages found in artifacts (from an earlier,
+    interrupted run) are not repeated; on_artifact(name, value) sees every
+    stage as it finishes. initializer runs on every stage thread.
+    """
+    artifacts = artifacts or {}
+    
+    def stage(name, dependencies, func):
+        if name in artifacts:
+            return ((), lambda: artifacts[name])
+        
+        def run(**kwargs):
+            value = func(**kwargs)
+            if on_artifact is not None:
+                on_artifact(name, value)
+            return value
+        return (dependencies, run)
+    
+    if stream:
+        content_stage = stage("content", ("title", "images"), lambda title, images: stream_formatted_content(model, topic, title, images, on_preview))
+    else:
+        content_stage = stage("content", ("title",), lambda title: {"content": generate_article_content(model, topic, title)})
+    
+    stages = run_stages({
+        "title": stage("title", (), lambda: generate_engaging_title(model, topic)),
+        "images": stage("images", (), lambda: search_bing_images(topic)),
+        "meta_description": stage("meta_description", ("title",), lambda title: generate_meta_description(model, topic, title)),
+        "content": content_stage,
+    }, initializer=initializer)
+    title = stages["title"]
+
+    return {
+        "topic": topic,
+        "title": title,
+        "filename": f"{clean_filename(title)}.html",
+        "meta_description": stages["meta_description"],
+        "images": stages["images"],
+        **stages["content"]  # Store the content for regenerating HTML later
+    }
+
+def mirror_writer(export, store):
+    """Writer for ImageMirror putting the images into the export, the store or both"""
+    if store is None:
+        return export.write
+    if export is None:
+        return store.write_asset
+
+    def write(name, data):
+        export.write(name, data)
+        store.write_asset(name, data)
+    return write
+
+def process_bulk_topics(topics, model, site_name="My Blog", site_description="", max_workers=DEFAULT_MAX_WORKERS,
+                        stream=False, on_preview=None, export=None, journal=None, job_id=None, on_result=None,
+                        initializer=None, mirror_images=False, postprocess_workers=DEFAULT_PROCESS_WORKERS,
+                        title_batch_size=TITLE_BATCH_SIZE, store=None):
+    """Process multiple topics concurrently and generate articles
+
+    Returns the generated articles and the run's throughput stats. When an
+    export is given every rendered page goes straight into it instead of
+    being kept on the returned articles. With a journal every topic's
+    progress is recorded as it happens; passing the job_id of an interrupted
+    job resumes it, skipping the stages that already finished.
+    on_result(index, topic, article, error) is called from the calling
+    thread as topics finish, initializer runs on every worker thread.
+    With mirror_images the images are downloaded into the export's assets/
+    folder as resized WebP and JPEG variants (needs Pillow) and the pages
+    use those instead of linking the remote images.
+    Formatting and page rendering run on postprocess_workers processes, in
+    batches; content formatting starts as soon as a batch of topics is done.
+    Titles and meta descriptions are generated title_batch_size topics per
+    call up front (0 for one call each per topic).
+    With a store (store.ArticleStore) every article is kept in it as soon as
+    it is generated, so an interrupted run keeps what it finished, and again
+    once formatted; mirrored images go into its assets. Without an export the
+    pages are left for store.build_site to render.
+    """
+    if journal is None:
+        entries = [{"topic": topic.strip(), "artifacts": {}} for topic in topics if topic.strip()]
+    else:
+        if job_id is None:
+            job_id = journal.create_job([topic.strip() for topic in topics if topic.strip()])
+        entries = journal.topics(job_id)
+    topics = [entry["topic"] for entry in entries]
+    
+    # Image searches only need the topic, get them in flight while the titles are generated
+    prefetch_images_in_background([entry["topic"] for entry in entries if "images" not in entry["artifacts"]])
+    
+    if title_batch_size > 0:
+        on_batch_artifact = None
+        if journal is not None:
+            on_batch_artifact = lambda position, name, value: journal.record_artifact(job_id, position, name, value)
+        batched = batch_titles(model, entries, title_batch_size, max_workers, on_batch_artifact, initializer)
+        if batched["batches"]:
+            logger.info("Titles in %d batched calls, %d topics left to per-topic calls", batched["batches"], batched["fallbacks"])
+
+    def generate(position):
+        on_artifact = None
+        if journal is not None:
+            on_artifact = lambda name, value: journal.record_artifact(job_id, position, name, value)
+        return generate_topic_article(
+            model, topics[position], stream, on_preview,
+            artifacts=entries[position]["artifacts"],
+            on_artifact=on_artifact,
+            initializer=initializer
+        )
+
+    processor = PostProcessor(postprocess_workers)
+    mirror_images = mirror_images and (export is not None or store is not None)
+    # Without mirroring the content is formatted in batches while the other topics are still generated
+    prepare_steps = (article_stats, format_article)
+    prepared, pending = [], []
+
+    def submit_pending():
+        if pending:
+            prepared.append(([index for index, _ in pending], processor.submit(prepare_steps, [a for _, a in pending])))
+            pending.clear()
+
+    def on_topic_result(index, article, error):
+        if error is not None:
+            logger.error("Error processing topic '%s': %s", topics[index], error)
+        if journal is not None:
+            journal.set_state(job_id, index, "failed" if error is not None else "written", error and str(error))
+        if error is None and store is not None:
+            store.add(article)
+        if on_result is not None:
+            on_result(index, topics[index], article, error)
+        if error is None and not mirror_images:
+            pending.append((index, article))
+            if len(pending) == processor.batch_size:
+                submit_pending()
+
+    with processor:
+        results, stats = run_concurrently(
+            range(len(topics)),
+            generate,
+            max_workers=max_workers,
+            on_result=on_topic_result,
+            initializer=initializer
+        )
+        submit_pending()
+        # Worker processes return copies of the articles, a failed step leaves the article as generated
+        articles = {position: article for position, (article, error) in enumerate(results) if error is None}
+        for batch, futures in prepared:
+            for position, (record, error) in zip(batch, gather(futures)):
+                if error is None:
+                    articles[position] = record
+        positions = sorted(articles)
+        generated_articles = [articles[position] for position in positions]
+        
+        mirrored = {}
+        # Rendering in this process, pages go into the export piece by piece as the template produces them;
+        # worker processes can only send back finished pages
+        stream_pages = export is not None and processor.max_workers == 0
+        render_steps = (render_article,)
+        if stream_pages or (export is None and store is not None):
+            # Pages of a store without an export are rendered when its site is built
+            render_steps = ()
+        if mirror_images:
+            render_steps = prepare_steps + render_steps
+            if pillow_available():
+                mirror = ImageMirror(mirror_writer(export, store))
+                # Only the images the pages show, not every search result
+                mirrored = mirror.mirror([url for article in generated_articles for url in referenced_image_urls(article)])
+            else:
+                logger.warning("Pillow is not installed, linking the remote images instead of mirroring them")
+        
+        # Pages link to related articles, so they are only rendered once every article is known
+        for i, article in enumerate(generated_articles):
+            article["related"] = pick_related(generated_articles, i)
+        options = {
+            "format_article": {"mirrored": mirrored},
+            "render_article": {
+                "site_name": site_name,
+                "site_description": site_description,
+                "assets": export.assets if export is not None else None,
+            },
+        }
+        rendered = []
+        for position, (article, error) in zip(positions, gather(processor.submit(render_steps, generated_articles, options))):
+            if error is not None:
+                logger.error("Error rendering topic '%s': %s", topics[position], error)
+                if journal is not None:
+                    journal.set_state(job_id, position, "failed", str(error))
+                continue
+            if store is not None:
+                store.add(article)
+            if stream_pages:
+                export.add_article({**article, "html": stream_article(article, **options["render_article"])})
+            elif export is not None:
+                export.add_article(article)
+            if "html" in article and (export is not None or store is not None):
+                # The page is in the export or is built from the store, don't keep it around
+                del article["html"]
+            rendered.append(article)
+            if journal is not None:
+                journal.set_state(job_id, position, "rendered")
+    
+    if journal is not None:
+        journal.finish_job(job_id)
+    return rendered, stats
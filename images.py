@@ -0,0 +1,172 @@
+"""Mirror remote article images into the site as resized WebP and JPEG variants
+
+Pillow is optional: it is only imported when images are mirrored
+(pip install Pillow). Without mirroring pages keep linking the remote images.
+"""
+import hashlib
+import io
+import logging
+
+from fetch import fetch_all
+from metrics import instrument
+from pipeline import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+# Widths of the srcset variants; images are never scaled up
+VARIANT_WIDTHS = (480, 800, 1200)
+THUMBNAIL_WIDTH = 160
+WEBP_QUALITY = 80
+# Method 2 is about 2.5x faster than the default 4 for ~7% larger files
+WEBP_METHOD = 2
+JPEG_QUALITY = 82
+ASSETS_DIR = 'assets/images'
+# Images downloaded and converted at a time; a 1600px JPEG is a few hundred KB
+MIRROR_CHUNK = 64
+# Article pages live in articles/, one level below the assets
+ASSETS_URL = '../assets/images'
+
+
+def pillow_available():
+    try:
+        import PIL
+    except ImportError:
+        return False
+    return True
+
+
+def image_tag(image, alt, css_class="", sizes="100vw", lazy=True):
+    """Render an image as a responsive <picture> when it was mirrored, as a plain <img> otherwise
+
+    Images at the top of the page should pass lazy=False so they are not held back.
+    """
+    if 'srcset' not in image:
+        return f'<img src="{image["url"]}" alt="{alt}" class="{css_class}">'
+    return (
+        f'<picture>'
+        f'<source type="image/webp" srcset="{image["webp_srcset"]}" sizes="{sizes}">'
+        f'<img src="{image["src"]}" srcset="{image["srcset"]}" sizes="{sizes}" width="{image["width"]}" '
+        f'height="{image["height"]}" loading="{"lazy" if lazy else "eager"}" decoding="async" alt="{alt}" class="{css_class}">'
+        f'</picture>'
+    )
+
+
+def localize(images, mirrored):
+    """Return image dicts with the local variants of every mirrored image merged in"""
+    return [{**image, **mirrored[image['url']]} if image['url'] in mirrored else image for image in images]
+
+
+def _encode(picture, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        picture.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        picture.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=WEBP_METHOD)
+    return buffer.getvalue()
+
+
+def render_variants(data):
+    """Decode one downloaded image and return its variants as {(width, extension): (size, bytes)}"""
+    from PIL import Image, ImageOps
+
+    picture = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip detail the largest variant can't show anyway
+    picture.draft('RGB', (VARIANT_WIDTHS[-1], VARIANT_WIDTHS[-1]))
+    picture = ImageOps.exif_transpose(picture)
+    if picture.mode != 'RGB':
+        # JPEG has no alpha channel, flatten transparent images onto white
+        background = Image.new('RGB', picture.size, 'white')
+        rgba = picture.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        picture = background
+
+    widths = {width for width in VARIANT_WIDTHS if width < picture.width}
+    widths.add(min(picture.width, VARIANT_WIDTHS[-1]))
+    widths.add(min(picture.width, THUMBNAIL_WIDTH))
+
+    # Each variant is scaled down from the next larger one, which is much cheaper than from the original
+    variants = {}
+    for width in sorted(widths, reverse=True):
+        if width < picture.width:
+            picture = picture.resize((width, max(1, round(picture.height * width / picture.width))), Image.LANCZOS)
+        variants[width, 'webp'] = (picture.size, _encode(picture, 'WEBP'))
+        variants[width, 'jpg'] = (picture.size, _encode(picture, 'JPEG'))
+    return variants
+
+
+class ImageMirror:
+    """Download images once, deduplicated by content hash, and write their variants with write(name, data)
+
+    mirror(urls) returns {url: variant info} for every image that could be
+    downloaded and decoded; the info is merged into the article's image dicts
+    by localize() and rendered by image_tag().
+    """
+
+    def __init__(self, write, max_workers=4, assets_dir=ASSETS_DIR, assets_url=ASSETS_URL):
+        self.write = write
+        self.max_workers = max_workers
+        self.assets_dir = assets_dir
+        self.assets_url = assets_url
+        self.by_url = {}
+        self.by_hash = {}
+
+    def _store(self, digest, variants):
+        """Write the variants of one image and return the info image_tag() needs"""
+        urls = {}
+        for (width, extension), (size, data) in variants.items():
+            name = f"{digest}-{width}.{extension}"
+            self.write(f"{self.assets_dir}/{name}", data)
+            urls[width, extension] = (f"{self.assets_url}/{name}", size)
+
+        widths = sorted({width for width, extension in variants})
+        thumbnail = min(widths)
+        largest = max(widths)
+        # Variants that are too small for the page would only be picked for thumbnails
+        page_widths = [width for width in widths if width > THUMBNAIL_WIDTH] or widths
+        width, height = urls[largest, 'jpg'][1]
+        return {
+            'src': urls[largest, 'jpg'][0],
+            'srcset': ', '.join(f"{urls[w, 'jpg'][0]} {w}w" for w in page_widths),
+            'webp_srcset': ', '.join(f"{urls[w, 'webp'][0]} {w}w" for w in page_widths),
+            'width': width,
+            'height': height,
+            'thumbnail': urls[thumbnail, 'jpg'][0],
+            'thumbnail_webp': urls[thumbnail, 'webp'][0],
+        }
+
+    @instrument("image_mirror")
+    def mirror(self, urls):
+        """Mirror every URL not seen before and return the variant info of all mirrored URLs
+
+        Images are downloaded and converted MIRROR_CHUNK at a time, so only
+        one chunk of them is held in memory.
+        """
+        pending = [url for url in dict.fromkeys(urls) if url and url not in self.by_url]
+        for start in range(0, len(pending), MIRROR_CHUNK):
+            self._mirror_chunk(pending[start:start + MIRROR_CHUNK])
+        return {
+            url: self.by_hash[self.by_url[url]]
+            for url in dict.fromkeys(urls)
+            if url in self.by_url and self.by_url[url] in self.by_hash
+        }
+
+    def _mirror_chunk(self, pending):
+        downloads = fetch_all([(url, None) for url in pending])
+
+        # The same picture is often found under several URLs, only render it once
+        fresh = {}
+        for url, (response, error) in zip(pending, downloads):
+            if error is not None:
+                logger.warning("Could not download image %s: %s", url, error)
+                continue
+            digest = hashlib.sha256(response.content).hexdigest()[:16]
+            fresh.setdefault(digest, (url, response.content))
+            self.by_url[url] = digest
+
+        new = [(digest, data) for digest, (url, data) in fresh.items() if digest not in self.by_hash]
+        results, stats = run_concurrently(new, lambda item: render_variants(item[1]), max_workers=self.max_workers)
+        for (digest, data), (variants, error) in zip(new, results):
+            if error is not None:
+                logger.warning("Could not convert image %s: %s", fresh[digest][0], error)
+                continue
+            self.by_hash[digest] = self._store(digest, variants)
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+DATA_DIR = os.environ.get("BLOG_DATA_DIR", ".data")
+JOURNAL_PATH = os.path.join(DATA_DIR, "jobs.sqlite3")
+
+# A topic moves pending -> titled -> written -> rendered, or ends up failed
+TOPIC_STATES = ("pending", "titled", "written", "rendered", "failed")
+
+# Stage artifacts and the journal columns they are stored in
+ARTIFACT_COLUMNS = {
+    "title": ("title",),
+    "meta_description": ("meta_description",),
+    "images": ("images",),
+    "content": ("content", "content_html"),
+}
+
+
+class JobJournal:
+    """SQLite journal of batch jobs, their topics' states and intermediate artifacts
+
+    Every finished stage is written as soon as it completes, so a job that
+    was interrupted can be resumed without repeating finished stages.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, created REAL NOT NULL, status TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS topics ("
+                "job_id TEXT NOT NULL, position INTEGER NOT NULL, topic TEXT NOT NULL, state TEXT NOT NULL, "
+                "title TEXT, meta_description TEXT, images TEXT, content TEXT, content_html TEXT, "
+                "error TEXT, updated REAL NOT NULL, PRIMARY KEY (job_id, position))"
+            )
+
+    def create_job(self, topics):
+        """Record a new job with all its topics pending and return its id"""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO jobs (id, created, status) VALUES (?, ?, 'running')", (job_id, now))
+            self._conn.executemany(
+                "INSERT INTO topics (job_id, position, topic, state, updated) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, position, topic, now) for position, topic in enumerate(topics)]
+            )
+        return job_id
+
+    def record_artifact(self, job_id, position, name, value):
+        """Store one finished stage's output; a title also moves the topic to titled"""
+        columns = ARTIFACT_COLUMNS[name]
+        if name == "images":
+            values = (json.dumps(value),)
+        elif name == "content":
+            values = (value["content"], value.get("content_html"))
+        else:
+            values = (value,)
+
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        if name == "title":
+            assignments += ", state = 'titled'"
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE topics SET {assignments}, updated = ? WHERE job_id = ? AND position = ?",
+                (*values, time.time(), job_id, position)
+            )
+
+    def set_state(self, job_id, position, state, error=None):
+        """Move a topic to another state, keeping the error message of failures"""
+        if state not in TOPIC_STATES:
+            raise ValueError(f"Unknown topic state: {state}")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE topics SET state = ?, error = ?, updated = ? WHERE job_id = ? AND position = ?",
+                (state, error, time.time(), job_id, position)
+            )
+
+    def finish_job(self, job_id):
+        """Mark a job completed when every topic was rendered"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'completed' WHERE id = ? AND NOT EXISTS ("
+                "SELECT 1 FROM topics WHERE job_id = ? AND state != 'rendered')",
+                (job_id, job_id)
+            )
+
+    def dismiss_job(self, job_id):
+        """Take a job off the unfinished list, e.g. once its failures were seen; it can still be resumed by id"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = 'dismissed' WHERE id = ? AND status != 'completed'", (job_id,))
+
+    def topics(self, job_id):
+        """Return the job's topics in order with their state and the artifacts found so far"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM topics WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+
+        topics = []
+        for row in rows:
+            artifacts = {}
+            for name in ("title", "meta_description"):
+                if row[name] is not None:
+                    artifacts[name] = row[name]
+            if row["images"] is not None:
+                artifacts["images"] = json.loads(row["images"])
+            if row["content"] is not None:
+                artifacts["content"] = {"content": row["content"], "content_html": row["content_html"]}
+            topics.append({"topic": row["topic"], "state": row["state"], "error": row["error"], "artifacts": artifacts})
+        return topics
+
+    def unfinished_jobs(self):
+        """List jobs that still have topics to generate or render and weren't dismissed, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT jobs.id, jobs.created, COUNT(*) AS total, "
+                "SUM(topics.state IN ('written', 'rendered')) AS written, "
+                "SUM(topics.state = 'failed') AS failed "
+                "FROM jobs JOIN topics ON topics.job_id = jobs.id "
+                "WHERE jobs.status NOT IN ('completed', 'dismissed') GROUP BY jobs.id ORDER BY jobs.created DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,289 @@
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import record_retry
+
+# Free-tier Gemini limits, override per pool for paid keys
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_COOLDOWN = 60
+
+QUOTA_ERROR_PATTERN = re.compile(r"\b429\b|quota|rate.?limit|resource.?exhausted", re.IGNORECASE)
+
+# Set while a call has somewhere else to go, e.g. the next tier of a route
+_skip_cooling = contextvars.ContextVar("key_pool_skip_cooling", default=False)
+
+
+class KeysCoolingDown(Exception):
+    """Every key is cooling down for the model of a call that doesn't wait for them; counts as a quota error"""
+
+    code = 429
+
+
+@contextmanager
+def without_waiting_for_cooldowns():
+    """Pool calls made inside raise KeysCoolingDown instead of waiting while every key cools down for their model"""
+    token = _skip_cooling.set(True)
+    try:
+        yield
+    finally:
+        _skip_cooling.reset(token)
+
+
+def is_quota_error(error):
+    """Check whether an exception is a 429 / quota-exceeded response"""
+    status = getattr(error, "code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        if int(status) == 429:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return bool(QUOTA_ERROR_PATTERN.search(str(error)))
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used before the real count is known"""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Per-minute budget that refills continuously"""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be consumed (0 when it can be consumed now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class PooledKey:
+    """One API key with its own request and token budgets and cooldown for each model
+
+    Gemini quotas are per model, so a quota error of one model leaves the
+    key's other models usable.
+    """
+
+    def __init__(self, key, requests_per_minute, tokens_per_minute, clock):
+        self.key = key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.clock = clock
+        # Model name -> (request bucket, token bucket), made on the model's first call
+        self.budgets = {}
+        # Model name -> clock time its cooldown ends
+        self.cooldown_until = {}
+        self.calls = 0
+        self.quota_errors = 0
+
+    def budget(self, model):
+        if model not in self.budgets:
+            self.budgets[model] = (
+                TokenBucket(self.requests_per_minute, self.clock), TokenBucket(self.tokens_per_minute, self.clock)
+            )
+        return self.budgets[model]
+
+    def cooling_down(self, model, now):
+        return self.cooldown_until.get(model, 0.0) > now
+
+    def wait_time(self, estimated_tokens, now, model=None):
+        requests, tokens = self.budget(model)
+        return max(
+            self.cooldown_until.get(model, 0.0) - now, requests.wait_time(1), tokens.wait_time(estimated_tokens)
+        )
+
+
+class KeyPool:
+    """Schedule API calls across several keys with per-key budgets, cooldowns and AIMD concurrency
+
+    Calls go to whichever key has request and token capacity left for the
+    call's model. A key that returns a quota error is put in cooldown and
+    skipped for that model, and that model's concurrency limit is halved;
+    every success grows it again additively. Other models are unaffected.
+    """
+
+    def __init__(self, keys, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, cooldown=DEFAULT_COOLDOWN,
+                 initial_concurrency=None, max_concurrency=None, max_attempts=None, clock=time.monotonic):
+        keys = list(dict.fromkeys(key for key in keys if key))
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key")
+
+        self.clock = clock
+        self.cooldown = cooldown
+        self.keys = [PooledKey(key, requests_per_minute, tokens_per_minute, clock) for key in keys]
+        self.max_concurrency = max_concurrency or 16 * len(keys)
+        self.initial_concurrency = float(min(self.max_concurrency, initial_concurrency or 4 * len(keys)))
+        # Model name -> its concurrency limit and calls in flight
+        self.concurrency_limits = {}
+        self.model_in_flight = {}
+        self.max_attempts = max_attempts or 2 * len(keys)
+        self.in_flight = 0
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def concurrency_limit(self, model=None):
+        with self._condition:
+            return self.concurrency_limits.get(model, self.initial_concurrency)
+
+    def acquire(self, estimated_tokens=0, timeout=None, model=None):
+        """Block until a key has capacity for model and a concurrency slot is free, then reserve it
+
+        Inside without_waiting_for_cooldowns, raises KeysCoolingDown instead
+        of waiting when every key is cooling down for model.
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._condition:
+            while True:
+                now = self.clock()
+                if _skip_cooling.get() and all(pooled.cooling_down(model, now) for pooled in self.keys):
+                    raise KeysCoolingDown(f"Every API key is cooling down after quota errors of {model}")
+                wait = None
+                limit = self.concurrency_limits.get(model, self.initial_concurrency)
+                if self.model_in_flight.get(model, 0) < int(limit):
+                    # Start scanning after the last key used so load spreads evenly
+                    for offset in range(len(self.keys)):
+                        index = (self._next + offset) % len(self.keys)
+                        pooled = self.keys[index]
+                        key_wait = pooled.wait_time(estimated_tokens, now, model)
+                        if key_wait <= 0:
+                            requests, tokens = pooled.budget(model)
+                            requests.consume(1)
+                            tokens.consume(estimated_tokens)
+                            pooled.calls += 1
+                            self.in_flight += 1
+                            self.model_in_flight[model] = self.model_in_flight.get(model, 0) + 1
+                            self._next = (index + 1) % len(self.keys)
+                            return pooled
+                        wait = key_wait if wait is None else min(wait, key_wait)
+
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise TimeoutError("No API key had capacity before the timeout")
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+
+    def release(self, pooled, error=None, estimated_tokens=0, used_tokens=None, model=None):
+        """Return a reserved key and adapt the model's concurrency limit to the outcome"""
+        with self._condition:
+            self.in_flight -= 1
+            self.model_in_flight[model] -= 1
+            if used_tokens is not None:
+                pooled.budget(model)[1].consume(used_tokens - estimated_tokens)
+
+            limit = self.concurrency_limits.get(model, self.initial_concurrency)
+            if error is not None and is_quota_error(error):
+                pooled.quota_errors += 1
+                pooled.cooldown_until[model] = self.clock() + self.cooldown
+                self.concurrency_limits[model] = max(1.0, limit / 2)
+            elif error is None:
+                self.concurrency_limits[model] = min(float(self.max_concurrency), limit + 1.0 / limit)
+            self._condition.notify_all()
+
+    def call(self, func, estimated_tokens=0, model=None):
+        """Run func(key) on a key with capacity for model, moving to another key on quota errors"""
+        for attempt in range(self.max_attempts):
+            pooled = self.acquire(estimated_tokens, model=model)
+            try:
+                result = func(pooled.key)
+            except Exception as e:
+                self.release(pooled, error=e, estimated_tokens=estimated_tokens, model=model)
+                if not is_quota_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                record_retry()
+                continue
+
+            usage = getattr(result, "usage_metadata", None)
+            self.release(
+                pooled,
+                estimated_tokens=estimated_tokens,
+                used_tokens=getattr(usage, "total_token_count", None) or None,
+                model=model
+            )
+            return result
+
+    def stats(self):
+        """Return the lowest and per-model concurrency limits and per-key call, error and cooldown counters"""
+        with self._condition:
+            now = self.clock()
+            return {
+                "concurrency_limit": int(min(self.concurrency_limits.values(), default=self.initial_concurrency)),
+                "concurrency_limits": {model: int(limit) for model, limit in self.concurrency_limits.items()},
+                "in_flight": self.in_flight,
+                "keys": [
+                    {
+                        "key": f"…{pooled.key[-4:]}",
+                        "calls": pooled.calls,
+                        "quota_errors": pooled.quota_errors,
+                        "cooling_down": any(pooled.cooling_down(model, now) for model in pooled.cooldown_until),
+                        "cooling_models": sorted(
+                            str(model) for model in pooled.cooldown_until if pooled.cooling_down(model, now)
+                        ),
+                    }
+                    for pooled in self.keys
+                ],
+            }
+
+
+class PooledModel:
+    """GenerativeModel stand-in that runs every call on whichever pooled key has capacity
+
+    start_chat returns a regular ChatSession over the pooled model, so
+    every message of a chat is scheduled through the pool too.
+    """
+
+    def __init__(self, pool, model_name, client_options=None, **model_kwargs):
+        import google.generativeai as genai
+
+        self.pool = pool
+        self.client_options = client_options or {}
+        self._genai = genai
+        self._model_kwargs = model_kwargs
+        self._models = {}
+        self._lock = threading.Lock()
+        # Answers what ChatSession asks of its model besides generate_content
+        self._template = genai.GenerativeModel(model_name=model_name, **model_kwargs)
+        self.model_name = self._template.model_name
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def _model_for(self, key):
+        with self._lock:
+            if key not in self._models:
+                from google.ai import generativelanguage as glm
+
+                # genai.configure() is process-wide, so bind a dedicated client to each key
+                model = self._genai.GenerativeModel(model_name=self.model_name, **self._model_kwargs)
+                model._client = glm.GenerativeServiceClient(client_options={**self.client_options, "api_key": key})
+                self._models[key] = model
+            return self._models[key]
+
+    def generate_content(self, contents, **kwargs):
+        return self.pool.call(
+            lambda key: self._model_for(key).generate_content(contents, **kwargs),
+            estimated_tokens=estimate_tokens(str(contents)),
+            model=self.model_name
+        )
+
+    def start_chat(self, history=None):
+        return self._genai.ChatSession(self, history=history)
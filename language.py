@@ -0,0 +1,163 @@
+"""Language detection of subjects, memoized and batched
+
+langdetect's profiles are loaded once per process and kept; every
+detection afterwards only samples the subject's n-grams. Subjects are
+memoized by their normalized text in a bounded LRU, so repeated and
+near-duplicate subjects (case, spacing) are detected once. Plain-ASCII
+subjects are scored against the Latin-script profiles only, skipping the
+languages of other scripts that could not win for them anyway. Large
+batches of new subjects are spread over worker processes, since detection
+is pure Python and holds the GIL.
+"""
+import functools
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_LANGUAGE = "English"
+# Distinct normalized subjects remembered; about 100 bytes each
+LANGUAGE_CACHE_SIZE = 10000
+# New subjects in one batch below which worker processes cost more than they save
+PARALLEL_MIN_SUBJECTS = 2000
+# langdetect profiles of the languages written in the Latin script
+LATIN_PROFILES = (
+    "af", "ca", "cs", "cy", "da", "de", "en", "es", "et", "fi", "fr", "hr", "hu", "id", "it", "lt",
+    "lv", "nl", "no", "pl", "pt", "ro", "sk", "sl", "so", "sq", "sv", "sw", "tl", "tr", "vi",
+)
+
+_factories = {}
+_factories_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _factory(latin):
+    """The loaded detector factory, all profiles or the Latin-script ones, built once per process"""
+    with _factories_lock:
+        if latin not in _factories:
+            from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+
+            factory = DetectorFactory()
+            if latin:
+                profiles = []
+                for code in LATIN_PROFILES:
+                    with open(os.path.join(PROFILES_DIRECTORY, code), "r", encoding="utf-8") as f:
+                        profiles.append(f.read())
+                factory.load_json_profile(profiles)
+            else:
+                factory.load_profile(PROFILES_DIRECTORY)
+            # Ensure consistent language detection
+            factory.set_seed(0)
+            _factories[latin] = factory
+        return _factories[latin]
+
+
+def warm_up():
+    """Load the profiles now rather than on the first detection"""
+    _factory(False)
+    _factory(True)
+
+
+def normalize_subject(subject):
+    return " ".join(subject.split()).lower()
+
+
+@functools.lru_cache(maxsize=None)
+def language_name(code):
+    """English name of a langdetect code, e.g. "French" for "fr" """
+    from langcodes import Language
+
+    try:
+        return Language.get(code).display_name()
+    except Exception:
+        return DEFAULT_LANGUAGE
+
+
+def _detect(subject):
+    """Detect the language of one subject without the memo"""
+    subject = " ".join(subject.split())
+    if not any(c.isalpha() for c in subject):
+        return DEFAULT_LANGUAGE
+    try:
+        detector = _factory(subject.isascii()).create()
+        detector.append(subject)
+        return language_name(detector.detect())
+    except Exception:
+        return DEFAULT_LANGUAGE  # Default to English if detection fails
+
+
+def _detect_many(subjects):
+    return [_detect(subject) for subject in subjects]
+
+
+def _remember(key, language):
+    with _cache_lock:
+        _cache[key] = language
+        _cache.move_to_end(key)
+        while len(_cache) > LANGUAGE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _cached(key):
+    with _cache_lock:
+        language = _cache.get(key)
+        if language is not None:
+            _cache.move_to_end(key)
+        return language
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def detect_language(subject):
+    """Detect the language of a given subject"""
+    key = normalize_subject(subject)
+    language = _cached(key)
+    if language is None:
+        language = _detect(subject)
+        _remember(key, language)
+    return language
+
+
+def detect_languages(subjects, max_workers=None):
+    """Detect the language of every subject and return the names in order
+
+    Each distinct normalized subject is detected once. When more than
+    PARALLEL_MIN_SUBJECTS of them are new, they are split over up to
+    max_workers processes (the CPU count by default, 0 to stay in-process).
+    """
+    subjects = list(subjects)
+    keys = [normalize_subject(subject) for subject in subjects]
+    languages = {}
+    new = {}
+    for key, subject in zip(keys, subjects):
+        if key in languages or key in new:
+            continue
+        language = _cached(key)
+        if language is None:
+            new[key] = subject
+        else:
+            languages[key] = language
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # Every worker gets at least PARALLEL_MIN_SUBJECTS subjects
+    workers = min(max_workers, len(new) // PARALLEL_MIN_SUBJECTS)
+    if workers > 1:
+        pending = list(new.values())
+        # A few chunks per worker balance uneven subjects without pickling each one separately
+        chunk = -(-len(pending) // (workers * 4))
+        chunks = [pending[start:start + chunk] for start in range(0, len(pending), chunk)]
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=warm_up) as executor:
+            detected = [language for part in executor.map(_detect_many, chunks) for language in part]
+    else:
+        detected = _detect_many(new.values())
+    for key, language in zip(new, detected):
+        languages[key] = language
+        _remember(key, language)
+    return [languages[key] for key in keys]
@@ -0,0 +1,261 @@
+import bisect
+import contextvars
+import functools
+import json
+import threading
+import time
+
+# Wall time buckets in seconds, from a cache hit up to a slow 3000-word article
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_run = contextvars.ContextVar("metrics_run", default=None)
+_current_stage = contextvars.ContextVar("metrics_stage", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram, cheap enough to update on every call"""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class StageMetrics:
+    """Wall time, token, retry and failure counters for one stage"""
+
+    def __init__(self):
+        self.wall_time = Histogram()
+        self.failures = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.fallbacks = 0
+        self.cost_usd = 0.0
+        # Model name -> calls it answered
+        self.models = {}
+
+    def to_dict(self):
+        count = self.wall_time.count
+        return {
+            "calls": count,
+            "failures": self.failures,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "fallbacks": self.fallbacks,
+            "cost_usd": self.cost_usd,
+            "models": dict(self.models),
+            "seconds_total": self.wall_time.sum,
+            "seconds_mean": self.wall_time.sum / count if count else 0.0,
+            "seconds_p50": self.wall_time.quantile(0.5),
+            "seconds_p95": self.wall_time.quantile(0.95),
+            "buckets": dict(zip([*map(str, self.wall_time.buckets), "+Inf"], self.wall_time.counts)),
+        }
+
+
+class RunMetrics:
+    """Per-run metrics of every instrumented stage"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageMetrics()
+        return self.stages[name]
+
+    def observe(self, stage, seconds, failed=False):
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.wall_time.observe(seconds)
+            metrics.failures += failed
+
+    def add_failure(self, stage):
+        with self._lock:
+            self._stage(stage).failures += 1
+
+    def add_retry(self, stage):
+        with self._lock:
+            self._stage(stage).retries += 1
+
+    def add_tokens(self, stage, prompt_tokens, output_tokens):
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.prompt_tokens += prompt_tokens
+            metrics.output_tokens += output_tokens
+
+    def add_fallback(self, stage):
+        with self._lock:
+            self._stage(stage).fallbacks += 1
+
+    def add_model_call(self, stage, model_name, cost_usd):
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.models[model_name] = metrics.models.get(model_name, 0) + 1
+            metrics.cost_usd += cost_usd
+
+    def to_dict(self):
+        with self._lock:
+            return {"started": self.started, "stages": {name: stage.to_dict() for name, stage in self.stages.items()}}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix="blog_generator"):
+        """Render the run in the Prometheus text exposition format"""
+        stages = self.to_dict()["stages"]
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time per stage call",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name, stage in stages.items():
+            cumulative = 0
+            for bound, count in stage["buckets"].items():
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["seconds_total"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["calls"]}')
+
+        for metric, help_text in (
+            ("failures", "Failed stage calls"),
+            ("retries", "Retried requests"),
+            ("prompt_tokens", "Prompt tokens sent"),
+            ("output_tokens", "Output tokens received"),
+            ("fallbacks", "Calls moved to a fallback model"),
+            ("cost_usd", "Estimated API cost in USD"),
+        ):
+            lines.append(f"# HELP {prefix}_{metric}_total {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric}_total counter")
+            for name, stage in stages.items():
+                lines.append(f'{prefix}_{metric}_total{{stage="{name}"}} {stage[metric]}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_run():
+    """Start collecting metrics for a new run in the current context and return them"""
+    run = RunMetrics()
+    _current_run.set(run)
+    return run
+
+
+def current_run():
+    return _current_run.get()
+
+
+def current_stage():
+    """The instrumented stage running in this context, also without a run"""
+    return _current_stage.get()
+
+
+def instrument(stage):
+    """Decorator recording the wall time and failures of every call as stage"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # The stage is set even without a run, models route calls by it
+            token = _current_stage.set(stage)
+            run = _current_run.get()
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                if run is not None:
+                    run.observe(stage, time.perf_counter() - started, failed)
+                _current_stage.reset(token)
+        return wrapper
+    return decorate
+
+
+def record_failure():
+    """Count a failure the current stage handled itself instead of raising"""
+    run, stage = _current_run.get(), _current_stage.get()
+    if run is not None and stage is not None:
+        run.add_failure(stage)
+
+
+def record_retry():
+    """Count a retried request against the current stage"""
+    run, stage = _current_run.get(), _current_stage.get()
+    if run is not None and stage is not None:
+        run.add_retry(stage)
+
+
+def record_fallback():
+    """Count a call the current stage moved to its next model"""
+    run, stage = _current_run.get(), _current_stage.get()
+    if run is not None and stage is not None:
+        run.add_fallback(stage)
+
+
+def record_model_call(model_name, cost_usd=0.0):
+    """Count a call a model answered for the current stage, with its estimated cost"""
+    run, stage = _current_run.get(), _current_stage.get()
+    if run is not None and stage is not None:
+        run.add_model_call(stage, model_name, cost_usd)
+
+
+def record_usage(response):
+    """Add a response's prompt and output token counts to the current stage"""
+    run, stage = _current_run.get(), _current_stage.get()
+    usage = getattr(response, "usage_metadata", None)
+    if run is not None and stage is not None and usage is not None:
+        run.add_tokens(
+            stage,
+            getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0
+        )
+
+
+def _metered_stream(stream):
+    last = None
+    for chunk in stream:
+        last = chunk
+        yield chunk
+    # Streaming responses report the usage of the whole response on the last chunk
+    record_usage(last)
+
+
+class MeteredModel:
+    """Wrap a model or chat session so every response's token usage is recorded"""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def _metered(self, response, stream):
+        if stream:
+            return _metered_stream(response)
+        record_usage(response)
+        return response
+
+    def generate_content(self, *args, **kwargs):
+        return self._metered(self.wrapped.generate_content(*args, **kwargs), kwargs.get("stream", False))
+
+    def send_message(self, *args, **kwargs):
+        return self._metered(self.wrapped.send_message(*args, **kwargs), kwargs.get("stream", False))
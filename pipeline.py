@@ -0,0 +1,74 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def run_concurrently(items, worker, max_workers=DEFAULT_MAX_WORKERS, on_result=None, initializer=None):
+    """Run worker over items with bounded concurrency, keeping results in input order
+
+    Each result is a (value, error) pair so one failing item never aborts the
+    rest of the batch. on_result(index, value, error) is called from the
+    calling thread as items finish, which keeps UI updates off the workers.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=initializer) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, worker, item): index
+            for index, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                value, error = future.result(), None
+            except Exception as e:
+                value, error = None, e
+            results[index] = (value, error)
+            if on_result:
+                on_result(index, value, error)
+
+    return results, throughput_stats(results, time.perf_counter() - started)
+
+
+def throughput_stats(results, elapsed):
+    """Summarize a batch run as completed/failed counts and articles per minute"""
+    completed = sum(1 for _, error in results if error is None)
+    return {
+        "completed": completed,
+        "failed": len(results) - completed,
+        "elapsed": elapsed,
+        "articles_per_minute": completed / elapsed * 60 if elapsed > 0 else 0.0,
+    }
+
+
+def run_stages(stages, initializer=None):
+    """Run a dependency graph of stages, starting each one as soon as its inputs are ready
+
+    stages maps a stage name to (dependencies, func); func is called with the
+    results of its dependencies as keyword arguments. Returns the results by
+    stage name. The first failing stage raises once the running ones finish.
+    """
+    results = {}
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages)), initializer=initializer) as executor:
+        while pending or running:
+            for name, (dependencies, func) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    kwargs = {dependency: results[dependency] for dependency in dependencies}
+                    running[executor.submit(contextvars.copy_context().run, func, **kwargs)] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Unresolvable stage dependencies: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return results
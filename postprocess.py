@@ -0,0 +1,166 @@
+"""Post-processing of generated articles on a pool of processes
+
+Formatting, markdown conversion and template rendering are CPU-bound and
+would otherwise share the GIL with the UI and the generation threads.
+Steps are module-level functions taking an article record (a plain,
+picklable dict) and returning it; they run over batches of records in
+worker processes, or inline when no workers are configured or the pool
+breaks, e.g. when a worker is killed.
+"""
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Records sent to a worker at once; larger batches amortize the pickling round trip
+BATCH_SIZE = 16
+# A process pool pays for its startup and the pickling, it is only worth it for many or long articles
+DEFAULT_PROCESS_WORKERS = 0
+WORDS_PER_MINUTE = 200
+
+
+def article_stats(record):
+    """Step: word count and read time of the article content"""
+    record["word_count"] = len(record["content"].split())
+    record["read_time"] = record["word_count"] // WORDS_PER_MINUTE
+    return record
+
+
+def markdown_to_html(record):
+    """Step: convert markdown content, as utils.generate_article writes it, to content_html"""
+    import markdown
+
+    record["content_html"] = markdown.markdown(record["content"], extensions=["extra"])
+    return record
+
+
+def _portable(error):
+    """The error itself when it survives pickling, a RuntimeError with its message otherwise"""
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+    return error
+
+
+def run_steps(steps, records, options):
+    """Run every step over each record and return a (record, error) pair per record"""
+    results = []
+    for record in records:
+        try:
+            for step in steps:
+                record = step(record, **options.get(step.__name__, {}))
+            results.append((record, None))
+        except Exception as e:
+            results.append((None, _portable(e)))
+    return results
+
+
+class _InlineBatch:
+    """Stands in for the future of a batch run in the calling thread; the batch runs once its result is asked for"""
+
+    def __init__(self, steps, records, options):
+        self.steps = steps
+        self.records = records
+        self.options = options
+        self._results = None
+
+    def result(self):
+        if self._results is None:
+            self._results = run_steps(self.steps, self.records, self.options)
+            self.records = None
+        return self._results
+
+
+class _PooledBatch:
+    """Future of a batch sent to the worker processes; the batch runs in the calling thread if that fails"""
+
+    def __init__(self, processor, steps, records, options):
+        self.processor = processor
+        self._inline = _InlineBatch(steps, records, options)
+        try:
+            self._future = processor._get_executor().submit(run_steps, tuple(steps), records, options)
+        except Exception as e:
+            processor._pool_failed(e)
+            self._future = None
+
+    def result(self):
+        if self._future is not None:
+            try:
+                # run_steps catches the errors of the steps, anything raised here is the pool's
+                results = self._future.result()
+                self._inline = None
+                return results
+            except Exception as e:
+                self.processor._pool_failed(e)
+                self._future = None
+        return self._inline.result()
+
+
+class PostProcessor:
+    """Run post-processing steps over article records in batches
+
+    With max_workers the batches go to that many worker processes, started
+    with spawn so they never inherit the locks of the app's threads;
+    without, they run in the calling thread when their results are
+    collected, one batch at a time. A batch the pool fails to run, e.g.
+    because a worker was killed, runs in the calling thread instead, and once
+    the pool is broken every later batch does too. Step options are given per
+    step name, e.g. {"render_article": {"site_name": ...}}.
+    """
+
+    def __init__(self, max_workers=DEFAULT_PROCESS_WORKERS, batch_size=BATCH_SIZE):
+        self.max_workers = min(max_workers, os.cpu_count() or 1)
+        self.batch_size = batch_size
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _pool_failed(self, error):
+        if not isinstance(error, BrokenExecutor):
+            logger.warning("Post-processing pool failed a batch, running it in this process: %s", error)
+        elif self._executor is not None:
+            logger.warning("Post-processing pool broke, running the remaining batches in this process: %s", error)
+            self.max_workers = 0
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, steps, records, options=None):
+        """Start processing records and return one future per batch, each resolving to its (record, error) pairs"""
+        records = list(records)
+        options = options or {}
+        futures = []
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if self.max_workers > 0:
+                futures.append(_PooledBatch(self, steps, batch, options))
+            else:
+                futures.append(_InlineBatch(steps, batch, options))
+        return futures
+
+    def run(self, steps, records, options=None):
+        """Process records and return their (record, error) pairs in order"""
+        return list(gather(self.submit(steps, records, options)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def gather(futures):
+    """Yield the (record, error) pairs of submitted batches in order, as the batches finish"""
+    for future in futures:
+        yield from future.result()
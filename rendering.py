@@ -0,0 +1,52 @@
+"""One Jinja environment for every page the generator renders
+
+Templates live in templates/ and extend base.html. Compiled templates are
+kept in a bytecode cache next to the other caches, so new processes skip
+the template compilation too.
+"""
+import os
+import threading
+
+from cache import CACHE_DIR
+from images import image_tag
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BYTECODE_CACHE_DIR = os.path.join(CACHE_DIR, 'jinja')
+
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def get_environment():
+    """Create the Jinja environment on first use"""
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+            os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+            _environment = Environment(
+                # Templates include the static CSS and JS inline when they are not exported as files
+                loader=FileSystemLoader([TEMPLATES_DIR, STATIC_DIR]),
+                bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+                trim_blocks=True,
+                lstrip_blocks=True,
+                keep_trailing_newline=True
+            )
+            _environment.globals['image_tag'] = image_tag
+        return _environment
+
+
+def get_template(name):
+    return get_environment().get_template(name)
+
+
+def render(name, **context):
+    """Render a template into one string"""
+    return get_template(name).render(**context)
+
+
+def stream(name, **context):
+    """Render a template piece by piece, for writers that can take the page as it is produced"""
+    return get_template(name).generate(**context)
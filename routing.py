@@ -0,0 +1,200 @@
+"""Route every generation stage to its own model
+
+A route is a list of tiers tried in order: the first answers the stage's
+calls, the next ones take over when it hits a quota error or times out.
+With a key pool, a tier whose keys are all cooling down for its model is
+passed over at once rather than waited for.
+Each tier names a model and optionally a generation_config merged over the
+stage's own, and a request timeout in seconds, e.g.
+
+    {"title": [{"model": "gemini-1.5-flash", "generation_config": {"temperature": 0.9}},
+               {"model": "gemini-1.5-pro"}]}
+
+Stages are the names the generation functions are instrumented with (see
+metrics.instrument). Every answered call is counted against its stage with
+the model that answered it and its estimated cost.
+"""
+import json
+import re
+import threading
+from contextlib import nullcontext
+
+from key_pool import is_quota_error, without_waiting_for_cooldowns
+from metrics import current_stage, record_fallback, record_model_call
+from streaming import stream_state
+
+DEFAULT_MODEL = "gemini-1.5-pro"
+FAST_MODEL = "gemini-1.5-flash"
+
+# Short outputs don't need the large model, long articles fall back to the fast one
+DEFAULT_ROUTES = {
+    "title": [{"model": FAST_MODEL}, {"model": DEFAULT_MODEL}],
+    "meta_description": [{"model": FAST_MODEL}, {"model": DEFAULT_MODEL}],
+    "titles_batch": [{"model": FAST_MODEL}, {"model": DEFAULT_MODEL}],
+    "content": [{"model": DEFAULT_MODEL}, {"model": FAST_MODEL}],
+    "utils_title": [{"model": FAST_MODEL}, {"model": DEFAULT_MODEL}],
+    "utils_seo_article": [{"model": DEFAULT_MODEL}, {"model": FAST_MODEL}],
+    "utils_pinterest_article": [{"model": DEFAULT_MODEL}, {"model": FAST_MODEL}],
+}
+TIER_KEYS = ("model", "generation_config", "timeout")
+
+# USD per million (prompt, output) tokens, for the cost estimates; longest matching prefix wins
+MODEL_PRICES = {
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+
+TIMEOUT_ERROR_PATTERN = re.compile(r"\b504\b|deadline.?exceeded|timed? ?out", re.IGNORECASE)
+
+
+def is_timeout_error(error):
+    """Timeouts, including streaming.StreamTimeout of a stalled stream, and 504 / deadline errors"""
+    if isinstance(error, TimeoutError):
+        return True
+    return getattr(error, "code", None) == 504 or bool(TIMEOUT_ERROR_PATTERN.search(str(error)))
+
+
+def should_fall_back(error):
+    """Quota errors and timeouts move a call to the next tier, any other error is the call's own"""
+    return is_quota_error(error) or is_timeout_error(error)
+
+
+def model_price(model_name):
+    name = model_name.split("/")[-1]
+    matches = [prefix for prefix in MODEL_PRICES if name.startswith(prefix)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else (0.0, 0.0)
+
+
+def estimate_cost(model_name, response):
+    """Estimated USD cost of a response from its usage; cached responses cost nothing"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0.0
+    prompt_price, output_price = model_price(model_name)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    return (prompt_tokens * prompt_price + output_tokens * output_price) / 1_000_000
+
+
+def load_routes(routes=None, default_model=DEFAULT_MODEL):
+    """Validate routes (a dict or its JSON) and merge them over DEFAULT_ROUTES
+
+    Raises ValueError for routes that aren't a stage -> list of tiers
+    mapping or tiers without a model.
+    """
+    if isinstance(routes, str):
+        try:
+            routes = json.loads(routes) if routes.strip() else {}
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Routes are not valid JSON: {e}")
+    if not isinstance(routes or {}, dict):
+        raise ValueError("Routes must map stage names to lists of tiers")
+    merged = {stage: [dict(tier) for tier in tiers] for stage, tiers in DEFAULT_ROUTES.items()}
+    for stage, tiers in (routes or {}).items():
+        if isinstance(tiers, str):
+            tiers = [{"model": tiers}]
+        if not isinstance(tiers, list) or not tiers:
+            raise ValueError(f"Route of {stage} must be a non-empty list of tiers")
+        for tier in tiers:
+            if not isinstance(tier, dict) or not tier.get("model"):
+                raise ValueError(f"Every tier of {stage} needs a model")
+            unknown = set(tier) - set(TIER_KEYS)
+            if unknown:
+                raise ValueError(f"Unknown tier settings for {stage}: {', '.join(sorted(unknown))}")
+        merged[stage] = [dict(tier) for tier in tiers]
+    merged.setdefault("default", [{"model": default_model}])
+    return merged
+
+
+def single_model_routes(model_name):
+    """Routes sending every stage to one model, without fallback"""
+    return {stage: [{"model": model_name}] for stage in (*DEFAULT_ROUTES, "default")}
+
+
+class RoutedModel:
+    """GenerativeModel stand-in that sends each call to the model routed for the current stage
+
+    build(model_name) returns the model of a tier, e.g. generator.build_model
+    with a key pool; each is built once. Calls outside any routed stage use
+    the "default" route.
+    """
+
+    def __init__(self, routes, build):
+        self.routes = routes
+        self.build = build
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        return self.route()[0]["model"]
+
+    def route(self, stage=None):
+        stage = stage or current_stage()
+        return self.routes.get(stage) or self.routes["default"]
+
+    def _model(self, model_name):
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self.build(model_name)
+            return self._models[model_name]
+
+    def _tier_call(self, tier, prompt, generation_config, kwargs):
+        config = {**(generation_config or {}), **tier.get("generation_config", {})}
+        if tier.get("timeout"):
+            kwargs = {**kwargs, "request_options": {**kwargs.get("request_options", {}), "timeout": tier["timeout"]}}
+        return self._model(tier["model"]).generate_content(prompt, generation_config=config or None, **kwargs)
+
+    def _waiting(self, tiers, position):
+        """Only the last tier waits for pooled keys cooling down for its model, the others move the call on"""
+        return nullcontext() if position == len(tiers) - 1 else without_waiting_for_cooldowns()
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        if stream:
+            return self._stream(prompt, generation_config, kwargs)
+        tiers = self.route()
+        for position, tier in enumerate(tiers):
+            try:
+                with self._waiting(tiers, position):
+                    response = self._tier_call(tier, prompt, generation_config, kwargs)
+            except Exception as e:
+                if position == len(tiers) - 1 or not should_fall_back(e):
+                    raise
+                record_fallback()
+                continue
+            record_model_call(tier["model"], estimate_cost(tier["model"], response))
+            return response
+
+    def _stream(self, prompt, generation_config, kwargs):
+        tiers = self.route()
+        # A stream_text retry follows a timeout: it goes on from the tier after the one that timed out
+        state = stream_state()
+        start = 0
+        if state is not None and "tier" in state:
+            start = min(state["tier"] + 1, len(tiers) - 1)
+            if start != state["tier"]:
+                record_fallback()
+        for position, tier in enumerate(tiers[start:], start):
+            if state is not None:
+                state["tier"] = position
+            try:
+                with self._waiting(tiers, position):
+                    chunks = iter(self._tier_call(tier, prompt, generation_config, {**kwargs, "stream": True}))
+                    # Quota errors of a stream may only show once it is read; a started stream stays on its tier
+                    first = next(chunks, None)
+            except Exception as e:
+                if position == len(tiers) - 1 or not should_fall_back(e):
+                    raise
+                record_fallback()
+                continue
+            last = first
+            if first is not None:
+                yield first
+                for last in chunks:
+                    yield last
+            # Streaming responses report the usage of the whole response on the last chunk
+            record_model_call(tier["model"], estimate_cost(tier["model"], last))
+            return
@@ -0,0 +1,126 @@
+"""Client-side search index for exported sites
+
+Articles are tokenized as they are added to the export and kept as an
+inverted index of term -> (article, weight) postings. Once the site is
+finished the index is written under search/ as gzipped JSON shards, one per
+term prefix, next to chunks of the article list and a small manifest.
+static/search.js fetches only the shards and chunks a query needs.
+"""
+import gzip
+import html
+import json
+import re
+from array import array
+from collections import Counter
+
+SEARCH_DIR = 'search'
+# Terms sharing their first characters share a shard
+SHARD_PREFIX = 2
+DOCS_PER_CHUNK = 500
+DESCRIPTION_LENGTH = 160
+# Occurrences in the title count more than in the description, and those more than in the content
+FIELD_WEIGHTS = {'title': 5, 'description': 2, 'content': 1}
+MIN_TERM_LENGTH = 2
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have how in into is it its of on or that the their this to '
+    'was were what when where which who why will with you your'.split()
+)
+
+_TERM = re.compile(r'[^\W_]+')
+_TAG = re.compile(r'<[^>]*>')
+
+
+def term_counts(text):
+    """Count the lowercase index terms of a text; static/search.js splits queries the same way"""
+    # Counting the raw words first filters every distinct word once instead of every occurrence
+    return Counter({
+        term: count for term, count in Counter(_TERM.findall(text.lower())).items()
+        if len(term) >= MIN_TERM_LENGTH and term not in STOPWORDS
+    })
+
+
+def strip_markup(text):
+    return html.unescape(_TAG.sub(' ', text))
+
+
+def article_weights(title, description="", content=""):
+    """Weight of every index term of an article, summed over its fields"""
+    weights = Counter()
+    for field, text in (('title', title), ('description', description), ('content', strip_markup(content))):
+        for term, count in term_counts(text).items():
+            weights[term] += count * FIELD_WEIGHTS[field]
+    return weights
+
+
+def shard_name(term):
+    """File name of the shard holding a term, kept to [a-z0-9_] whatever the script"""
+    return ''.join(c if c.isascii() and c.isalnum() else f'_{ord(c):x}' for c in term[:SHARD_PREFIX])
+
+
+def _gzip_json(value):
+    return gzip.compress(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'), 9, mtime=0)
+
+
+class SearchIndex:
+    """Inverted index of the articles of one export"""
+
+    def __init__(self):
+        self.docs = []
+        # Postings are flat (doc, weight, doc, weight, ...) arrays, far smaller than lists of tuples
+        self.postings = {}
+
+    def add(self, title, url, description="", content="", weights=None):
+        """Index one article and return its document number
+
+        weights from article_weights(), e.g. stored with the article, spare
+        tokenizing it again.
+        """
+        doc = len(self.docs)
+        self.docs.append([title, url, description[:DESCRIPTION_LENGTH]])
+
+        if weights is None:
+            weights = article_weights(title, description, content)
+        for term, weight in weights.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array('I')
+            postings.append(doc)
+            postings.append(weight)
+        return doc
+
+    def _encoded(self, term):
+        encoded = list(self.postings[term])
+        # Documents are added in order, so deltas are small numbers that compress well
+        for position in range(len(encoded) - 2, 0, -2):
+            encoded[position] -= encoded[position - 2]
+        return encoded
+
+    def write(self, write, directory=SEARCH_DIR):
+        """Write the shards, the document chunks and the manifest with write(name, data)
+
+        Shards are encoded one at a time, so only one is held uncompressed.
+        Returns the size of every compressed file.
+        """
+        shards = {}
+        for term in self.postings:
+            shards.setdefault(shard_name(term), []).append(term)
+
+        sizes = {}
+        for shard, terms in shards.items():
+            data = _gzip_json({term: self._encoded(term) for term in terms})
+            sizes[f'{directory}/{shard}.json.gz'] = len(data)
+            write(f'{directory}/{shard}.json.gz', data)
+        for start in range(0, len(self.docs), DOCS_PER_CHUNK):
+            data = _gzip_json(self.docs[start:start + DOCS_PER_CHUNK])
+            sizes[f'{directory}/docs-{start // DOCS_PER_CHUNK}.json.gz'] = len(data)
+            write(f'{directory}/docs-{start // DOCS_PER_CHUNK}.json.gz', data)
+
+        write(f'{directory}/manifest.json', json.dumps({
+            'docs': len(self.docs),
+            'docs_per_chunk': DOCS_PER_CHUNK,
+            'shard_prefix': SHARD_PREFIX,
+            'min_term_length': MIN_TERM_LENGTH,
+            'stopwords': sorted(STOPWORDS),
+            'shards': sorted(shards),
+        }, separators=(',', ':')))
+        return sizes
@@ -0,0 +1,152 @@
+// Client side of search.py: fetches only the index shards and article chunks a query needs
+var searchManifest = null;
+var searchFiles = {};
+var searchGeneration = 0;
+var MAX_RESULTS = 20;
+var MAX_PREFIX_TERMS = 50;
+
+function loadSearchFile(name) {
+    if (!(name in searchFiles)) {
+        searchFiles[name] = fetch("search/" + name).then(function (response) {
+            if (!response.ok) {
+                return null;
+            }
+            return response.arrayBuffer().then(function (buffer) {
+                var bytes = new Uint8Array(buffer);
+                // Hosts that send .gz files with Content-Encoding: gzip have them decompressed already
+                if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+                    return JSON.parse(new TextDecoder().decode(bytes));
+                }
+                var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+                return new Response(stream).json();
+            });
+        });
+    }
+    return searchFiles[name];
+}
+
+function loadManifest() {
+    if (searchManifest === null) {
+        searchManifest = fetch("search/manifest.json").then(function (response) {
+            return response.json();
+        });
+    }
+    return searchManifest;
+}
+
+function searchTerms(query, manifest) {
+    var stopwords = new Set(manifest.stopwords);
+    return (query.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []).filter(function (term) {
+        return Array.from(term).length >= manifest.min_term_length && !stopwords.has(term);
+    });
+}
+
+function shardName(term, manifest) {
+    return Array.from(term).slice(0, manifest.shard_prefix).map(function (c) {
+        return /^[a-z0-9]$/.test(c) ? c : "_" + c.codePointAt(0).toString(16);
+    }).join("");
+}
+
+function termScores(shard, term, prefix, documentCount) {
+    // Postings are (document delta, weight) pairs
+    var scores = new Map();
+    if (!shard) {
+        return scores;
+    }
+    var terms = prefix ? Object.keys(shard).filter(function (key) {
+        return key.startsWith(term);
+    }).slice(0, MAX_PREFIX_TERMS) : (term in shard ? [term] : []);
+    terms.forEach(function (key) {
+        var postings = shard[key];
+        var idf = Math.log(1 + documentCount / (postings.length / 2));
+        var doc = 0;
+        for (var i = 0; i < postings.length; i += 2) {
+            doc += postings[i];
+            scores.set(doc, Math.max(scores.get(doc) || 0, postings[i + 1] * idf));
+        }
+    });
+    return scores;
+}
+
+function search(query) {
+    return loadManifest().then(function (manifest) {
+        var terms = searchTerms(query, manifest);
+        var shards = terms.map(function (term) {
+            var name = shardName(term, manifest);
+            return manifest.shards.indexOf(name) === -1 ? Promise.resolve(null) : loadSearchFile(name + ".json.gz");
+        });
+        return Promise.all(shards).then(function (loaded) {
+            // Every term has to match; the last one may still be being typed, so it matches as a prefix
+            var total = null;
+            terms.forEach(function (term, position) {
+                var scores = termScores(loaded[position], term, position === terms.length - 1, manifest.docs);
+                if (total === null) {
+                    total = scores;
+                    return;
+                }
+                var combined = new Map();
+                total.forEach(function (score, doc) {
+                    if (scores.has(doc)) {
+                        combined.set(doc, score + scores.get(doc));
+                    }
+                });
+                total = combined;
+            });
+            var ranked = Array.from(total || []).sort(function (a, b) {
+                return b[1] - a[1];
+            }).slice(0, MAX_RESULTS);
+            var chunks = ranked.map(function (result) {
+                return loadSearchFile("docs-" + Math.floor(result[0] / manifest.docs_per_chunk) + ".json.gz");
+            });
+            return Promise.all(chunks).then(function (loadedChunks) {
+                return ranked.map(function (result, position) {
+                    var doc = loadedChunks[position][result[0] % manifest.docs_per_chunk];
+                    return {title: doc[0], url: doc[1], description: doc[2]};
+                });
+            });
+        });
+    });
+}
+
+function showResults(query) {
+    var list = document.getElementById("searchResults");
+    var status = document.getElementById("searchStatus");
+    var generation = ++searchGeneration;
+    search(query).then(function (results) {
+        // A later query has been typed in the meantime
+        if (generation !== searchGeneration) {
+            return;
+        }
+        list.textContent = "";
+        status.textContent = query.trim() ? results.length + (results.length === MAX_RESULTS ? "+" : "") + " results" : "";
+        results.forEach(function (result) {
+            var item = document.createElement("li");
+            item.className = "bg-white rounded-lg shadow-md p-6";
+            var link = document.createElement("a");
+            link.href = result.url;
+            link.className = "text-xl font-semibold text-blue-600 hover:underline";
+            link.textContent = result.title;
+            var description = document.createElement("p");
+            description.className = "text-gray-600 mt-2";
+            description.textContent = result.description;
+            item.appendChild(link);
+            item.appendChild(description);
+            list.appendChild(item);
+        });
+    });
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+    var input = document.getElementById("searchInput");
+    var pending = null;
+    input.value = new URLSearchParams(window.location.search).get("q") || "";
+    input.addEventListener("input", function () {
+        clearTimeout(pending);
+        pending = setTimeout(function () {
+            showResults(input.value);
+        }, 150);
+    });
+    if (input.value) {
+        showResults(input.value);
+    }
+});
@@ -0,0 +1,9 @@
+function showImage(elem) {
+    var main = document.getElementById("mainImage");
+    var source = document.getElementById("mainImageSource");
+    main.src = elem.dataset.src || elem.src;
+    main.srcset = elem.dataset.srcset || "";
+    if (source) {
+        source.srcset = elem.dataset.webpSrcset || "";
+    }
+}
@@ -0,0 +1,282 @@
+"""Persistent article store and incremental site builds
+
+Finished articles are kept in SQLite (metadata, related links and search
+terms) with their content in one JSON file each under content/, so a site
+can be built from every article ever generated without holding them in
+memory. build_site writes the site of the whole store into a directory and
+renders an article page again only when the hash of its inputs changed:
+its content, the titles of the articles it links to, the site settings and
+the templates. Every other file is rewritten only when its bytes changed.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from export import INDEX_PAGE_SIZE, IncrementalExport
+from journal import DATA_DIR
+from postprocess import DEFAULT_PROCESS_WORKERS, PostProcessor, gather
+from rendering import STATIC_DIR, TEMPLATES_DIR
+from search import article_weights
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.path.join(DATA_DIR, "store")
+RELATED_ARTICLES = 2
+# Rows read from SQLite at a time while a site is built
+ENTRY_CHUNK = 500
+# Article fields kept in the content files; everything a page is rendered from
+CONTENT_FIELDS = ("content", "content_html", "images", "word_count", "read_time")
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def templates_digest():
+    """Hash of every template and static file, which all pages are rendered with"""
+    digest = hashlib.sha256()
+    for directory in (TEMPLATES_DIR, STATIC_DIR):
+        for name in sorted(os.listdir(directory)):
+            digest.update(name.encode('utf-8'))
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ArticleStore:
+    """Every generated article, in SQLite and content files under directory
+
+    Articles are keyed by filename: adding an article with the filename of
+    a stored one replaces it. Images mirrored into the site are kept under
+    assets/ and copied into every site built from the store. Sites built
+    from the store go under sites/, one directory per site settings.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.content_directory = os.path.join(directory, "content")
+        os.makedirs(self.content_directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Held while a site directory is built or read, sessions sharing the store build one at a time
+        self._site_locks = defaultdict(threading.RLock)
+        self._conn = sqlite3.connect(os.path.join(directory, "articles.sqlite3"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT UNIQUE NOT NULL, topic TEXT, "
+                "title TEXT NOT NULL, meta_description TEXT, related TEXT NOT NULL, search_terms TEXT NOT NULL, "
+                "content_hash TEXT NOT NULL, updated TEXT NOT NULL)"
+            )
+            # Hash of every file of every site built from the store, see IncrementalExport
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS site_files ("
+                "site TEXT NOT NULL, name TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (site, name))"
+            )
+
+    def _content_path(self, filename):
+        return os.path.join(self.content_directory, f"{filename}.json")
+
+    def add(self, article):
+        """Store a finished article; its related articles are topped up from the store
+
+        An article stored again keeps the related articles it has, new ones
+        only fill the places it has left.
+        """
+        content = {field: article.get(field) for field in CONTENT_FIELDS}
+        content_hash = _digest(article["title"], article.get("meta_description"), content)
+        path = self._content_path(article["filename"])
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+        related = [other["filename"] for other in article.get("related") or [] if other["filename"] != article["filename"]]
+        weights = article_weights(
+            article["title"], article.get("meta_description", ""),
+            article.get("content_html") or article.get("content", "")
+        )
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            stored = self._conn.execute("SELECT related FROM articles WHERE filename = ?", (article["filename"],)).fetchone()
+            if stored is not None:
+                # New related links would change a stored article's page and force a render, its own are kept
+                kept = json.loads(stored["related"])
+                related = (kept + [filename for filename in related if filename not in kept])[:RELATED_ARTICLES]
+            if len(related) < RELATED_ARTICLES:
+                candidates = [row[0] for row in self._conn.execute(
+                    "SELECT filename FROM articles WHERE filename != ? ORDER BY RANDOM() LIMIT ?",
+                    (article["filename"], RELATED_ARTICLES * 2)
+                )]
+                related += [filename for filename in candidates if filename not in related][:RELATED_ARTICLES - len(related)]
+            self._conn.execute(
+                "INSERT INTO articles (filename, topic, title, meta_description, related, search_terms, content_hash, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (filename) DO UPDATE SET "
+                "topic = excluded.topic, title = excluded.title, meta_description = excluded.meta_description, "
+                "related = excluded.related, search_terms = excluded.search_terms, "
+                # An article stored again unchanged keeps its date, so its sitemap and feed entries stay put
+                "updated = CASE WHEN content_hash = excluded.content_hash THEN updated ELSE excluded.updated END, "
+                "content_hash = excluded.content_hash",
+                (article["filename"], article.get("topic"), article["title"], article.get("meta_description", ""),
+                 json.dumps(related), json.dumps(weights, ensure_ascii=False), content_hash, now)
+            )
+
+    def write_asset(self, name, data):
+        """Keep a file of the site's assets/, e.g. a mirrored image; the writer ImageMirror needs"""
+        path = os.path.join(self.directory, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def titles(self):
+        """Filename -> title of every stored article"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT filename, title FROM articles").fetchall())
+
+    def entries(self):
+        """Yield every article's stored row in the order they were first added, without their content"""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT * FROM articles WHERE id > ? ORDER BY id LIMIT ?", (last, ENTRY_CHUNK)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                entry = dict(row)
+                entry["related"] = json.loads(entry["related"])
+                entry["search_terms"] = json.loads(entry["search_terms"])
+                yield entry
+            last = rows[-1]["id"]
+
+    def load(self, entry, titles):
+        """The full record of a stored article, as render_article takes it"""
+        with open(self._content_path(entry["filename"]), "r", encoding="utf-8") as f:
+            record = json.load(f)
+        record.update({
+            "title": entry["title"],
+            "filename": entry["filename"],
+            "meta_description": entry["meta_description"],
+            "related": [{"title": titles[filename], "filename": filename} for filename in entry["related"] if filename in titles],
+        })
+        return record
+
+    def site_directory(self, site_name, site_description, optimize=False, site_url=None, page_size=INDEX_PAGE_SIZE):
+        """The store's own directory for the site built with these settings"""
+        settings = _digest(site_name, site_description, optimize, site_url, page_size)
+        return os.path.join(self.directory, "sites", settings[:16])
+
+    def site_lock(self, directory):
+        """Lock of a site directory; hold it while reading a built site, e.g. to ZIP it"""
+        with self._lock:
+            return self._site_locks[os.path.abspath(directory)]
+
+    def site_hashes(self, site):
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, hash FROM site_files WHERE site = ?", (site,)).fetchall())
+
+    def save_site_hashes(self, site, hashes):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM site_files WHERE site = ?", (site,))
+            self._conn.executemany(
+                "INSERT INTO site_files (site, name, hash) VALUES (?, ?, ?)",
+                [(site, name, digest) for name, digest in hashes.items()]
+            )
+
+
+def _copy_assets(store, directory):
+    """Copy the store's mirrored images the site doesn't have yet; their names are content hashes"""
+    assets = os.path.join(store.directory, "assets")
+    for root, _, files in os.walk(assets):
+        for filename in files:
+            source = os.path.join(root, filename)
+            target = os.path.join(directory, os.path.relpath(source, store.directory))
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+
+
+def build_site(store, site_name, site_description, directory=None, optimize=False, site_url=None,
+               page_size=INDEX_PAGE_SIZE, render_workers=DEFAULT_PROCESS_WORKERS, full=False):
+    """Build the site of every stored article into directory (by default the store's for these settings)
+
+    Only article pages whose inputs changed since the last build of the
+    same directory are rendered, on render_workers processes; full renders
+    and writes every file again. Either way files of the previous build the
+    site no longer has are deleted. Only the index, search and crawler files
+    are held in memory, a few hundred bytes per article. The directory is
+    locked while it is built. A page that fails to render doesn't stop the
+    build: it keeps its previous version, if any, and is rendered again next
+    time. Returns the directory, how many pages were rendered and kept and
+    the filename and error of every page that failed.
+    """
+    directory = directory or store.site_directory(site_name, site_description, optimize, site_url, page_size)
+    with store.site_lock(directory):
+        return _build_site(store, site_name, site_description, directory, optimize, site_url, page_size,
+                           render_workers, full)
+
+
+def _build_site(store, site_name, site_description, directory, optimize, site_url, page_size, render_workers, full):
+    from generator import render_article
+
+    site = os.path.abspath(directory)
+    export = IncrementalExport(
+        site_name, site_description, directory, store.site_hashes(site),
+        optimize=optimize, site_url=site_url, page_size=page_size, rewrite=full
+    )
+    settings = _digest(site_name, site_description, export.assets, templates_digest())
+    titles = store.titles()
+
+    changed, failed = [], []
+    for entry in store.entries():
+        export.add_entry(entry, entry["search_terms"])
+        name = f"articles/{entry['filename']}"
+        related = [(filename, titles.get(filename)) for filename in entry["related"]]
+        digest = _digest(settings, entry["content_hash"], related)
+        if export.unchanged(name, digest):
+            export.keep(name, digest)
+        else:
+            # Only the row is kept until the page is rendered, its content is loaded then
+            del entry["search_terms"]
+            changed.append((entry, digest))
+
+    options = {"render_article": {"site_name": site_name, "site_description": site_description, "assets": export.assets}}
+    with PostProcessor(render_workers) as processor:
+        # A few batches at a time, so only they are in memory
+        step = processor.batch_size * max(1, processor.max_workers) * 2
+        for start in range(0, len(changed), step):
+            part = changed[start:start + step]
+            records = [store.load(entry, titles) for entry, _ in part]
+            results = gather(processor.submit((render_article,), records, options))
+            for (entry, digest), (record, error) in zip(part, results):
+                name = f"articles/{entry['filename']}"
+                if error is None:
+                    export.write_page(name, record["html"], digest)
+                    continue
+                logger.error("Error rendering stored article %s: %s", entry["filename"], error)
+                failed.append({"filename": entry["filename"], "error": str(error)})
+                if name in export.previous:
+                    # The previous page stays until one renders; its old hash has it rendered again next build
+                    export.keep(name, export.previous[name])
+
+    _copy_assets(store, directory)
+    export.close()
+    store.save_site_hashes(site, export.hashes)
+    return {
+        "directory": directory,
+        "articles": len(export.entries),
+        "rendered": len(changed) - len(failed),
+        "kept": len(export.entries) - len(changed),
+        "failed": failed,
+        "files_written": export.written,
+    }
@@ -0,0 +1,85 @@
+import contextvars
+import queue
+import threading
+
+from metrics import record_retry
+
+FIRST_TOKEN_TIMEOUT = 30
+STALL_TIMEOUT = 20
+MAX_STREAM_ATTEMPTS = 3
+
+_DONE = object()
+# Shared by the attempts of one stream_text call, see stream_state
+_stream_state = contextvars.ContextVar("stream_state", default=None)
+
+
+class StreamTimeout(TimeoutError):
+    """Raised when a stream produces no first chunk or stalls for too long"""
+
+
+def stream_state():
+    """Dict shared by the attempts of the stream_text call starting a stream, None outside one
+
+    A retried attempt follows a timeout, so a model can note in it where it
+    streamed from and go elsewhere on the retry, e.g. RoutedModel its tier.
+    """
+    return _stream_state.get()
+
+
+def _pump(start_stream, chunks, cancelled):
+    try:
+        for chunk in start_stream():
+            if cancelled.is_set():
+                return
+            chunks.put(chunk.text)
+    except Exception as e:
+        chunks.put(e)
+        return
+    chunks.put(_DONE)
+
+
+def stream_text(start_stream, on_chunk=None, on_retry=None, first_token_timeout=FIRST_TOKEN_TIMEOUT,
+                stall_timeout=STALL_TIMEOUT, max_attempts=MAX_STREAM_ATTEMPTS):
+    """Consume a streaming response chunk by chunk and return the full text
+
+    start_stream() must return an iterable of chunks with a .text attribute;
+    it runs on a background thread so a request that never produces a first
+    chunk, or stops producing chunks, can be abandoned and retried early.
+    on_chunk(text) sees every chunk as it arrives, on_retry(attempt) is called
+    before a retry so consumers can throw away the partial output.
+    """
+    state = {}
+    for attempt in range(1, max_attempts + 1):
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        context = contextvars.copy_context()
+        context.run(_stream_state.set, state)
+        threading.Thread(target=context.run, args=(_pump, start_stream, chunks, cancelled), daemon=True).start()
+
+        parts = []
+        timeout = first_token_timeout
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    stage = "stalled" if parts else "produced no output"
+                    raise StreamTimeout(f"Stream {stage} for {timeout}s (attempt {attempt}/{max_attempts})")
+
+                if item is _DONE:
+                    return ''.join(parts)
+                if isinstance(item, Exception):
+                    raise item
+
+                parts.append(item)
+                timeout = stall_timeout
+                if on_chunk:
+                    on_chunk(item)
+        except StreamTimeout:
+            # The abandoned request keeps running on its thread, make sure its chunks are dropped
+            cancelled.set()
+            if attempt == max_attempts:
+                raise
+            record_retry()
+            if on_retry:
+                on_retry(attempt)
@@ -1,23 +1,24 @@
+import itertools
 import os
-import requests
-from bs4 import BeautifulSoup
-import json
 import urllib.parse
-from langdetect import detect, DetectorFactory
-from langcodes import Language
-import google.generativeai as genai
+from bing import IMAGE_RESULTS, extract_image_records
+from cache import CachedChatSession, get_image_cache, normalize_query
+from chat import DEFAULT_HISTORY_POLICY, ChatSessionManager
+from fetch import fetch
+from formatting import format_sections
+from images import image_tag
+from language import detect_language, detect_languages
+from rendering import render
+from key_pool import KeyPool, PooledModel
+from metrics import instrument, record_failure
+from postprocess import DEFAULT_PROCESS_WORKERS, PostProcessor, article_stats, markdown_to_html
+from routing import RoutedModel, load_routes
+from streaming import stream_text
 
-# Ensure consistent language detection
-DetectorFactory.seed = 0
+BING_IMAGES_URL = "http://www.bing.com/images/search"
 
-def detect_language(subject):
-    """Detect the language of a given subject"""
-    try:
-        lang_code = detect(subject)
-        lang_name = Language.get(lang_code).display_name()
-        return lang_name
-    except:
-        return "English"  # Default to English if detection fails
+# genai and bs4 are imported where they are
+# used so importing utils stays cheap for workers that never need them
 
 def read_api_keys(filename="apikey.txt"):
     """Read API keys from a file"""
@@ -28,6 +29,17 @@ def read_api_keys(filename="apikey.txt"):
         keys = [line.strip() for line in file if line.strip()]
     return keys
 
+def load_api_keys(filename="apikey.txt"):
+    """Collect API keys from the key file and the GEMINI_API_KEY / GEMINI_API_KEYS environment variables"""
+    keys = read_api_keys(filename)
+    for name in ("GEMINI_API_KEY", "GEMINI_API_KEYS"):
+        keys += [key.strip() for key in os.environ.get(name, "").split(",") if key.strip()]
+    return list(dict.fromkeys(keys))
+
+def create_key_pool(filename="apikey.txt", **pool_options):
+    """Build a KeyPool from every configured key so calls spread across their quotas"""
+    return KeyPool(load_api_keys(filename), **pool_options)
+
 def switch_api_key(keys, current_index):
     """Switch to the next API key"""
     if not keys:
@@ -38,6 +50,8 @@ def switch_api_key(keys, current_index):
 
 def configure_gemini(api_key):
     """Configure the Gemini API with the given key"""
+    import google.generativeai as genai
+    
     genai.configure(api_key=api_key)
     
     # Default generation config
@@ -51,6 +65,35 @@ def configure_gemini(api_key):
     
     return generation_config
 
+def start_chat_session(model_name, generation_config, cache_mode="use", history=DEFAULT_HISTORY_POLICY, routes=None,
+                       key_pool=None, **history_options):
+    """Start a Gemini chat session whose replies go through the response cache
+
+    history is the ChatSessionManager policy that keeps the chat from
+    resending every earlier title and article; see chat.py. With routes
+    (see routing.py) the title and each kind of article go to the models
+    routed for them, model_name answering the rest; this needs the
+    stateless policy, a chat stays on one model. With a key_pool (see
+    create_key_pool) every call runs on whichever key has capacity instead
+    of the key configured with genai.configure.
+    """
+    import google.generativeai as genai
+
+    def build(name):
+        if key_pool is not None:
+            return PooledModel(key_pool, name, generation_config=generation_config)
+        return genai.GenerativeModel(model_name=name, generation_config=generation_config)
+    
+    if routes is not None:
+        if history != "stateless":
+            raise ValueError("Routed sessions need the stateless history policy")
+        model = RoutedModel(load_routes(routes, default_model=model_name), build)
+    else:
+        model = build(model_name)
+    manager = ChatSessionManager(model, policy=history, **history_options)
+    return CachedChatSession(manager, generation_config=generation_config, mode=cache_mode)
+
+@instrument("utils_title")
 def generate_title(session, subject, language):
     """Generate a title for the subject in the specified language"""
     title_prompt = (
@@ -62,58 +105,91 @@ def generate_title(session, subject, language):
     response = session.send_message(title_prompt)
     return response.text.strip().replace('"', '').replace("**", "").replace("##", "")
 
-def generate_article(session, title, subject, language, is_seo=False):
-    """Generate an article based on the title and subject"""
+def discard_unfinished_turn(session):
+    """Drop a timed out streaming turn so the chat history stays usable for a retry"""
+    # last is only set once the request returned a stream, a request that never answered left no turn behind
+    if getattr(session, "last", None) is not None:
+        session.rewind()
+
+def generate_article(session, title, subject, language, is_seo=False, on_chunk=None):
+    """Generate an article based on the title and subject
+
+    When on_chunk is given the reply is streamed to it chunk by chunk, and a
+    reply that is slow to start or stalls is retried early. SEO and
+    Pinterest articles are separate stages, so they can be routed to
+    different models.
+    """
     if is_seo:
-        article_prompt = (
-            f"Forget previous instructions. You are an SEO expert and content writer in {language}. "
-            f"Write a 1600-word article with the keyword \"{title}\". Include the keyword 4 times. "
-            f"Format it professionally using markdown with proper H1, H2, and H3 headings. "
-            f"Include a meta description and optimize for search engines."
-        )
-    else:
-        article_prompt = (
-            f"Ignore all previous instructions. You are an expert Pinterest content writer and blogger in {language}. "
-            f"Write a blog post of around 3000 words for the title \"{title}\" that is inspiring, informative, "
-            f"and visually descriptive. Use a storytelling tone, include tips or how-tos when relevant, and format it professionally using markdown. "
-            f"Use short paragraphs and bold important points or keywords to enhance readability. "
-            f"Include lists or steps if applicable to help Pinterest readers absorb the content quickly."
+        return _generate_seo_article(session, title, language, on_chunk)
+    return _generate_pinterest_article(session, title, language, on_chunk)
+
+def _send_article_prompt(session, article_prompt, on_chunk):
+    if on_chunk is not None:
+        return stream_text(
+            lambda: session.send_message(article_prompt, stream=True),
+            on_chunk=on_chunk,
+            on_retry=lambda attempt: discard_unfinished_turn(session)
         )
     
     response = session.send_message(article_prompt)
     return response.text
 
+@instrument("utils_seo_article")
+def _generate_seo_article(session, title, language, on_chunk=None):
+    article_prompt = (
+        f"Forget previous instructions. You are an SEO expert and content writer in {language}. "
+        f"Write a 1600-word article with the keyword \"{title}\". Include the keyword 4 times. "
+        f"Format it professionally using markdown with proper H1, H2, and H3 headings. "
+        f"Include a meta description and optimize for search engines."
+    )
+    return _send_article_prompt(session, article_prompt, on_chunk)
+
+@instrument("utils_pinterest_article")
+def _generate_pinterest_article(session, title, language, on_chunk=None):
+    article_prompt = (
+        f"Ignore all previous instructions. You are an expert Pinterest content writer and blogger in {language}. "
+        f"Write a blog post of around 3000 words for the title \"{title}\" that is inspiring, informative, "
+        f"and visually descriptive. Use a storytelling tone, include tips or how-tos when relevant, and format it professionally using markdown. "
+        f"Use short paragraphs and bold important points or keywords to enhance readability. "
+        f"Include lists or steps if applicable to help Pinterest readers absorb the content quickly."
+    )
+    return _send_article_prompt(session, article_prompt, on_chunk)
+
 def get_soup(url, header):
     """Get BeautifulSoup object from a URL"""
-    response = requests.get(url, headers=header)
+    from bs4 import BeautifulSoup
+    
+    response = fetch(url, headers=header)
     soup = BeautifulSoup(response.content, "html.parser")
     return soup
 
+@instrument("image_search")
 def bing_image_search(query, max_images=10):
-    """Search for images using Bing Image Search"""
+    """Search for images using Bing Image Search, reusing cached results for the same query"""
     try:
-        query = '+'.join(query.split())
-        url = f"http://www.bing.com/images/search?q={query}&FORM=HDRSC2"
-        header = {'User-Agent': "Mozilla/5.0"}
-        soup = get_soup(url, header)
-        image_results_raw = soup.find_all("a", {"class": "iusc"})[:max_images]
+        cache = get_image_cache()
+        cache_key = normalize_query(query)
+        records = cache.get(cache_key)
+        
+        if records is None:
+            query = '+'.join(query.split())
+            url = f"{BING_IMAGES_URL}?q={query}&FORM=HDRSC2"
+            header = {'User-Agent': "Mozilla/5.0"}
+            records = extract_image_records(fetch(url, headers=header).text, max(max_images, IMAGE_RESULTS))
+            
+            if records:
+                cache.set(cache_key, records)
         
         image_html_list = []
         image_data_list = []
         
-        for image_result_raw in image_results_raw:
-            m = json.loads(image_result_raw["m"])
-            murl = m["murl"]  # URL of the image
-            mdesc = m.get("desc", "No description available")  # Description of the image if available
+        for record in records[:max_images]:
+            murl = record['url']
+            mdesc = record['description']
             image_name = urllib.parse.urlsplit(murl).path.split("/")[-1]
             
             # HTML representation for embedding
-            image_html_list.append(
-                f'<div style="text-align: center; margin: 20px 0;">'
-                f'<img src="{murl}" alt="{image_name}" width="600" height="400" style="border: 2px solid black;">'
-                f'<div style="font-size: 14px; color: gray;">{mdesc}</div>'
-                f'</div>'
-            )
+            image_html_list.append(format_image_html(murl, mdesc))
             
             # Data representation for processing
             image_data_list.append({
@@ -125,30 +201,71 @@ def bing_image_search(query, max_images=10):
         return image_html_list, image_data_list
     except Exception as e:
         print(f"Error in image search: {str(e)}")
+        record_failure()
         return [], []
 
+def format_image_html(url, description, mirrored=None):
+    """HTML for embedding one image, with its local variants when it is in mirrored"""
+    image_name = urllib.parse.urlsplit(url).path.split("/")[-1]
+    if mirrored and url in mirrored:
+        image = image_tag({'url': url, **mirrored[url]}, image_name, sizes="600px")
+    else:
+        image = f'<img src="{url}" alt="{image_name}" width="600" height="400" style="border: 2px solid black;">'
+    return (
+        f'<div style="text-align: center; margin: 20px 0;">'
+        f'{image}'
+        f'<div style="font-size: 14px; color: gray;">{description}</div>'
+        f'</div>'
+    )
+
+def localize_image_html(image_data_list, mirrored):
+    """Rebuild the image HTML of bing_image_search with the images an ImageMirror mirrored"""
+    return [format_image_html(image['url'], image['description'], mirrored) for image in image_data_list]
+
 def format_article_with_images(article, image_html_list, max_images=7):
-    """Format the article with images inserted at appropriate positions"""
-    # Split article into paragraphs
-    paragraphs = article.split('\n\n')
+    """Format the article with the images spread evenly between its paragraphs"""
+    pieces = format_sections(article, image_html_list, '\n\n', max_images=max_images)
     
     # Add read more tag after first paragraph
-    if paragraphs:
-        paragraphs[0] += ' <span><!--more--></span>'
+    return ''.join(itertools.chain([next(pieces) + ' <span><!--more--></span>'], pieces))
+
+def slideshow_html(image_urls, mirrored=None):
+    """Main image and thumbnails of the slideshow, using local variants for the mirrored images"""
+    # The image HTML may already point at the local copies
+    local = {**{image['src']: image for image in (mirrored or {}).values()}, **(mirrored or {})}
+    main_image = image_urls[0] if image_urls else ""
     
-    # Insert images throughout the article
-    images_to_use = image_html_list[:max_images]
-    for i, image_html in enumerate(images_to_use):
-        # Calculate position - distribute images evenly
-        position = min(i + 2, len(paragraphs) - 1)
-        paragraphs.insert(position, image_html)
+    if main_image in local:
+        image = local[main_image]
+        main_html = (
+            f'<picture><source id="mainImageSource" type="image/webp" srcset="{image["webp_srcset"]}" sizes="700px">'
+            f'<img id="mainImage" src="{image["src"]}" srcset="{image["srcset"]}" sizes="700px" '
+            f'width="{image["width"]}" height="{image["height"]}" alt="Main Image"></picture>'
+        )
+    else:
+        main_html = f'<img id="mainImage" src="{main_image}" alt="Main Image">'
     
-    # Rejoin paragraphs
-    formatted_article = '\n\n'.join(paragraphs)
-    return formatted_article
+    thumbnails = []
+    for url in image_urls:
+        if url in local:
+            image = local[url]
+            thumbnails.append(
+                f'<img src="{image["thumbnail"]}" data-src="{image["src"]}" data-srcset="{image["srcset"]}" '
+                f'data-webp-srcset="{image["webp_srcset"]}" width="80" height="60" loading="lazy" '
+                f'onclick="showImage(this)" alt="Thumbnail">'
+            )
+        else:
+            thumbnails.append(f'<img src="{url}" onclick="showImage(this)" alt="Thumbnail">')
+    return main_html, ''.join(thumbnails)
+
+def generate_html_template(title, article, images, mirrored=None, assets=None, root=""):
+    """Generate a complete HTML template for the article
 
-def generate_html_template(title, article, images):
-    """Generate a complete HTML template for the article"""
+    mirrored is the {url: variants} result of an ImageMirror; the slideshow
+    then shows the local variants of those images. With the assets of
+    assets.build_assets the page links the shared stylesheet and script,
+    found at root, instead of inlining them.
+    """
     clean_title = title.replace("**", "").replace("##", "").strip()
     
     image_urls = []
@@ -159,103 +276,31 @@ def generate_html_template(title, article, images):
         except:
             continue
     
-    main_image = image_urls[0] if image_urls else ""
-    
-    html_output = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <title>{clean_title}</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            margin: 20px;
-            max-width: 800px;
-            margin-left: auto;
-            margin-right: auto;
-        }}
-        img {{
-            max-width: 100%;
-            height: auto;
-            border: 4px solid #ddd;
-            border-radius: 8px;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-            transition: transform 0.3s ease;
-        }}
-        img:hover {{
-            transform: scale(1.02);
-        }}
-        .image-container {{
-            text-align: center;
-            margin: 30px 0;
-        }}
-        .image-description {{
-            font-size: 14px;
-            color: #666;
-            margin-top: 5px;
-        }}
-        h2, h3 {{
-            color: #222;
-        }}
-        strong {{
-            color: #C71585;
-        }}
-        .slideshow-container {{
-            text-align: center;
-            margin: 40px 0;
-        }}
-        .slideshow-container .main-image img {{
-            width: 100%;
-            max-width: 700px;
-            height: auto;
-            border: 4px solid #ddd;
-            border-radius: 10px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.15);
-        }}
-        .slideshow-container .thumbnails {{
-            display: flex;
-            justify-content: center;
-            flex-wrap: wrap;
-            margin-top: 15px;
-            gap: 10px;
-        }}
-        .slideshow-container .thumbnails img {{
-            width: 80px;
-            height: 60px;
-            object-fit: cover;
-            border: 2px solid transparent;
-            border-radius: 5px;
-            cursor: pointer;
-            transition: 0.3s;
-        }}
-        .slideshow-container .thumbnails img:hover {{
-            border-color: #C71585;
-        }}
-    </style>
-</head>
-<body>
-<h1>{clean_title}</h1>
+    main_html, thumbnails_html = slideshow_html(image_urls, mirrored)
+    return render(
+        'pinterest.html', title=clean_title, article=article, main_html=main_html, thumbnails_html=thumbnails_html,
+        assets=assets, root=root
+    )
+
+def format_pinterest_article(record, max_images=7):
+    """Post-processing step: spread record["image_html"] (from bing_image_search) through the markdown content"""
+    record["content"] = format_article_with_images(record["content"], record["image_html"], max_images)
+    return record
 
-{article}
+def render_pinterest_article(record, mirrored=None, assets=None, root=""):
+    """Post-processing step: render the Pinterest page of the converted content into record["html"]"""
+    record["html"] = generate_html_template(record["title"], record["content_html"], record["image_html"], mirrored, assets, root)
+    return record
 
-<div class="slideshow-container">
-    <div class="main-image" id="mainImageContainer">
-        <img id="mainImage" src="{main_image}" alt="Main Image">
-    </div>
-    <div class="thumbnails" id="thumbnails">
-        {''.join([f'<img src="{url}" onclick="showImage(this)" alt="Thumbnail">' for url in image_urls])}
-    </div>
-</div>
+# Images first, while the content is still markdown whose blank lines separate the paragraphs
+PINTEREST_STEPS = (article_stats, format_pinterest_article, markdown_to_html, render_pinterest_article)
 
-<script>
-    function showImage(elem) {{
-        document.getElementById("mainImage").src = elem.src;
-    }}
-</script>
+def render_pinterest_articles(records, postprocess_workers=DEFAULT_PROCESS_WORKERS, **options):
+    """Turn generate_article output into Pinterest pages on postprocess_workers processes
 
-</body>
-</html>
-"""
-    return html_output
+    records are {"title", "content", "image_html"} dicts; options are the
+    steps' options by step name, e.g. {"render_pinterest_article":
+    {"mirrored": ...}}. Returns a (record, error) pair per record, in order.
+    """
+    with PostProcessor(postprocess_workers) as processor:
+        return processor.run(PINTEREST_STEPS, records, options)